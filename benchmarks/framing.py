@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+# Micro-benchmark of the framing layer
+# Compares the buffer-based framing with the old implementation
+# on multi-megabyte frames, sent through a socket pair
+import socket
+import struct
+import threading
+import time
+import minestorm.common
+
+def legacy_send_packet(conn, content):
+    """ Old send_packet, which re-slices the content on every partial send """
+    sended = 0
+    while sended < len(content):
+        sended_now = conn.send(content[sended:])
+        if sended_now == 0:
+            raise RuntimeError('Broken socket!')
+        sended += sended_now
+
+def legacy_receive_packet(conn, length):
+    """ Old receive_packet, which concatenates 4096 bytes chunks """
+    result = b''
+    while len(result) < length:
+        chunk_length = min( length-len(result), 4096 )
+        chunk = conn.recv( chunk_length )
+        if chunk == b'':
+            raise RuntimeError('Broken socket!')
+        result += chunk
+    return result
+
+def legacy_send_frame(conn, payload):
+    """ Old framing: header and payload sent separately """
+    legacy_send_packet(conn, struct.pack('I', len(payload)))
+    legacy_send_packet(conn, payload)
+
+def legacy_receive_frame(conn):
+    """ Old framing: receive the header, then the payload """
+    length = struct.unpack('I', legacy_receive_packet(conn, 4))[0]
+    return legacy_receive_packet(conn, length)
+
+def measure(send, receive, payload, rounds):
+    """ Measure the time needed to send and receive a frame multiple times """
+    a, b = socket.socketpair()
+    def sender():
+        for i in range(rounds):
+            send(a, payload)
+    thread = threading.Thread(target=sender)
+    start = time.perf_counter()
+    thread.start()
+    for i in range(rounds):
+        received = receive(b)
+    thread.join()
+    elapsed = time.perf_counter() - start
+    assert len(received) == len(payload)
+    a.close()
+    b.close()
+    return elapsed / rounds
+
+def main():
+    print('Size'.ljust(10), 'Legacy'.ljust(12), 'Buffered'.ljust(12), 'Speedup', sep='')
+    print('-'*42)
+    for megabytes in (1, 4, 16):
+        payload = b'x' * (megabytes * 1024 * 1024)
+        rounds = max( 2, 32 // megabytes )
+        legacy = measure(legacy_send_frame, legacy_receive_frame, payload, rounds)
+        buffered = measure(minestorm.common.send_frame, minestorm.common.receive_frame, payload, rounds)
+        print('{}MB'.format(megabytes).ljust(10), '{:.2f}ms'.format(legacy*1000).ljust(12),
+              '{:.2f}ms'.format(buffered*1000).ljust(12), '{:.1f}x'.format(legacy/buffered), sep='')
+
+if __name__ == '__main__':
+    main()
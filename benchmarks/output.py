@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+# Micro-benchmark of the output ingestion
+# Compares the chunked reads of the OutputWatcher with the old
+# byte by byte implementation, on the output sent through a pipe
+import os
+import threading
+import time
+import minestorm.server.servers
+
+LINE = b'[12:34:56] [Server thread/INFO]: <Player> a chat message from a busy server\n'
+
+def legacy_ingest(pipe, on_line):
+    """ Old OutputWatcher loop, which reads and decodes a byte at time """
+    line = ''
+    while True:
+        char = pipe.read(1)
+        char = char.decode('utf-8')
+        if char == '':
+            break
+        elif char == '\n':
+            on_line(line)
+            line = ''
+        else:
+            line += char
+
+def chunked_ingest(pipe, on_lines):
+    """ New OutputWatcher loop, which reads big chunks of output """
+    splitter = minestorm.server.servers.LineSplitter()
+    while True:
+        data = pipe.read1(65536)
+        if data == b'':
+            break
+        lines = splitter.feed(data)
+        if lines:
+            on_lines(lines)
+
+def measure(ingest, payload):
+    """ Measure the time needed to ingest the payload, returning it with the lines count """
+    read_fd, write_fd = os.pipe()
+    pipe = os.fdopen(read_fd, 'rb') # Buffered like the pipes of subprocess
+    def writer():
+        with os.fdopen(write_fd, 'wb') as f:
+            f.write(payload)
+    lines = []
+    thread = threading.Thread(target=writer)
+    start = time.perf_counter()
+    thread.start()
+    if ingest is legacy_ingest:
+        ingest(pipe, lines.append)
+    else:
+        ingest(pipe, lines.extend)
+    elapsed = time.perf_counter() - start
+    thread.join()
+    pipe.close()
+    return elapsed, len(lines)
+
+def main():
+    print('Size'.ljust(10), 'Legacy'.ljust(12), 'Chunked'.ljust(12), 'Speedup', sep='')
+    print('-'*42)
+    for megabytes in (1, 4, 16):
+        payload = LINE * ( megabytes * 1024 * 1024 // len(LINE) )
+        legacy, legacy_lines = measure(legacy_ingest, payload)
+        chunked, chunked_lines = measure(chunked_ingest, payload)
+        assert legacy_lines == chunked_lines
+        print('{}MB'.format(megabytes).ljust(10), '{:.1f}MB/s'.format(megabytes/legacy).ljust(12),
+              '{:.1f}MB/s'.format(megabytes/chunked).ljust(12), '{:.1f}x'.format(legacy/chunked), sep='')
+
+if __name__ == '__main__':
+    main()
@@ -13,6 +13,8 @@ import minestorm.server.networking
 import minestorm.server.requests
 import minestorm.server.servers
 import minestorm.server.sessions
+import minestorm.server.jobs
+import minestorm.server.parsing
 
 class BaseBooter:
     """
@@ -123,6 +125,9 @@ class CliBooter( BaseBooter ):
         manager.register( minestorm.cli.CommandCommand() )
         manager.register( minestorm.cli.ConsoleCommand() )
         manager.register( minestorm.cli.StatusCommand() )
+        manager.register( minestorm.cli.LogsCommand() )
+        manager.register( minestorm.cli.GrepCommand() )
+        manager.register( minestorm.cli.StartupsCommand() )
         manager.register( minestorm.cli.TestCommand() )
         manager.register( minestorm.cli.ConfigureCommand() )
 
@@ -152,11 +157,25 @@ class ServerBooter( BaseBooter ):
         """ Boot the networking """
         # Create events
         minestorm.get('events').create('server.networking.request_received')
-        # Boot the networking
-        manager = minestorm.server.networking.Listener()
+        # Boot the networking, using the engine choosen in the configuration
+        engine = minestorm.get('configuration').get('networking.engine', 'threads')
+        if engine == 'asyncio':
+            manager = minestorm.server.networking.AsyncListener()
+        elif engine == 'threads':
+            manager = minestorm.server.networking.Listener()
+        else:
+            raise RuntimeError('Invalid networking engine: {0}'.format(engine))
         minestorm.bind('server.networking', manager)
         # Bind the console port
         manager.bind( minestorm.get('configuration').get('networking.port') )
+        # Bind the Unix socket used by local clients, if enabled
+        path = minestorm.get('configuration').get('networking.unix_socket.path', '')
+        if path:
+            mode = int( str(minestorm.get('configuration').get('networking.unix_socket.mode', '660')), 8 )
+            try:
+                manager.bind_unix(path, mode)
+            except ( OSError, RuntimeError ) as e:
+                logging.getLogger('minestorm.networking').error('Unable to bind the Unix socket {0}: {1!s}'.format(path, e))
 
     def boot_3_requests(self):
         """ Boot the requests parser """
@@ -180,12 +199,22 @@ class ServerBooter( BaseBooter ):
         manager.register( minestorm.server.requests.CommandProcessor() )
         manager.register( minestorm.server.requests.StatusProcessor() )
         manager.register( minestorm.server.requests.RetrieveLinesProcessor() )
+        manager.register( minestorm.server.requests.StatsProcessor() )
+        manager.register( minestorm.server.requests.BatchProcessor() )
+        manager.register( minestorm.server.requests.SubscribeLinesProcessor() )
+        manager.register( minestorm.server.requests.SearchLinesProcessor() )
+        manager.register( minestorm.server.requests.JobStatusProcessor() )
+        manager.register( minestorm.server.requests.WaitProcessor() )
+        manager.register( minestorm.server.requests.MetricsHistoryProcessor() )
+        manager.register( minestorm.server.requests.StartupHistoryProcessor() )
         # Listen for events
         listener = lambda event: manager.sort(event.data['request'])
         minestorm.get('events').listen('server.networking.request_received', listener, 100)
 
     def boot_4_servers(self):
         """ Boot the servers manager """
+        # Create events triggered for recognized output lines
+        minestorm.server.parsing.create_events()
         manager = minestorm.server.servers.ServersManager()
         minestorm.bind('server.servers', manager)
         # Register all servers
@@ -197,7 +226,12 @@ class ServerBooter( BaseBooter ):
         manager = minestorm.server.sessions.SessionsManager()
         minestorm.bind('server.sessions', manager)
 
-    def boot_6_manager(self):
+    def boot_6_jobs(self):
+        """ Boot the background jobs manager """
+        manager = minestorm.server.jobs.JobsManager()
+        minestorm.bind('server.jobs', manager)
+
+    def boot_7_manager(self):
         """ Boot the server manager """
         manager = minestorm.server.MinestormServer()
         minestorm.bind('server', manager)
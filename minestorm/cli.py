@@ -3,16 +3,15 @@ from argparse import ArgumentParser
 import sys
 import curses
 import socket
-import json
 import time
 import datetime
-import struct
 import shutil
 import os
 import pkg_resources
 import minestorm
 import minestorm.common.resources
 import minestorm.common
+import minestorm.common.networking
 import minestorm.console
 import minestorm.test
 
@@ -59,6 +58,7 @@ class CommandsManager( minestorm.common.resources.ResourceWrapper ):
 class Command:
     name = '__base__'
     description = 'a command'
+    _client = None
 
     def __new__(cls, *args, **kwargs):
         # Overwrite the class creator to deny
@@ -78,28 +78,32 @@ class Command:
 
     def request(self, data):
         """ Make a request to the server """
+        # Create the client the first time it's needed
+        if self._client is None:
+            self._client = minestorm.common.networking.client()
         try:
-            # Create a new socket
-            s = socket.socket()
-            s.connect(( socket.gethostname(), minestorm.get('configuration').get('networking.port') ))
-            # Prepare data
-            to_send = json.dumps(data).encode('utf-8')
-            length = struct.pack('I', len(to_send))
-            # Send the request
-            minestorm.common.send_packet(s, length)
-            minestorm.common.send_packet(s, to_send)
-            # Receive response
-            length = struct.unpack('I', minestorm.common.receive_packet( s, 4 ))[0]
-            raw = minestorm.common.receive_packet( s, length )
-            # Load the response
-            response = json.loads(raw.decode('utf-8'))
-            # Shutdown the socket
-            s.shutdown(socket.SHUT_RD)
-            s.close()
-            return response
+            return self._client.request(data)
         except socket.error:
             return
 
+    def wait_job(self, sid, job):
+        """ Wait for a background job to finish, returning its details """
+        while True:
+            request = self.request({ 'status': 'wait', 'job': job, 'sid': sid })
+            if not request or request['status'] != 'job_status_response':
+                return
+            if request['job']['status'] in ('DONE', 'FAILED'):
+                return request['job']
+
+    def show_timings(self, job):
+        """ Show the outcome of a job which started or stopped all servers """
+        if job['status'] == 'FAILED':
+            print('Error: {}'.format(job['error']), file=sys.stderr)
+            exit(1)
+        for name, details in sorted(job['result']['servers'].items()):
+            print(name.ljust(15), details['result'].ljust(12), '{:.1f}s'.format(details['seconds']), sep="")
+        print('Total time: {:.1f}s'.format(job['result']['seconds']))
+
 class ExecuteCommand(Command):
     """
     Command which execute minestorm server
@@ -190,16 +194,26 @@ class StartAllCommand(Command):
     name = 'start-all'
     description = 'start all servers'
 
+    def boot(self, parser):
+        parser.add_argument('-w', '--wait', help='wait for all servers to be ready', action='store_true')
+
     def run(self, args):
         # Try to get a session id
         sid_request = self.request({ 'status': 'new_session' })
         # If the server is online
         if sid_request:
             # Try to start all servers
-            request = self.request({ 'status': 'start_all_servers', 'sid': sid_request['sid'] })
+            request = self.request({ 'status': 'start_all_servers', 'background': args.wait, 'sid': sid_request['sid'] })
             if request['status'] == 'failed':
                 print('Error: {}'.format(request['reason']), file=sys.stderr)
                 exit(1)
+            # Wait for servers to be ready if requested
+            if args.wait:
+                job = self.wait_job(sid_request['sid'], request['job'])
+                if job is None:
+                    print('Error: can\'t reach the server', file=sys.stderr)
+                    exit(1)
+                self.show_timings(job)
         else:
             print('Error: can\'t reach the server', file=sys.stderr)
             exit(1)
@@ -213,6 +227,7 @@ class StopAllCommand(Command):
 
     def boot(self, parser):
         parser.add_argument('-m', '--message', help='message you want to display on stop', default=None)
+        parser.add_argument('-w', '--wait', help='wait for all servers to exit', action='store_true')
 
     def run(self, args):
         # Try to get a session id
@@ -220,10 +235,17 @@ class StopAllCommand(Command):
         # If the server is online
         if sid_request:
             # Try to stop all servers
-            request = self.request({ 'status': 'stop_all_servers', 'message': args.message, 'sid': sid_request['sid'] })
+            request = self.request({ 'status': 'stop_all_servers', 'message': args.message, 'background': args.wait, 'sid': sid_request['sid'] })
             if request['status'] == 'failed':
                 print('Error: {}'.format(request['reason']), file=sys.stderr)
                 exit(1)
+            # Wait for servers to exit if requested
+            if args.wait:
+                job = self.wait_job(sid_request['sid'], request['job'])
+                if job is None:
+                    print('Error: can\'t reach the server', file=sys.stderr)
+                    exit(1)
+                self.show_timings(job)
         else:
             print('Error: can\'t reach the server', file=sys.stderr)
             exit(1)
@@ -250,9 +272,10 @@ class CommandCommand(Command):
             if servers is None:
                 status = self.request({ 'status': 'status', 'sid': sid_request['sid'] })
                 servers = list(status['servers'].keys()) # Get servers list
-            # Send the command to specified servers
-            for server in servers:
-                response = self.request({ 'status': 'command', 'server': server, 'command': args.command, 'sid': sid_request['sid'] })
+            # Send the command to specified servers, all in a single batch
+            requests = [ { 'status': 'command', 'server': server, 'command': args.command } for server in servers ]
+            batch = self.request({ 'status': 'batch', 'requests': requests, 'sid': sid_request['sid'] })
+            for server, response in zip(servers, batch['responses']):
                 if response['status'] == 'failed':
                     print('Error on {}: {}'.format(server, response['reason']), file=sys.stderr)
         else:
@@ -272,7 +295,7 @@ class StatusCommand(Command):
         if sid_request:
             status = self.request({ 'status': 'status', 'sid': sid_request['sid'] })
             # Display the header
-            print('Name'.ljust(15), 'Status'.ljust(10), 'Started at'.ljust(16), 'RAM'.ljust(8), 'Uptime', sep="")
+            print('Name'.ljust(15), 'Status'.ljust(10), 'Started at'.ljust(16), 'RAM'.ljust(8), 'RSS'.ljust(10), 'CPU'.ljust(8), 'Uptime', sep="")
             print('-'*79)
             # Display informations about servers
             for name, details in status['servers'].items():
@@ -281,15 +304,167 @@ class StatusCommand(Command):
                 # If the server is running display more informations about it
                 if details['status'] in ('STARTING', 'STARTED', 'STOPPING'):
                     started_at = time.strftime("%D %H:%M", time.localtime(details['started_at'])) # Prepare started at
-                    ram = str( round(details['ram_used'], 2) )+'%'
+                    # Resources usage is available only after the first sample
+                    ram = str( round(details['ram_used'], 2) )+'%' if details['ram_used'] is not None else '-'
+                    rss = str( round(details['rss'] / 1048576, 1) )+'M' if details.get('rss') is not None else '-'
+                    cpu = str( round(details['cpu'], 1) )+'%' if details.get('cpu') is not None else '-'
                     uptime = datetime.timedelta(seconds=details['uptime'])
                 else:
-                    started_at, ram, uptime = '-', '-', '-'
+                    started_at, ram, rss, cpu, uptime = '-', '-', '-', '-', '-'
                 # Display informations
-                print(name.ljust(15), status.ljust(10), started_at.ljust(16), ram.ljust(8), uptime, sep="")
+                print(name.ljust(15), status.ljust(10), started_at.ljust(16), ram.ljust(8), rss.ljust(10), cpu.ljust(8), uptime, sep="")
         else:
             print('Minestorm is currently stopped')
 
+class LogsCommand(Command):
+    """
+    Command which show the output of a server
+    """
+    name = 'logs'
+    description = 'show the output of a server'
+
+    def boot(self, parser):
+        parser.add_argument('server', help='choose which server output show')
+        parser.add_argument('-f', '--follow', help='continue showing new lines', action='store_true', default=False)
+        parser.add_argument('-n', '--lines', help='number of old lines to show', type=int, default=10, metavar='N')
+
+    def run(self, args):
+        # Try to get a session id
+        sid_request = self.request({ 'status': 'new_session' })
+        # If the server is online
+        if sid_request:
+            if args.follow:
+                self._follow(args, sid_request['sid'])
+            else:
+                self._show(args, sid_request['sid'])
+        else:
+            print('Error: can\'t reach the server', file=sys.stderr)
+            exit(1)
+
+    def _show(self, args, sid):
+        """ Show old lines, receiving them in chunks """
+        if self._client is None:
+            self._client = minestorm.common.networking.client()
+        try:
+            for chunk in self._client.request_chunks({ 'status': 'retrieve_lines', 'server': args.server, 'start': -args.lines, 'stop': -1, 'chunked': True, 'compact': True, 'sid': sid }):
+                # Lines are already in order, but old backends send dicts
+                if 'base' in chunk:
+                    lines = chunk['lines']
+                else:
+                    lines = [ line for index, line in sorted(chunk.items(), key=lambda item: int(item[0])) ]
+                for line in lines:
+                    print(line)
+        except RuntimeError as e:
+            print('Error: {}'.format(e), file=sys.stderr)
+            exit(1)
+        except socket.error:
+            print('Error: connection with the server lost', file=sys.stderr)
+            exit(1)
+
+    def _follow(self, args, sid):
+        """ Show lines as soon as they're printed """
+        if self._client is None:
+            self._client = minestorm.common.networking.client()
+        start = -args.lines if args.lines > 0 else None
+        try:
+            for message in self._client.stream({ 'status': 'subscribe_lines', 'server': args.server, 'start': start, 'sid': sid }):
+                if message['status'] == 'line':
+                    print(message['line'], flush=True)
+                # The daemon ended the subscription
+                elif message['status'] == 'unsubscribed':
+                    break
+                elif message['status'] == 'failed':
+                    print('Error: {}'.format(message['reason']), file=sys.stderr)
+                    exit(1)
+        except ( socket.error, RuntimeError ):
+            print('Error: connection with the server lost', file=sys.stderr)
+            exit(1)
+
+class GrepCommand(Command):
+    """
+    Command which search the output of a server
+    """
+    name = 'grep'
+    description = 'search the output of a server'
+
+    def boot(self, parser):
+        parser.add_argument('server', help='choose which server output search')
+        parser.add_argument('query', help='the text you want to search')
+        parser.add_argument('-E', '--regex', help='interpret the query as a regex', action='store_true', default=False)
+        parser.add_argument('-i', '--ignore-case', help='ignore case distinctions', action='store_true', default=False, dest='ignore_case')
+        parser.add_argument('-n', '--line-number', help='show the index of each line', action='store_true', default=False, dest='line_number')
+        parser.add_argument('-m', '--max-count', help='show at most N lines', type=int, default=100, metavar='N', dest='max_count')
+        parser.add_argument('-s', '--since', help='search only lines printed in the last N minutes', type=float, default=None, metavar='N')
+
+    def run(self, args):
+        # Try to get a session id
+        sid_request = self.request({ 'status': 'new_session' })
+        # If the server is online
+        if sid_request:
+            since = time.time() - args.since*60 if args.since is not None else None
+            request = self.request({ 'status': 'search_lines', 'server': args.server, 'query': args.query, 'regex': args.regex,
+                                     'ignore_case': args.ignore_case, 'limit': args.max_count, 'since': since, 'sid': sid_request['sid'] })
+            if request['status'] == 'failed':
+                print('Error: {}'.format(request['reason']), file=sys.stderr)
+                exit(1)
+            for match in request['matches']:
+                if args.line_number:
+                    print('{}:{}'.format(match['index'], match['line']))
+                else:
+                    print(match['line'])
+            # Exit with an error if nothing was found, like grep
+            if not request['matches']:
+                exit(1)
+        else:
+            print('Error: can\'t reach the server', file=sys.stderr)
+            exit(2)
+
+class StartupsCommand(Command):
+    """
+    Command which shows the last starts of a server
+    """
+    name = 'startups'
+    description = 'see how long the last starts of a server took'
+
+    def boot(self, parser):
+        parser.add_argument('server', help='choose which server starts show')
+        parser.add_argument('-n', '--number', help='show the last N starts', type=int, default=20, metavar='N')
+
+    def run(self, args):
+        # Try to get a session id
+        sid_request = self.request({ 'status': 'new_session' })
+        # If the server is online
+        if sid_request:
+            request = self.request({ 'status': 'startup_history', 'server': args.server, 'limit': args.number, 'sid': sid_request['sid'] })
+            if request['status'] == 'failed':
+                print('Error: {}'.format(request['reason']), file=sys.stderr)
+                exit(1)
+            # Display the header
+            print('Started at'.ljust(16), 'Result'.ljust(10), 'Time'.ljust(10), 'Reported'.ljust(10), 'CDS', sep="")
+            print('-'*79)
+            for start in request['starts']:
+                started_at = datetime.datetime.fromtimestamp(start['started_at']).strftime('%x %H:%M')
+                reported = '{:.1f}s'.format(start['reported']) if start['reported'] is not None else '-'
+                print(started_at.ljust(16), start['result'].ljust(10), '{:.1f}s'.format(start['seconds']).ljust(10), reported.ljust(10), start.get('cds') or '-', sep="")
+            # Display the summary of the successful starts
+            summary = request['summary']
+            if summary['count']:
+                print()
+                print('Average {:.1f}s, best {:.1f}s, worst {:.1f}s over {} starts'.format(summary['average'], summary['best'], summary['worst'], summary['count']))
+            # Compare the starts using the class data archive with the other ones
+            cds = request.get('cds', {})
+            if cds.get('archive', {}).get('count'):
+                for mode in ( 'archive', 'training', 'off' ):
+                    if cds.get(mode, {}).get('count'):
+                        print('  {}: average {:.1f}s over {} starts'.format(mode.ljust(8), cds[mode]['average'], cds[mode]['count']))
+                without = [ cds[mode] for mode in ( 'training', 'off' ) if cds.get(mode, {}).get('count') ]
+                if without:
+                    average = sum( group['average'] * group['count'] for group in without ) / sum( group['count'] for group in without )
+                    print('The class data archive saves {:.1f}s per start ({:.0%})'.format(average - cds['archive']['average'], 1 - cds['archive']['average'] / average))
+        else:
+            print('Error: can\'t reach the server', file=sys.stderr)
+            exit(1)
+
 class TestCommand(Command):
     """
     Command which run unit tests
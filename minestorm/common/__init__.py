@@ -1,6 +1,8 @@
 #!/usr/bin/python3
 # This package contains classes and functions used by all the
 # minestorm project
+import struct
+import zlib
 
 class BaseManager:
     """
@@ -63,25 +65,80 @@ class BaseManager:
 
 def send_packet(conn, content):
     """ Send a packet """
+    # Use a memoryview to avoid copying the content on partial sends
+    view = memoryview(content)
     sended = 0
-    while sended < len(content):
-        sended_now = conn.send(content[sended:])
+    while sended < len(view):
+        sended_now = conn.send(view[sended:])
         if sended_now == 0:
             raise RuntimeError('Broken socket!')
         sended += sended_now
 
 def receive_packet(conn, length):
     """ Receive a single packet """
-    result = b''
-    # Read the packet until the length of the received packet
-    # is greater than the wanted length
-    while len(result) < length:
-        # Max chunk length is 4096
-        chunk_length = min( length-len(result), 4096 )
-        chunk = conn.recv( chunk_length ) # Receive the chunk
-        if chunk == b'':
+    # Receive the packet directly into a preallocated buffer
+    result = bytearray(length)
+    view = memoryview(result)
+    received = 0
+    while received < length:
+        received_now = conn.recv_into( view[received:] )
+        if received_now == 0:
             raise RuntimeError('Broken socket!')
-        result += chunk
+        received += received_now
+    return result
+
+# The highest bit of the frame header marks zlib compressed payloads
+COMPRESSED_FLAG = 0x80000000
+
+def pack_header(length, compressed=False):
+    """ Build the header of a frame """
+    if compressed:
+        length |= COMPRESSED_FLAG
+    return struct.pack('I', length)
+
+def unpack_header(header):
+    """ Parse the header of a frame, returning the length and the compressed flag """
+    length = struct.unpack('I', header)[0]
+    return length & ~COMPRESSED_FLAG, bool(length & COMPRESSED_FLAG)
+
+def send_frame(conn, payload, compressed=False):
+    """ Send a frame, made by the payload length and the payload """
+    header = pack_header(len(payload), compressed)
+    # Send header and payload with a single gathered write if possible
+    if hasattr(conn, 'sendmsg'):
+        sended = conn.sendmsg([header, payload])
+        if sended == 0:
+            raise RuntimeError('Broken socket!')
+        # Send what's left after a partial write
+        if sended < len(header):
+            send_packet(conn, header[sended:])
+            sended = len(header)
+        send_packet(conn, memoryview(payload)[sended-len(header):])
+    else:
+        send_packet(conn, header)
+        send_packet(conn, payload)
+
+def receive_frame(conn, max_length=None):
+    """ Receive a frame, returning its payload """
+    length, compressed = unpack_header( receive_packet(conn, 4) )
+    # Reject hostile lengths before allocating anything
+    if max_length is not None and length > max_length:
+        raise RuntimeError('Frame too large: {} bytes'.format(length))
+    payload = receive_packet(conn, length)
+    # Transparently decompress the payload
+    if compressed:
+        payload = decompress(payload, max_length)
+    return payload
+
+def decompress(payload, max_length=None):
+    """ Decompress a payload, without exceeding the max length """
+    if max_length is None:
+        return zlib.decompress(payload)
+    decompressor = zlib.decompressobj()
+    result = decompressor.decompress(payload, max_length)
+    # If something is left the payload was too large
+    if decompressor.unconsumed_tail:
+        raise RuntimeError('Frame too large: more than {} bytes'.format(max_length))
     return result
 
 def seconds_to_string(seconds, days_suffix='d', hours_suffix='h', minutes_suffix='m', seconds_suffix='s'):
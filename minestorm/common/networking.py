@@ -0,0 +1,251 @@
+#!/usr/bin/python3
+import os
+import stat
+import socket
+import select
+import threading
+import itertools
+import json
+import zlib
+import minestorm
+import minestorm.common
+
+class Client:
+    """
+    Client of the minestorm server, which opens
+    a new connection for each request
+    """
+
+    def __init__(self, address, compression=False):
+        self.address = address
+        self.compression = compression
+
+    def request(self, data):
+        """ Make a new request to the server and return the response """
+        s = _connect(self.address)
+        # Send the request
+        _send(s, self._prepare(data))
+        # Receive the response
+        response = _receive(s)
+        # Shutdown the socket, which may be already closed by the server
+        try:
+            s.shutdown(socket.SHUT_RD)
+        except socket.error:
+            pass
+        s.close()
+        return response
+
+    def stream(self, data, poll_every=1):
+        """ Make a streaming request, yielding all the received messages """
+        # Streams always need their own connection
+        s = _connect(self.address)
+        try:
+            _send(s, self._prepare(data))
+            while not minestorm.shutdowned:
+                # Wait for a new message, checking from time to time
+                # if minestorm is shutting down
+                readable = select.select([s], [], [], poll_every)[0]
+                if readable:
+                    yield _receive(s)
+        finally:
+            s.close()
+
+    def request_chunks(self, data):
+        """ Make a request with a chunked response, yielding every chunk """
+        for message in self.stream(data):
+            if message['status'] == 'chunk':
+                yield message['data']
+            # The terminator frame was received
+            elif message['status'] == 'chunks_end':
+                return
+            # Something went wrong, and a normal response was sent
+            else:
+                raise RuntimeError(message.get('reason', 'Unexpected response: {}'.format(message['status'])))
+
+    def close(self):
+        """ Close the client """
+        pass
+
+    def _prepare(self, data):
+        """ Prepare a request before sending it """
+        # Tell the server compressed responses are supported
+        if self.compression:
+            data = data.copy()
+            data['compression'] = ['zlib']
+        return data
+
+class MultiplexedClient(Client):
+    """
+    Client of the minestorm server, which sends all the requests
+    through a single persistent connection
+
+    Each request is tagged with an id, so responses can be received
+    out of order and requests can be made from multiple threads
+    """
+
+    def __init__(self, address, compression=False):
+        super(MultiplexedClient, self).__init__(address, compression)
+        self.socket = None
+        self.reader = None
+        self._pending = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+
+    def request(self, data, timeout=None):
+        """ Make a new request to the server and return the response """
+        pending = PendingResponse()
+        with self._lock:
+            # Connect to the server if needed
+            if self.socket is None:
+                self._connect()
+            request_id = next(self._ids)
+            self._pending[request_id] = pending
+            sock = self.socket
+        # Tag the request with its id and send it
+        data = self._prepare(data)
+        data['request_id'] = request_id
+        try:
+            with self._send_lock:
+                _send(sock, data)
+        except ( socket.error, RuntimeError ):
+            self._disconnect(sock)
+            raise socket.error('Broken connection')
+        # Wait for the response
+        return pending.wait(timeout)
+
+    def close(self):
+        """ Close the persistent connection """
+        with self._lock:
+            sock = self.socket
+        if sock is not None:
+            self._disconnect(sock)
+
+    def _connect(self):
+        """ Open the persistent connection, must be called with the lock held """
+        self.socket = _connect(self.address)
+        # Start the thread which will receive the responses
+        self.reader = MultiplexedReaderThread(self, self.socket)
+        self.reader.start()
+
+    def _disconnect(self, sock):
+        """ Close a connection and fail its pending requests """
+        with self._lock:
+            # Don't touch a newer connection
+            if self.socket is not sock:
+                return
+            self.socket = None
+            self.reader = None
+            pending, self._pending = self._pending, {}
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        sock.close()
+        # Wake up everyone waiting for a response
+        for response in pending.values():
+            response.fail()
+
+    def _on_response(self, response):
+        """ Method called by the reader thread when a response is received """
+        with self._lock:
+            pending = self._pending.pop(response.pop('request_id', None), None)
+        # Ignore responses no one is waiting for
+        if pending is not None:
+            pending.resolve(response)
+
+class PendingResponse:
+    """
+    A response which wasn't received yet
+    """
+
+    def __init__(self):
+        self.response = None
+        self.failed = False
+        self._event = threading.Event()
+
+    def resolve(self, response):
+        """ Set the received response """
+        self.response = response
+        self._event.set()
+
+    def fail(self):
+        """ Mark the response as lost """
+        self.failed = True
+        self._event.set()
+
+    def wait(self, timeout=None):
+        """ Wait for the response """
+        if not self._event.wait(timeout):
+            raise socket.timeout('No response received')
+        if self.failed:
+            raise socket.error('Broken connection')
+        return self.response
+
+class MultiplexedReaderThread(threading.Thread):
+    """
+    This thread receives the responses from a persistent
+    connection and pass them to the client
+    """
+
+    def __init__(self, client, sock):
+        super(MultiplexedReaderThread, self).__init__()
+        self.daemon = True # Don't prevent the program from exiting
+        self.client = client
+        self.socket = sock
+
+    def run(self):
+        while True:
+            try:
+                response = _receive(self.socket)
+            except ( socket.error, RuntimeError, ValueError, zlib.error ):
+                self.client._disconnect(self.socket)
+                break
+            self.client._on_response(response)
+
+def client(address=None):
+    """ Create a client using the configuration """
+    configuration = minestorm.get('configuration')
+    # Use the local server if no address is provided, preferring
+    # its Unix socket if available
+    if address is None:
+        path = os.path.expanduser( configuration.get('networking.unix_socket.path', '') )
+        # Don't trust sockets created by other users, which could
+        # impersonate the daemon
+        if path and is_own_socket(path):
+            address = path
+        else:
+            address = ( socket.gethostname(), configuration.get('networking.port') )
+    compression = configuration.get('networking.compression.enabled', False)
+    # Persistent connections must be enabled
+    if configuration.get('networking.persistent_connections', False):
+        return MultiplexedClient(address, compression)
+    else:
+        return Client(address, compression)
+
+def is_own_socket(path):
+    """ Check if a path is a Unix socket owned by the current user """
+    try:
+        info = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISSOCK(info.st_mode) and info.st_uid == os.getuid()
+
+def _connect(address):
+    """ Connect to an address, which is a path for Unix sockets """
+    if isinstance(address, str):
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    else:
+        s = socket.socket()
+    s.connect(address)
+    return s
+
+def _send(conn, data):
+    """ Send a request """
+    minestorm.common.send_frame(conn, json.dumps(data).encode('utf-8'))
+
+def _receive(conn):
+    """ Receive a response """
+    max_length = int( minestorm.get('configuration').get('networking.max_frame_size', 16777216) )
+    raw = minestorm.common.receive_frame(conn, max_length)
+    return json.loads(raw.decode('utf-8'))
@@ -1,5 +1,4 @@
 #!/usr/bin/python3
-import socket
 import curses
 import minestorm
 import minestorm.console.networking
@@ -23,7 +22,7 @@ class MinestormConsole:
         """ Initialize the networking """
         # Create the session
         networking = minestorm.console.networking.Session()
-        networking.connect(socket.gethostname(), 45342)
+        networking.connect() # Connect to the local server
         # Bind all things
         minestorm.bind("console.networking", networking)
 
@@ -1,11 +1,6 @@
 #!/usr/bin/python3
-import socket
-import threading
-import json
-import time
-import struct
 import minestorm
-import minestorm.common
+import minestorm.common.networking
 
 class Session:
     """
@@ -15,33 +10,21 @@ class Session:
     def __init__(self):
         self.sid = None
         self.addr = None
+        self.client = None
 
-    def connect(self, ip, port):
-        """ Connect to a minestorm server """
-        self.addr = (ip, port) # Define socket connection pair
+    def connect(self, ip=None, port=None):
+        """ Connect to a minestorm server, by default the local one """
+        # Define socket connection pair, if provided
+        if ip is not None:
+            self.addr = (ip, port)
+        self.client = minestorm.common.networking.client(self.addr)
+        self.addr = self.client.address
         self.refresh_sid() # Get a new sid
 
     def request(self, data):
         """ Make a new request to the server and return the response """
-        if self.addr:
-            # Create a new socket
-            s = socket.socket()
-            s.connect(self.addr)
-            # Prepare data
-            to_send = json.dumps(data).encode('utf-8')
-            length = struct.pack('I', len(to_send))
-            # Send the request
-            minestorm.common.send_packet(s, length)
-            minestorm.common.send_packet(s, to_send)
-            # Receive response
-            length = struct.unpack('I', minestorm.common.receive_packet( s, 4 ))[0]
-            raw = minestorm.common.receive_packet( s, length )
-            # Load the response
-            response = json.loads(raw.decode('utf-8'))
-            # Shutdown the socket
-            s.shutdown(socket.SHUT_RD)
-            s.close()
-            return response
+        if self.client:
+            return self.client.request(data)
         else:
             raise RuntimeError('You first need to connect')
 
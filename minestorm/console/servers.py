@@ -41,6 +41,29 @@ class ServersManager:
             for server in diff:
                 del self._servers[name]
 
+    def retrieve_last_lines(self):
+        """ Retrieve last lines of all servers, in a single batch """
+        servers, requests = [], []
+        for server in self._servers.values():
+            try:
+                requests.append( server.last_lines_request() )
+            except SyncError:
+                continue
+            servers.append(server)
+        # Don't bother the backend if no server is running
+        if not requests:
+            return
+        networking = minestorm.get('console.networking')
+        response = networking.request({ 'status': 'batch', 'requests': requests, 'sid': networking.sid })
+        if response['status'] != 'batch_response':
+            raise SyncError('Unable to retrieve lines')
+        # Store the lines of each server
+        for server, lines in zip(servers, response['responses']):
+            try:
+                server.store_lines(lines)
+            except SyncError:
+                pass
+
     def all(self):
         """ Return all servers loaded """
         return self._servers.copy()
@@ -57,10 +80,11 @@ class Server:
     """
     Representation of a remote server
     """
+    gap_marker = '[... {} lines not received ...]' # Line shown in place of the missed lines
 
     def __init__(self, name):
         self.name = name
-        self._lines = {}
+        self._lines = []
         self._last_line_identifier = -1
         self._informations = {}
 
@@ -84,44 +108,62 @@ class Server:
 
     def retrieve_lines(self, start, stop):
         """ Retrieve a specified amount of lines """
+        response = minestorm.get('console.networking').request( self.lines_request(start, stop) )
+        self.store_lines(response)
+
+    def retrieve_last_lines(self):
+        """ Retrieve last lines """
+        request = self.last_lines_request()
+        self.store_lines( minestorm.get('console.networking').request(request) )
+
+    def lines_request(self, start, stop):
+        """ Prepare the request which retrieves a specified amount of lines """
         # Raise an error if the server is not running
         if self.status not in ('STARTING', 'STARTED', 'STOPPING'):
             raise SyncError('Unable to retrieve lines when the server is not running!')
-        # Retrieve lines
-        response = minestorm.get('console.networking').request({
-            'status': 'retrieve_lines', 'start': start, 'stop': stop, 'server': self.name, 'sid': minestorm.get('console.networking').sid
-        })
-        # Raise an exception if lines are not provided
-        if response['status'] != 'retrieve_lines_response':
-            raise SyncError('Unable to retrieve lines')
-        # Iterate over lines to check them and add to the lines list
-        for identifier, line in response['lines'].items():
-            identifier = int(identifier) # Convert the identifier to the correct type
-            # First check if the line was already downloaded
-            if identifier in self._lines:
-                continue
-            self._lines[identifier] = line
-            # Update the last line identifier if it greater than the actual one
-            if identifier > self._last_line_identifier:
-                self._last_line_identifier = identifier
+        return { 'status': 'retrieve_lines', 'start': start, 'stop': stop, 'server': self.name, 'compact': True, 'sid': minestorm.get('console.networking').sid }
 
-    def retrieve_last_lines(self):
-        """ Retrieve last lines """
+    def last_lines_request(self):
+        """ Prepare the request which retrieves last lines """
         # If this is the first time lines are retrieved retrieve last 10
         # Else retrieve last ones
         if self._last_line_identifier == -1:
-            self.retrieve_lines(-10, -1)
+            return self.lines_request(-10, -1)
+        else:
+            return self.lines_request(self._last_line_identifier, -1)
+
+    def store_lines(self, response):
+        """ Store the lines contained in a retrieve_lines response """
+        # Raise an exception if lines are not provided
+        if response['status'] != 'retrieve_lines_response':
+            raise SyncError('Unable to retrieve lines')
+        # Lines are received as a list starting from the base identifier,
+        # but old backends send a dict with string identifiers
+        if 'base' in response:
+            base, lines = response['base'], response['lines']
         else:
-            self.retrieve_lines(self._last_line_identifier, -1)
+            identifiers = sorted( int(identifier) for identifier in response['lines'] )
+            base = identifiers[0] if identifiers else 0
+            lines = [ response['lines'][str(identifier)] for identifier in identifiers ]
+        # Lines printed and discarded by the backend between two polls
+        # can't be downloaded anymore, show where they were missed
+        if lines and self._last_line_identifier != -1 and base > self._last_line_identifier + 1:
+            self._lines.append( self.gap_marker.format( base - self._last_line_identifier - 1 ) )
+        # Skip lines already downloaded
+        skip = max( self._last_line_identifier + 1 - base, 0 )
+        if skip < len(lines):
+            self._lines.extend( lines[skip:] )
+            # Update the last line identifier
+            self._last_line_identifier = base + len(lines) - 1
 
     def clear_lines_cache(self):
         """ Clear the lines cache """
-        self._lines = {}
+        self._lines = []
         self._last_line_identifier = -1
 
     def all_lines(self):
-        """ Get all lines from the cache """
-        return self._lines.copy()
+        """ Get all lines from the cache, oldest first """
+        return list(self._lines)
 
 class SyncherThread(threading.Thread):
     """
@@ -136,11 +178,10 @@ class SyncherThread(threading.Thread):
         while not self.stop:
             minestorm.get('console.servers').sync() # Sync the local cache
             # Retrieve last lines
-            for server in minestorm.get('console.servers').all().values():
-                try:
-                    server.retrieve_last_lines()
-                except SyncError:
-                    pass
+            try:
+                minestorm.get('console.servers').retrieve_last_lines()
+            except SyncError:
+                pass
             # Update the UI
             minestorm.get('console.ui').sidebar.update() # Update the sidebar
             minestorm.get('console.ui').stream.update() # Update the stream
@@ -82,7 +82,7 @@ class StreamComponent(BaseComponent):
         """ Update the screen """
         focus = minestorm.get('console.ui').focus
         if focus:
-            lines = list( minestorm.get('console.servers').get( focus ).all_lines().values() )
+            lines = minestorm.get('console.servers').get( focus ).all_lines()
         else:
             lines = []
         self.position = len(lines) # temp fix
@@ -174,7 +174,8 @@ class SidebarComponent(BaseComponent):
         if focus:
             server = minestorm.get("console.servers").get(focus)
             if server.status in ('STARTING', 'STARTED', 'STOPPING'):
-                ram = str(round(server.ram_used, 2))+"%"
+                # Resources usage is available only after the first sample
+                ram = str(round(server.ram_used, 2))+"%" if server.ram_used is not None else "-"
                 uptime = minestorm.common.seconds_to_string(round(server.uptime))
                 boxes = [( "RAM", ram ), ( "Uptime", uptime )]
         line = 1
@@ -17,5 +17,5 @@ class MinestormServer:
         """ Shutdown minestorm server """
         logging.getLogger('minestorm').info('Shutting down minestorm...')
         minestorm.get('server.networking').stop() # Stop the networking and close the port
-        minestorm.get('server.servers').stop_all() # Stop all servers
+        minestorm.get('server.servers').stop_all(wait=True) # Stop all servers, waiting for them to exit
         logging.getLogger('minestorm').info('Waiting for threads shutdown...')
@@ -0,0 +1,133 @@
+#!/usr/bin/python3
+import hashlib
+import glob
+import os
+import shutil
+import subprocess
+import tempfile
+import logging
+
+class ClassDataArchive:
+    """
+    Class data sharing archive of a server jar
+
+    The first start with a new jar is a training run, which dumps
+    the loaded classes in an archive when the JVM exits; the next
+    starts map that archive instead of loading and verifying the
+    classes again. Archives are named after the hash of the jar and
+    of the java binary, so a new jar or JVM is trained again
+    """
+
+    # Modes of a start
+    MODE_TRAINING = 'training'
+    MODE_ARCHIVE = 'archive'
+
+    def __init__(self, directory, jar, java='java'):
+        self.directory = directory
+        self.jar = jar
+        self.java = java
+        self.logger = logging.getLogger('minestorm.servers')
+        self.training = None # Archive being dumped by the current start
+        self._hash_cache = None # Hash of the jar, with its mtime and size
+        self._supported = None # If the JVM supports dumping archives, probed once for every binary
+
+    def java_identity(self):
+        """ Get the resolved path of the java binary, with its mtime and size """
+        path = shutil.which(self.java)
+        if path is None:
+            raise OSError('{} not found'.format(self.java))
+        path = os.path.realpath(path)
+        stat = os.stat(path)
+        return '{0}:{1}:{2}'.format(path, stat.st_mtime_ns, stat.st_size)
+
+    def jar_hash(self, identity):
+        """ Get the hash of the jar, computed again only if it or the JVM changed """
+        stat = os.stat(self.jar)
+        key = ( stat.st_mtime_ns, stat.st_size, identity )
+        if self._hash_cache is None or self._hash_cache[0] != key:
+            digest = hashlib.sha256()
+            # Archives are valid only for the JVM which created them, which
+            # may be replaced by an update keeping the same path
+            digest.update( identity.encode('utf-8') + b'\0' )
+            with open(self.jar, 'rb') as f:
+                for chunk in iter(lambda: f.read(1048576), b''):
+                    digest.update(chunk)
+            self._hash_cache = ( key, digest.hexdigest()[:16] )
+        return self._hash_cache[1]
+
+    def supported(self, identity):
+        """ Check if the JVM can dump archives, which needs Java 13 or newer
+        Older JVMs refuse to start with the flag, so it's tried with -version """
+        if self._supported is None or self._supported[0] != identity:
+            directory = tempfile.mkdtemp()
+            try:
+                process = subprocess.run([ self.java, '-XX:ArchiveClassesAtExit='+os.path.join(directory, 'probe.jsa'), '-version' ],
+                                         stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=60)
+                supported = process.returncode == 0
+            except ( OSError, subprocess.TimeoutExpired ):
+                supported = False
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
+            if not supported:
+                self.logger.warning('{} doesn\'t support class data archives, Java 13 or newer is needed'.format(self.java))
+            self._supported = ( identity, supported )
+        return self._supported[1]
+
+    def path(self, jar_hash):
+        """ Get the path of the archive of a jar """
+        return os.path.join(self.directory, jar_hash+'.jsa')
+
+    def prepare(self):
+        """ Get the mode of the next start and the JVM arguments for it,
+        the mode is None if the archive can't be used """
+        self.training = None
+        try:
+            identity = self.java_identity()
+            jar_hash = self.jar_hash(identity)
+        except OSError as e:
+            self.logger.warning('Unable to use the class data archive of {0}: {1!s}'.format(self.jar, e))
+            return None, []
+        path = self.path(jar_hash)
+        # The JVM refuses archives older than the jar, which happens
+        # when the jar is copied again even if it didn't change
+        if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(self.jar):
+            return self.MODE_ARCHIVE, [ '-XX:SharedArchiveFile='+path, '-Xshare:auto' ]
+        # Don't train again if a training run with this jar already failed
+        if os.path.exists(path+'.failed') or not self.supported(identity):
+            return None, []
+        # The directory is created only when needed, if it can't be the
+        # server starts without the archive
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+        except OSError as e:
+            self.logger.warning('Unable to create the class data archives directory {0}: {1!s}'.format(self.directory, e))
+            return None, []
+        # Dump the archive to a temporary file, it's kept only if the
+        # server exits cleanly
+        self.training = jar_hash
+        return self.MODE_TRAINING, [ '-XX:ArchiveClassesAtExit='+path+'.tmp' ]
+
+    def finish(self, exit_code, ready):
+        """ Keep the archive dumped by a training run if the server exited
+        cleanly; if it didn't even get ready the JVM probably doesn't
+        support archives, so training isn't tried again with this jar """
+        if self.training is None:
+            return
+        path = self.path(self.training)
+        self.training = None
+        try:
+            if exit_code == 0 and os.path.exists(path+'.tmp') and os.path.getsize(path+'.tmp') > 0:
+                os.rename(path+'.tmp', path)
+                # Remove the archives of the previous jars
+                for other in glob.glob( os.path.join(self.directory, '*.jsa*') ):
+                    if other != path:
+                        os.remove(other)
+                self.logger.info('Created the class data archive {}'.format(path))
+                return
+            if os.path.exists(path+'.tmp'):
+                os.remove(path+'.tmp')
+            if not ready:
+                open(path+'.failed', 'w').close()
+                self.logger.warning('The training run of the class data archive of {} failed, it won\'t be used for this jar'.format(self.jar))
+        except OSError as e:
+            self.logger.error('Unable to save the class data archive {0}: {1!s}'.format(path, e))
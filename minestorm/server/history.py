@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+import json
+import os
+import threading
+import logging
+
+class StartupHistory:
+    """
+    History of the starts of a server
+
+    Every start is recorded with its outcome and the time needed
+    to be ready; if a path is provided the history is also appended
+    to that file, one JSON entry per line, and loaded back at boot
+    """
+
+    def __init__(self, path=None, max_entries=100):
+        self.path = path
+        self.max_entries = max_entries
+        self.entries = []
+        self.lock = threading.Lock()
+        if path is not None:
+            # Keep the history only in memory if the file can't be used
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                self._load()
+            except OSError as e:
+                logging.getLogger('minestorm.servers').error('Unable to use the startup history file {0}, it won\'t be saved: {1!s}'.format(path, e))
+                self.path = None
+
+    def record(self, entry):
+        """ Record a start """
+        with self.lock:
+            self.entries.append(entry)
+            del self.entries[ : -self.max_entries ]
+            if self.path is not None:
+                try:
+                    with open(self.path, 'a') as f:
+                        f.write( json.dumps(entry) + '\n' )
+                    # Rewrite the file from time to time, to keep it small
+                    if self._lines_count() > self.max_entries * 2:
+                        self._rewrite()
+                except OSError as e:
+                    logging.getLogger('minestorm.servers').error('Unable to save the startup history to {0}: {1!s}'.format(self.path, e))
+
+    def last(self, limit=None):
+        """ Get the last starts, oldest first """
+        with self.lock:
+            return list( self.entries[ -limit: ] if limit else self.entries )
+
+    def summary(self, entries=None):
+        """ Get statistics about the time needed by the starts which succeeded """
+        if entries is None:
+            entries = self.last()
+        times = [ entry['seconds'] for entry in entries if entry['result'] == 'ready' ]
+        if not times:
+            return { 'count': 0, 'last': None, 'average': None, 'best': None, 'worst': None }
+        return { 'count': len(times), 'last': times[-1], 'average': sum(times) / len(times), 'best': min(times), 'worst': max(times) }
+
+    def compare(self, key, default=None):
+        """ Get the statistics of the starts grouped by the value of a key """
+        groups = {}
+        for entry in self.last():
+            groups.setdefault( entry.get(key) or default, [] ).append(entry)
+        return { value: self.summary(entries) for value, entries in groups.items() }
+
+    def _load(self):
+        """ Load the entries saved in the file """
+        if not os.path.exists(self.path):
+            return
+        truncated = False
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    self.entries.append( json.loads(line) )
+                except ValueError:
+                    truncated = True # Skip lines truncated by a crash
+        del self.entries[ : -self.max_entries ]
+        # Remove truncated lines, new entries would be appended to them
+        if truncated:
+            self._rewrite()
+
+    def _lines_count(self):
+        """ Count the entries in the file, must be called with the lock held """
+        with open(self.path, 'r') as f:
+            return sum( 1 for line in f )
+
+    def _rewrite(self):
+        """ Rewrite the file with only the kept entries, must be called with the lock held """
+        with open(self.path+'.tmp', 'w') as f:
+            for entry in self.entries:
+                f.write( json.dumps(entry) + '\n' )
+        os.rename(self.path+'.tmp', self.path)
@@ -0,0 +1,228 @@
+#!/usr/bin/python3
+import logging
+import uuid
+import time
+import queue
+import heapq
+import itertools
+import threading
+import minestorm
+
+class JobsManager:
+    """
+    Manager of the background jobs, which runs
+    long operations on its own workers
+    """
+
+    def __init__(self):
+        self.jobs = {}
+        self.logger = logging.getLogger('minestorm.jobs')
+        self.queue = queue.Queue()
+        self._lock = threading.Lock()
+        # Start the workers
+        self.workers = []
+        for i in range( int( minestorm.get('configuration').get('jobs.workers', 2) ) ):
+            worker = JobWorkerThread(self)
+            worker.start()
+            self.workers.append(worker)
+        # A single thread expires the timeouts of all the waiters
+        self._timeouts = []
+        self._timeouts_ids = itertools.count()
+        self._timeouts_condition = threading.Condition()
+        self.timeouts_thread = JobTimeoutThread(self)
+        self.timeouts_thread.start()
+
+    def submit(self, name, function):
+        """ Submit a new job, which will call the function passing itself """
+        self.clear() # Remove old jobs
+        job = Job(name, function)
+        with self._lock:
+            self.jobs[job.id] = job
+        self.queue.put(job)
+        self.logger.debug('Submitted job {0} ({1})'.format(job.id, name))
+        return job
+
+    def get(self, id):
+        """ Get a job by its id """
+        if id in self.jobs:
+            return self.jobs[id]
+        else:
+            raise KeyError('Invalid job: {}'.format(id))
+
+    def clear(self):
+        """ Remove finished jobs older than the expiration time """
+        expire_at = time.time() - minestorm.get('configuration').get('jobs.expiration', 3600)
+        with self._lock:
+            for job in list(self.jobs.values()):
+                if job.finished_at is not None and job.finished_at < expire_at:
+                    del self.jobs[job.id]
+
+    def notify(self, job, timeout, callback):
+        """ Call the callback with the job when it finishes or when the
+        timeout expires, whichever comes first, without blocking """
+        waiter = JobWaiter(job, callback)
+        with self._timeouts_condition:
+            heapq.heappush(self._timeouts, ( time.time() + timeout, next(self._timeouts_ids), waiter ))
+            self._timeouts_condition.notify()
+        job.add_done_callback(waiter.fire)
+
+    def _expire_timeouts(self, wait):
+        """ Fire the waiters whose timeout expired, waiting up to some
+        seconds for the next one """
+        expired = []
+        with self._timeouts_condition:
+            now = time.time()
+            while self._timeouts and self._timeouts[0][0] <= now:
+                expired.append( heapq.heappop(self._timeouts)[2] )
+            # Sleep until the next timeout if nothing expired yet
+            if not expired:
+                if self._timeouts:
+                    wait = min(wait, self._timeouts[0][0] - now)
+                self._timeouts_condition.wait(wait)
+        for waiter in expired:
+            waiter.fire(waiter.job)
+
+    def stop(self):
+        """ Stop all the workers """
+        for worker in self.workers:
+            worker.stop = True
+        self.timeouts_thread.stop = True
+
+class Job:
+    """
+    Representation of a background job
+    """
+
+    # Status codes
+    STATUS_PENDING = 'PENDING'
+    STATUS_RUNNING = 'RUNNING'
+    STATUS_DONE = 'DONE'
+    STATUS_FAILED = 'FAILED'
+
+    def __init__(self, name, function):
+        self.id = str( uuid.uuid4() ) # Generate an unique id for this job
+        self.name = name
+        self.function = function
+        self.status = self.STATUS_PENDING
+        self.progress = { 'done': 0, 'total': None }
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def run(self):
+        """ Run the job """
+        self.status = self.STATUS_RUNNING
+        self.started_at = time.time()
+        try:
+            self.result = self.function(self)
+        except Exception as e:
+            self.error = str(e)
+            self.status = self.STATUS_FAILED
+            logging.getLogger('minestorm.jobs').error('Job {0} ({1}) failed: {2!s}'.format(self.id, self.name, e))
+        else:
+            self.status = self.STATUS_DONE
+        self.finished_at = time.time()
+        with self._lock:
+            self._event.set() # Wake up everyone waiting for the job
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def update(self, done, total=None):
+        """ Update the progress of the job """
+        self.progress = { 'done': done, 'total': total }
+
+    def wait(self, timeout=None):
+        """ Wait for the job to finish, returning if it finished """
+        return self._event.wait(timeout)
+
+    def add_done_callback(self, callback):
+        """ Call the callback with the job when it finishes, or right
+        now if it already finished """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def details(self):
+        """ Get the details of the job """
+        result = {}
+        result['id'] = self.id
+        result['name'] = self.name
+        result['status'] = self.status
+        result['progress'] = self.progress
+        result['created_at'] = self.created_at
+        result['started_at'] = self.started_at
+        result['finished_at'] = self.finished_at
+        # Provide the outcome only when the job finished
+        if self.status == self.STATUS_DONE:
+            result['result'] = self.result
+        elif self.status == self.STATUS_FAILED:
+            result['error'] = self.error
+        return result
+
+    def __repr__(self):
+        return '<Job "'+self.name+'" '+self.id+'>'
+
+class JobWorkerThread(threading.Thread):
+    """
+    Thread which runs the queued jobs
+    """
+
+    def __init__(self, manager):
+        super(JobWorkerThread, self).__init__() # Run the parent constructor
+        self.manager = manager
+        self.stop = False
+
+    def run(self):
+        while not ( self.stop or minestorm.shutdowned ):
+            # Wait for a job, checking from time to time
+            # if minestorm is shutting down
+            try:
+                job = self.manager.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            job.run()
+
+class JobWaiter:
+    """
+    Someone waiting for a job, which must be notified only once
+    """
+
+    def __init__(self, job, callback):
+        self.job = job
+        self.callback = callback
+        self.called = False
+        self._lock = threading.Lock()
+
+    def fire(self, job):
+        """ Notify the waiter, if it wasn't already """
+        with self._lock:
+            if self.called:
+                return
+            self.called = True
+        try:
+            self.callback(job)
+        except Exception as e:
+            logging.getLogger('minestorm.jobs').error('Unable to notify a waiter of job {0}: {1!s}'.format(job.id, e))
+
+class JobTimeoutThread(threading.Thread):
+    """
+    Thread which notifies the waiters whose timeout expired
+    """
+
+    def __init__(self, manager):
+        super(JobTimeoutThread, self).__init__() # Run the parent constructor
+        self.manager = manager
+        self.stop = False
+
+    def run(self):
+        while not ( self.stop or minestorm.shutdowned ):
+            # Check from time to time if minestorm is shutting down
+            self.manager._expire_timeouts(0.5)
@@ -0,0 +1,165 @@
+#!/usr/bin/python3
+import os
+import re
+import logging
+import minestorm
+import minestorm.server.monitoring
+
+MEGABYTE = 1024 * 1024
+GIGABYTE = 1024 * MEGABYTE
+
+def aikar(heap):
+    """ G1 tuned for Minecraft, with short pauses and a big young generation """
+    flags = [ '-XX:+UseG1GC', '-XX:+ParallelRefProcEnabled', '-XX:MaxGCPauseMillis=200',
+              '-XX:+UnlockExperimentalVMOptions', '-XX:+DisableExplicitGC', '-XX:+AlwaysPreTouch' ]
+    # Bigger heaps need a bigger young generation and regions
+    if heap is not None and heap > 12 * GIGABYTE:
+        flags += [ '-XX:G1NewSizePercent=40', '-XX:G1MaxNewSizePercent=50', '-XX:G1HeapRegionSize=16M',
+                   '-XX:G1ReservePercent=15', '-XX:InitiatingHeapOccupancyPercent=20' ]
+    else:
+        flags += [ '-XX:G1NewSizePercent=30', '-XX:G1MaxNewSizePercent=40', '-XX:G1HeapRegionSize=8M',
+                   '-XX:G1ReservePercent=20', '-XX:InitiatingHeapOccupancyPercent=15' ]
+    flags += [ '-XX:G1HeapWastePercent=5', '-XX:G1MixedGCCountTarget=4', '-XX:G1MixedGCLiveThresholdPercent=90',
+               '-XX:G1RSetUpdatingPauseTimePercent=5', '-XX:SurvivorRatio=32', '-XX:+PerfDisableSharedMem',
+               '-XX:MaxTenuringThreshold=1', '-Dusing.aikars.flags=https://mcflags.emc.gs', '-Daikars.new.flags=true' ]
+    return flags
+
+def zgc(heap):
+    """ ZGC, which has pauses shorter than a millisecond with any heap size """
+    return [ '-XX:+UseZGC', '-XX:+DisableExplicitGC', '-XX:+PerfDisableSharedMem' ]
+
+def pretouch(heap):
+    """ Touch all the heap at start, so pages aren't faulted in while playing """
+    return [ '-XX:+AlwaysPreTouch' ]
+
+def large_pages(heap):
+    """ Back the heap with large pages, which must be enabled in the kernel """
+    return [ '-XX:+UseLargePages' ]
+
+def string_dedup(heap):
+    """ Deduplicate the strings in the heap during garbage collections """
+    return [ '-XX:+UseStringDeduplication' ]
+
+# Available profiles, with the garbage collector they select
+PROFILES = {
+    'aikar': ( 'G1', aikar ),
+    'zgc': ( 'Z', zgc ),
+    'pretouch': ( None, pretouch ),
+    'large_pages': ( None, large_pages ),
+    'string_dedup': ( None, string_dedup ),
+}
+
+# Profiles which want the initial heap to be the maximum one
+FIXED_HEAP_PROFILES = ( 'aikar', 'zgc', 'pretouch' )
+
+def parse_size(value):
+    """ Convert a size in the JVM format, like 512M or 4G, to bytes """
+    match = re.match(r'^\s*(\d+)\s*([kmgt]?)b?\s*$', str(value), re.IGNORECASE)
+    if match is None:
+        raise RuntimeError('Invalid memory size: {}'.format(value))
+    exponent = ' kmgt'.index( match.group(2).lower() or ' ' )
+    return int(match.group(1)) * 1024 ** exponent
+
+def format_size(size):
+    """ Convert a size in bytes to the JVM format, in megabytes """
+    return '{}M'.format( size // MEGABYTE )
+
+def memory_limit(root='/sys/fs/cgroup', cgroups='/proc/self/cgroup'):
+    """ Get the memory limit of the cgroup of the daemon in bytes,
+    or None if the memory isn't limited """
+    # Find the limit files of the cgroups of the daemon, for cgroups v2
+    # and for the memory controller of cgroups v1
+    paths = []
+    try:
+        with open(cgroups, 'r') as f:
+            for line in f:
+                hierarchy, controllers, path = line.strip().split(':', 2)
+                if hierarchy == '0' and controllers == '':
+                    paths.append( os.path.join(root, path.lstrip('/'), 'memory.max') )
+                elif 'memory' in controllers.split(','):
+                    paths.append( os.path.join(root, 'memory', path.lstrip('/'), 'memory.limit_in_bytes') )
+    except OSError:
+        pass
+    # In containers the cgroup of the daemon is usually the root one
+    paths += [ os.path.join(root, 'memory.max'), os.path.join(root, 'memory', 'memory.limit_in_bytes') ]
+    limits = []
+    for path in paths:
+        try:
+            with open(path, 'r') as f:
+                content = f.read().strip()
+        except OSError:
+            continue
+        # Unlimited cgroups v2 report max
+        if content.isdigit():
+            limits.append( int(content) )
+    # Unlimited cgroups v1 report a huge number
+    limits = [ limit for limit in limits if limit < minestorm.server.monitoring.memory_total() ]
+    return min(limits) if limits else None
+
+def option_key(flag):
+    """ Get the name of the option set by a flag, used to override it """
+    match = re.match(r'^-XX:[+-]?([\w.]+)', flag)
+    if match is not None:
+        return 'XX:'+match.group(1)
+    match = re.match(r'^-D([^=]+)', flag)
+    if match is not None:
+        return 'D:'+match.group(1)
+    match = re.match(r'^-(Xm[sxn]|Xss)', flag)
+    if match is not None:
+        return match.group(1)
+    return flag
+
+def merge(flags, overrides):
+    """ Merge two lists of flags, the overrides replace flags setting
+    the same options and the other ones are appended """
+    result = {}
+    for flag in flags + overrides:
+        result[ option_key(flag) ] = flag # Dicts keep the insertion order
+    return list( result.values() )
+
+def arguments(details, limit=None, heap_ratio=0.8, default_profiles=(), servers=1):
+    """ Get the arguments of the JVM for a server, before the jar
+    A configured maximum heap is always reduced to fit in the memory limit,
+    while a heap derived from it is divided between all the servers """
+    start_command = details['start_command']
+    jvm = details.get('jvm', {})
+    profiles = jvm.get('profiles', default_profiles)
+    if isinstance(profiles, str):
+        profiles = [ profiles ]
+    # Check profiles before building anything
+    collectors = {}
+    for profile in profiles:
+        if profile not in PROFILES:
+            raise RuntimeError('Invalid JVM profile: {}'.format(profile))
+        if PROFILES[profile][0] is not None:
+            collectors[ PROFILES[profile][0] ] = profile
+    if len(collectors) > 1:
+        raise RuntimeError('JVM profiles {} select different garbage collectors'.format(', '.join( sorted(collectors.values()) )))
+    flags = []
+    ram = start_command.get('ram', {})
+    # Don't allow a heap bigger than the memory available to the container
+    available = int(limit * heap_ratio) if limit is not None else None
+    maximum = ram.get('max')
+    if maximum is not None and available is not None and parse_size(maximum) > available:
+        logging.getLogger('minestorm.servers').warning('The maximum heap of {0} is bigger than {1:.0%} of the memory limit, reducing it to {2}'.format(details['name'], heap_ratio, format_size(available)))
+        maximum = format_size(available)
+    # Derive the heap from the memory limit when tuning is requested,
+    # leaving space for the other servers, which may commit their heap
+    # at start
+    elif maximum is None and profiles:
+        total = available if available is not None else int(minestorm.server.monitoring.memory_total() * heap_ratio)
+        maximum = format_size( total // max(servers, 1) )
+    minimum = ram.get('min')
+    if minimum is None and maximum is not None and any( profile in FIXED_HEAP_PROFILES for profile in profiles ):
+        minimum = maximum
+    elif minimum is not None and maximum is not None and parse_size(minimum) > parse_size(maximum):
+        minimum = maximum
+    if minimum is not None:
+        flags.append( '-Xms'+str(minimum) )
+    if maximum is not None:
+        flags.append( '-Xmx'+str(maximum) )
+    # Add the flags of the profiles, then the ones of the user
+    heap = parse_size(maximum) if maximum is not None else None
+    for profile in profiles:
+        flags = merge( flags, PROFILES[profile][1](heap) )
+    return merge( flags, [ str(flag) for flag in jvm.get('flags', []) ] )
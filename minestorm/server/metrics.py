@@ -0,0 +1,143 @@
+#!/usr/bin/python3
+import math
+import time
+import array
+import threading
+
+# Metrics recorded for each server
+METRICS = ( 'ram', 'cpu', 'lines', 'players' )
+
+# Default resolutions, as ( seconds per point, number of points )
+RESOLUTIONS = ( ( 1, 3600 ), ( 60, 1440 ), ( 600, 4320 ) )
+
+class MetricsRing:
+    """
+    Fixed length ring of points at a resolution
+
+    Every point is the average of the samples received in its
+    interval; the point being filled is kept apart until the
+    next interval starts
+    """
+
+    def __init__(self, step, length, names=METRICS):
+        if step <= 0 or length < 1:
+            raise RuntimeError('Invalid metrics resolution: {0}s x {1}'.format(step, length))
+        self.step = step
+        self.length = length
+        self.names = names
+        # Interval number of each slot, -1 if the slot is empty
+        self.buckets = array.array('q', [ -1 ] * length)
+        self.values = { name: array.array('d', [ math.nan ] * length) for name in names }
+        # Interval being filled, with the sums of its samples
+        self.current = None
+        self.sums = {}
+        self.counts = {}
+
+    @property
+    def span(self):
+        """ Seconds covered by the ring """
+        return self.step * self.length
+
+    def add(self, timestamp, values):
+        """ Add a sample, unknown values are None """
+        bucket = int( timestamp // self.step )
+        # Samples going back in time are merged in the current interval
+        if self.current is None or bucket > self.current:
+            self._flush()
+            self.current = bucket
+        for name in self.names:
+            value = values.get(name)
+            if value is not None:
+                self.sums[name] = self.sums.get(name, 0) + value
+                self.counts[name] = self.counts.get(name, 0) + 1
+
+    def query(self, since=None, until=None):
+        """ Get the points in a time range
+        It returns the list of the times of the points, and a dict containing
+        the list of the values of each metric, None for unknown values """
+        times = []
+        columns = { name: [] for name in self.names }
+        if self.current is None:
+            return times, columns
+        first = self.current - self.length + 1
+        if since is not None:
+            first = max( first, int( since // self.step ) )
+        last = self.current
+        if until is not None:
+            last = min( last, int( until // self.step ) )
+        for bucket in range(first, last+1):
+            if bucket == self.current:
+                # The interval being filled has the average so far
+                point = { name: self.sums[name] / self.counts[name] if self.counts.get(name) else None for name in self.names }
+            else:
+                slot = bucket % self.length
+                if self.buckets[slot] != bucket:
+                    continue # No samples in this interval
+                point = { name: self.values[name][slot] for name in self.names }
+                point = { name: None if math.isnan(value) else value for name, value in point.items() }
+            times.append( bucket * self.step )
+            for name in self.names:
+                columns[name].append( point[name] )
+        return times, columns
+
+    def _flush(self):
+        """ Store the interval being filled in the ring """
+        if self.current is None:
+            return
+        slot = self.current % self.length
+        self.buckets[slot] = self.current
+        for name in self.names:
+            count = self.counts.get(name)
+            self.values[name][slot] = self.sums[name] / count if count else math.nan
+        self.sums = {}
+        self.counts = {}
+
+class MetricsHistory:
+    """
+    History of the metrics of a server
+
+    Every sample is added to rings at multiple resolutions, so
+    recent points are precise and old points are downsampled
+    """
+
+    def __init__(self, resolutions=RESOLUTIONS, names=METRICS):
+        self.names = names
+        # Finest resolution first
+        self.rings = [ MetricsRing(step, length, names) for step, length in sorted(resolutions) ]
+        if not self.rings:
+            raise RuntimeError('At least a metrics resolution is needed')
+        self.lock = threading.Lock()
+
+    @property
+    def resolutions(self):
+        """ Seconds per point of each resolution, finest first """
+        return [ ring.step for ring in self.rings ]
+
+    def add(self, timestamp, values):
+        """ Add a sample of the metrics """
+        with self.lock:
+            for ring in self.rings:
+                ring.add(timestamp, values)
+
+    def query(self, since=None, until=None, resolution=None, now=None):
+        """ Get the points in a time range
+        If the resolution isn't provided, the finest one covering the
+        range is used. It returns the resolution, the times of the points
+        and a dict containing the values of each metric """
+        if resolution is not None:
+            rings = [ ring for ring in self.rings if ring.step == resolution ]
+            if not rings:
+                raise RuntimeError('Invalid resolution: {0}'.format(resolution))
+            ring = rings[0]
+        else:
+            if now is None:
+                now = time.time()
+            # Fall back to the coarsest resolution for very old ranges
+            ring = self.rings[-1]
+            for candidate in self.rings:
+                if since is None or now - since <= candidate.span:
+                    ring = candidate
+                    break
+        with self.lock:
+            times, columns = ring.query(since, until)
+        return ring.step, times, columns
@@ -0,0 +1,172 @@
+#!/usr/bin/python3
+import os
+import time
+import logging
+import threading
+import minestorm
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+_memory_total = None
+
+def memory_total():
+    """ Get the total memory of the system in bytes, reading it only once """
+    global _memory_total
+    if _memory_total is None:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                key, value = line.split(':', 1)
+                if key == 'MemTotal':
+                    _memory_total = int( value.replace('kB', '').strip() ) * 1024
+                    break
+    return _memory_total
+
+class ResourcesSampler:
+    """
+    Sampler of the resources used by all servers
+
+    It reads only a few files from /proc for each process, and
+    keeps the previous samples to calculate the CPU usage
+    """
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.previous = {}
+        self.logger = logging.getLogger('minestorm.monitoring')
+
+    def sample_all(self):
+        """ Sample the usage of all running servers """
+        for name, server in list( self.manager.servers.items() ):
+            pid = server.pid
+            if pid is None:
+                self.previous.pop(name, None)
+                continue
+            try:
+                usage = self.sample(name, pid)
+            except OSError:
+                continue # The process just exited
+            server._on_usage_sampled(usage)
+
+    def sample(self, name, pid):
+        """ Sample the usage of a process and all its descendants """
+        now = time.time()
+        usage = { 'cpu_time': 0, 'threads': 0, 'rss': 0, 'pss': 0, 'read_bytes': 0, 'write_bytes': 0 }
+        pids = process_tree(pid)
+        for i, current in enumerate(pids):
+            try:
+                process = read_stat(current)
+                process['rss'] = read_statm(current)
+                process['pss'] = read_pss(current)
+                process.update( read_io(current) )
+            except OSError:
+                # Only the main process must be alive
+                if i == 0:
+                    raise
+                continue
+            # Sum the usage, a single unknown value makes the total unknown
+            for key, value in process.items():
+                usage[key] = usage[key] + value if value is not None and usage[key] is not None else None
+        usage['processes'] = len(pids)
+        # Calculate the CPU usage from the previous sample of the same process
+        cpu_time = usage.pop('cpu_time')
+        previous = self.previous.get(name)
+        if previous is not None and previous[0] == pid and now > previous[2]:
+            # Children which exited take away their time
+            usage['cpu'] = max( cpu_time - previous[1], 0 ) * 100 / ( now - previous[2] )
+        else:
+            usage['cpu'] = None
+        self.previous[name] = ( pid, cpu_time, now )
+        usage['ram_used'] = ( usage['rss'] * 100 ) / memory_total()
+        return usage
+
+def process_tree(pid):
+    """ Get the pid of a process followed by the pids of all its descendants """
+    result = [ pid ]
+    for current in result:
+        result.extend( children(current) )
+    return result
+
+def children(pid):
+    """ Get the pids of the children of a process """
+    result = []
+    try:
+        # Every thread has its own children
+        for task in os.listdir('/proc/{}/task'.format(pid)):
+            with open('/proc/{}/task/{}/children'.format(pid, task), 'r') as f:
+                result.extend( int(child) for child in f.read().split() )
+    except FileNotFoundError:
+        # The process exited, or the kernel doesn't provide children files:
+        # in this case look for processes with this parent
+        if os.path.exists('/proc/{}'.format(pid)):
+            return [ child for child, parent in _parents() if parent == pid ]
+    return result
+
+def _parents():
+    """ Get the parent pid of all the processes """
+    for name in os.listdir('/proc'):
+        if name.isdigit():
+            try:
+                with open('/proc/{}/stat'.format(name), 'r') as f:
+                    content = f.read()
+            except OSError:
+                continue
+            yield int(name), int( content[ content.rindex(')')+2 : ].split()[1] )
+
+def read_stat(pid):
+    """ Read the CPU time and the threads count of a process """
+    with open('/proc/{}/stat'.format(pid), 'r') as f:
+        content = f.read()
+    # The process name can contain spaces, so split after it
+    fields = content[ content.rindex(')')+2 : ].split()
+    return {
+        'cpu_time': ( int(fields[11]) + int(fields[12]) ) / CLOCK_TICKS, # utime + stime
+        'threads': int(fields[17]),
+    }
+
+def read_statm(pid):
+    """ Read the resident memory of a process, in bytes """
+    with open('/proc/{}/statm'.format(pid), 'r') as f:
+        return int( f.read().split()[1] ) * PAGE_SIZE
+
+def read_pss(pid):
+    """ Read the proportional memory of a process in bytes, if the kernel provides it """
+    try:
+        with open('/proc/{}/smaps_rollup'.format(pid), 'r') as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    return int( line.split()[1] ) * 1024
+    except FileNotFoundError:
+        # Old kernels don't have smaps_rollup, but the process may be alive
+        if not os.path.exists('/proc/{}'.format(pid)):
+            raise
+    except PermissionError:
+        pass
+    return None
+
+def read_io(pid):
+    """ Read the bytes read and written by a process """
+    result = { 'read_bytes': None, 'write_bytes': None }
+    try:
+        with open('/proc/{}/io'.format(pid), 'r') as f:
+            for line in f:
+                key, value = line.split(':', 1)
+                if key in result:
+                    result[key] = int(value)
+    except PermissionError:
+        pass
+    return result
+
+class UsageSamplerThread(threading.Thread):
+    """ This thread samples the resources used by all servers """
+
+    def __init__(self, sampler):
+        super(UsageSamplerThread, self).__init__() # Run the parent constructor
+        self.sampler = sampler
+        self.stop = False
+
+    def run(self):
+        while not ( self.stop or minestorm.shutdowned ):
+            self.sampler.sample_all()
+            # Now sleep a little
+            time.sleep( minestorm.get('configuration').get('servers.update_usage_informations_every') )
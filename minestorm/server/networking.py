@@ -1,11 +1,17 @@
 #!/usr/bin/python3
+import os
 import socket
 import json
 import threading
 import logging
-import struct
+import time
+import zlib
+import queue
+import asyncio
+import concurrent.futures
 import minestorm
 import minestorm.common
+import minestorm.common.networking
 
 class Listener:
     """
@@ -14,10 +20,22 @@ class Listener:
 
     def __init__(self):
         self.socket = None
+        self.unix_socket = None
+        self.unix_path = None
         self.binded = False
         self.started = False
         self.thread = None
+        self.unix_thread = None
+        self.workers = []
+        self.queue = None
+        self.connections = set() # Persistent connections, closed when stopping
+        self._connections_lock = threading.Lock()
         self.logger = logging.getLogger('minestorm.networking')
+        # Counters about the handled work
+        self.stats = {'accepted': 0, 'queued': 0, 'rejected': 0, 'processed': 0}
+        self.compression_stats = {'frames': 0, 'original_bytes': 0, 'compressed_bytes': 0, 'cpu_time': 0.0}
+        self._stats_lock = threading.Lock()
+        self.max_frame_size = int( minestorm.get('configuration').get('networking.max_frame_size', 16777216) )
 
     def bind(self, port):
         """ Bind a port to the socket """
@@ -32,31 +50,104 @@ class Listener:
         else:
             raise RuntimeError('Already initialized socket')
 
+    def bind_unix(self, path, mode=0o660):
+        """ Bind an Unix domain socket, used by local clients """
+        if self.unix_socket is None:
+            path = os.path.expanduser(path)
+            # Keep the socket in a private directory, so other users
+            # can't replace it
+            directory = os.path.dirname(path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory, 0o700)
+            # Remove a stale socket file left by a previous run, but
+            # never something owned by someone else
+            if os.path.lexists(path):
+                if not minestorm.common.networking.is_own_socket(path):
+                    raise RuntimeError('{0} exists and is not a socket owned by this user'.format(path))
+                os.unlink(path)
+            self.unix_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.unix_socket.bind(path)
+            # File permissions act as access control
+            os.chmod(path, mode)
+            self.unix_path = path
+            self.logger.info('Binded Unix socket {0}'.format(path))
+        else:
+            raise RuntimeError('Already initialized Unix socket')
+
     def listen(self):
         """ Start the listener """
         if self.socket and self.binded == True and self.started == False:
             self.started = True
             self.socket.listen(5) # Start listening
             self.logger.info('Now listening for new connections')
+            # Start the workers pool if it's enabled
+            self._start_workers()
             # Create a new listener thread
-            self.thread = ListenerThread(self)
+            self.thread = ListenerThread(self, self.socket)
             self.thread.start()
+            # Also listen on the Unix socket, if binded
+            if self.unix_socket:
+                self.unix_socket.listen(5)
+                self.unix_thread = ListenerThread(self, self.unix_socket)
+                self.unix_thread.start()
         else:
             raise RuntimeError('Listener already started')
 
-    def accept(self):
+    def accept(self, sock=None):
         """ Accept a connection """
+        if sock is None:
+            sock = self.socket
         try:
-            conn, addr = self.socket.accept() # Accept a connection
-            # Get the packet length
-            length_packet = minestorm.common.receive_packet( conn, 4 )
-            length = struct.unpack( 'I', length_packet )[0]
-            data = minestorm.common.receive_packet( conn, length )
-            self._on_request_recived(conn, addr, data) # Pass the request to the listener
+            sock, addr = sock.accept() # Accept a connection
+            # Unix sockets don't have an address
+            if sock.family == socket.AF_UNIX:
+                addr = ('unix', self.unix_path)
         except ( socket.error, RuntimeError ):
             if self.started:
                 logging.getLogger('minestorm.networking').critical('Socket broken')
-                return
+            return
+        self._count('accepted')
+        conn = Connection(sock)
+        # If the workers pool is enabled only hand the connection off,
+        # else process it in this thread
+        if self.workers:
+            self._enqueue(self.handle, conn, addr)
+        else:
+            self.handle(conn, addr)
+
+    def handle(self, conn, addr):
+        """ Receive the first request from a connection and process it """
+        try:
+            data = self._receive(conn)
+        except ( socket.error, RuntimeError, zlib.error ):
+            self.logger.warning('Connection with {0} broken'.format(addr))
+            conn.close()
+            return
+        # Persistent connections carry more requests, so continue
+        # reading them in a dedicated thread as soon as the first one
+        # is decoded, even if processing it takes a while
+        conn.on_persistent = lambda: ConnectionThread(self, conn, addr).start()
+        self._process(conn, addr, data)
+
+    def handle_frame(self, conn, addr, data):
+        """ Process a request received from a persistent connection """
+        if self.workers:
+            self._enqueue(self._process, conn, addr, data)
+        else:
+            self._process(conn, addr, data)
+
+    def get_stats(self):
+        """ Get a copy of the counters about the handled work """
+        with self._stats_lock:
+            result = self.stats.copy()
+        result['workers'] = len(self.workers)
+        result['queue_length'] = self.queue.qsize() if self.queue else 0
+        with self._stats_lock:
+            result['compression'] = self.compression_stats.copy()
+        # Calculate the global compression ratio
+        if result['compression']['compressed_bytes']:
+            result['compression']['ratio'] = result['compression']['original_bytes'] / result['compression']['compressed_bytes']
+        return result
 
     def stop(self):
         """ Stop the listener """
@@ -64,20 +155,123 @@ class Listener:
             # Reset variables
             self.binded = False
             self.started = False
-            # Stop the thread if it was started
-            if self.thread:
-                self.thread.stop = True
-                self.thread = None
+            # Stop the threads if they were started
+            for thread in (self.thread, self.unix_thread):
+                if thread:
+                    thread.stop = True
+            self.thread = None
+            self.unix_thread = None
+            # Stop all the workers
+            for worker in self.workers:
+                worker.stop = True
+            self.workers = []
+            # Close the persistent connections, waking up their threads
+            with self._connections_lock:
+                connections = list(self.connections)
+                self.connections.clear()
+            for conn in connections:
+                try:
+                    conn.socket.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass # Already closed by the client
             # Shutdown the socket
             self.socket.shutdown(socket.SHUT_RDWR)
             self.socket.close()
             self.socket = None
+            self._close_unix_socket()
             self.logger.info('Networking stopped!')
         else:
             raise RuntimeError('Can\'t stop a stopped server...')
 
+    def _close_unix_socket(self):
+        """ Close the Unix socket, if binded """
+        if self.unix_socket:
+            try:
+                self.unix_socket.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            self.unix_socket.close()
+            self.unix_socket = None
+            # Remove the socket file
+            if os.path.exists(self.unix_path):
+                os.unlink(self.unix_path)
+            self.unix_path = None
+
+    def _start_workers(self):
+        """ Start the workers pool, if enabled in the configuration """
+        configuration = minestorm.get('configuration')
+        pool_size = int( configuration.get('networking.workers.pool_size', 0) )
+        # A pool size of 0 disables the pool
+        if pool_size > 0:
+            # A queue size of 0 would make the queue unbounded
+            queue_size = int( configuration.get('networking.workers.queue_size', 32) )
+            if queue_size < 1:
+                raise RuntimeError('networking.workers.queue_size must be greater than 0')
+            self.queue = queue.Queue( queue_size )
+            for i in range(pool_size):
+                worker = ListenerWorkerThread(self)
+                worker.start()
+                self.workers.append(worker)
+            self.logger.info('Started {0} networking workers'.format(pool_size))
+
+    def _enqueue(self, function, conn, addr, *args):
+        """ Hand a connection off to the workers pool, which will call function with it """
+        try:
+            self.queue.put_nowait( (function, (conn, addr) + args) )
+        except queue.Full:
+            # The pool is too busy, so reject the work
+            self._count('rejected')
+            self.logger.warning('Rejected request from {0}: workers queue is full'.format(addr))
+            self._reject(conn, addr, *args[-1:])
+        else:
+            self._count('queued')
+
+    def _reject(self, conn, addr, data=None):
+        """ Tell the client the server is busy """
+        reply = {'status': 'failed', 'reason': 'Server busy'}
+        try:
+            # If the request was already received reply to it, so
+            # persistent connections get the right request id
+            if data is not None:
+                request = Request(conn, addr, data)
+                if not request.replied:
+                    request.reply(reply)
+            else:
+                minestorm.common.send_frame(conn, json.dumps(reply).encode('utf-8'))
+                conn.close()
+        except ( socket.error, RuntimeError ):
+            conn.close()
+
+    def _receive(self, conn):
+        """ Receive a single request from a connection """
+        return minestorm.common.receive_frame(conn, self.max_frame_size)
+
+    def _process(self, conn, addr, data):
+        """ Process a received request """
+        try:
+            self._on_request_recived(conn, addr, data) # Pass the request to the listener
+        except ( socket.error, RuntimeError ):
+            self.logger.warning('Connection with {0} broken'.format(addr))
+            conn.close()
+        finally:
+            self._count('processed')
+
+    def _count(self, counter):
+        """ Increment a counter """
+        with self._stats_lock:
+            self.stats[counter] += 1
+
     # Events called by ListenerThread
 
+    def _on_frame_compressed(self, original, compressed, cpu_time):
+        """ Event called by requests when a frame is compressed """
+        with self._stats_lock:
+            self.compression_stats['frames'] += 1
+            self.compression_stats['original_bytes'] += original
+            self.compression_stats['compressed_bytes'] += compressed
+            self.compression_stats['cpu_time'] += cpu_time
+        self.logger.debug('Compressed a frame from {0} to {1} bytes (ratio {2:.2f}) in {3:.3f}ms'.format(original, compressed, original / max(compressed, 1), cpu_time * 1000))
+
     def _on_request_recived(self, conn, addr, data):
         """ Event called by ListenerThread when a new request was recived """
         request = Request(conn, addr, data)
@@ -94,27 +288,124 @@ class Request:
         self.replied = False
         self.connection = conn
         self.address = addr
+        self.request_id = None
         try:
             self.data = json.loads(data.decode("utf-8")) # Decode json request
         # Catch invalid json input
         except ( SyntaxError, ValueError) as e:
             self.data = {}
             self.reply({'status': 'invalid_request', 'reason': 'Invalid JSON: {0!s}'.format(e)}) # Reply invalid_request
+            return
+        # Requests tagged with an id switch the connection to the
+        # multiplexed mode, which keeps it open after the reply
+        if isinstance(self.data, dict) and 'request_id' in self.data:
+            self.request_id = self.data['request_id']
+            self.connection.make_persistent()
 
     def reply(self, data):
         """ Reply to the request and shutdown the socket """
         if not self.replied:
             self.replied = True
-            encoded = json.dumps(data).encode('utf-8') # Prepare the reply
-            length = struct.pack('I', len(encoded)) # Get the length
-            # Send the reply
-            minestorm.common.send_packet(self.connection, length)
-            minestorm.common.send_packet(self.connection, encoded)
-            # Shutdown the connection
-            self.connection.close()
+            self._send(data)
+            # Shutdown the connection, unless it's a persistent one
+            if not self.connection.persistent:
+                self.connection.close()
         else:
             raise RuntimeError('Something already replied to this request')
 
+    def push(self, data):
+        """ Send a message to the client without closing the connection """
+        if not self.replied:
+            self._send(data)
+        else:
+            raise RuntimeError('Something already replied to this request')
+
+    def reply_chunked(self, chunks):
+        """ Reply to the request sending every chunk as soon as it's available """
+        if self.replied:
+            raise RuntimeError('Something already replied to this request')
+        count = 0
+        # Each chunk is encoded and sent as soon as it's produced, so
+        # the whole response is never kept in memory
+        for chunk in chunks:
+            self._send({ 'status': 'chunk', 'data': chunk })
+            count += 1
+        # Send the terminator frame
+        self.reply({ 'status': 'chunks_end', 'count': count })
+
+    def _send(self, data):
+        """ Send a frame to the client """
+        # Tag the frame with the request id in the multiplexed mode
+        if self.request_id is not None:
+            data = data.copy()
+            data['request_id'] = self.request_id
+        encoded = json.dumps(data).encode('utf-8') # Prepare the frame
+        encoded, compressed = self._compress(encoded)
+        # Send the frame, preventing other frames on the same
+        # connection from being mixed with this one
+        with self.connection.lock:
+            minestorm.common.send_frame(self.connection, encoded, compressed)
+
+    def _compress(self, encoded):
+        """ Compress a frame, if the client supports it and it's worth it """
+        # The client must tell it supports compression
+        if not isinstance(self.data, dict) or 'zlib' not in self.data.get('compression', ()):
+            return encoded, False
+        configuration = minestorm.get('configuration')
+        if len(encoded) < int( configuration.get('networking.compression.threshold', 4096) ):
+            return encoded, False
+        # Compress the frame, measuring how much CPU time it costs
+        started = time.process_time()
+        compressed = zlib.compress(encoded, int( configuration.get('networking.compression.level', 6) ))
+        elapsed = time.process_time() - started
+        minestorm.get('server.networking')._on_frame_compressed(len(encoded), len(compressed), elapsed)
+        return compressed, True
+
+class Connection:
+    """
+    Wrapper around an accepted socket, shared by all
+    the requests received from it
+    """
+
+    def __init__(self, sock):
+        self.socket = sock
+        self.lock = threading.Lock()
+        self.persistent = False
+        self.on_persistent = None # Called when the connection becomes persistent
+
+    def make_persistent(self):
+        """ Keep the connection open after the replies """
+        if not self.persistent:
+            self.persistent = True
+            if self.on_persistent is not None:
+                self.on_persistent()
+
+    def send(self, data):
+        """ Send some data """
+        return self.socket.send(data)
+
+    def sendmsg(self, buffers):
+        """ Send some buffers with a single call """
+        return self.socket.sendmsg(buffers)
+
+    def recv_into(self, buffer):
+        """ Receive some data into a buffer """
+        return self.socket.recv_into(buffer)
+
+    def is_closed(self):
+        """ Check if the client closed the connection, without
+        consuming the data it may have sent """
+        try:
+            return self.socket.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b''
+        except BlockingIOError:
+            return False # Nothing to read, but still open
+        except socket.error:
+            return True # Broken, or already closed by the server
+
+    def close(self):
+        """ Close the connection """
+        self.socket.close()
+
 class ListenerThread(threading.Thread):
     """
     This thread will listen to a specific port
@@ -123,12 +414,280 @@ class ListenerThread(threading.Thread):
     and I need to continue working after starting the loop
     """
 
-    def __init__(self, listener):
+    def __init__(self, listener, sock=None):
         self.listener = listener
+        self.socket = sock
         self.stop = False
         super(ListenerThread, self).__init__()
 
     def run(self):
         # Stop the loop putting self.stop to false
         while not ( self.stop or minestorm.shutdowned ):
-            self.listener.accept()
+            self.listener.accept(self.socket)
+
+class ListenerWorkerThread(threading.Thread):
+    """
+    This thread takes connections handed off by the
+    listener and process them
+    """
+
+    def __init__(self, listener):
+        self.listener = listener
+        self.stop = False
+        super(ListenerWorkerThread, self).__init__()
+
+    def run(self):
+        # Stop the loop putting self.stop to true
+        while not ( self.stop or minestorm.shutdowned ):
+            # Wait for a connection, checking from time to time if
+            # the thread should be stopped
+            try:
+                function, args = self.listener.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            # Don't let an unexpected error kill the worker, else the
+            # pool would shrink without anyone noticing
+            try:
+                function(*args)
+            except Exception:
+                conn, addr = args[:2]
+                self.listener.logger.exception('Unexpected error while processing a request from {0}'.format(addr))
+                if not conn.persistent:
+                    conn.close()
+
+class ConnectionThread(threading.Thread):
+    """
+    This thread reads the requests sent through a persistent
+    connection and pass them to the listener
+    """
+
+    def __init__(self, listener, conn, addr):
+        self.listener = listener
+        self.conn = conn
+        self.addr = addr
+        super(ConnectionThread, self).__init__()
+        self.daemon = True # Don't prevent the program from exiting
+        with listener._connections_lock:
+            listener.connections.add(conn)
+
+    def run(self):
+        try:
+            while not minestorm.shutdowned:
+                try:
+                    data = self.listener._receive(self.conn)
+                except ( socket.error, RuntimeError, zlib.error ):
+                    # The client closed the connection, or the listener stopped
+                    break
+                self.listener.handle_frame(self.conn, self.addr, data)
+        finally:
+            with self.listener._connections_lock:
+                self.listener.connections.discard(self.conn)
+            self.conn.close()
+
+class AsyncListener(Listener):
+    """
+    Network listener built on top of asyncio
+
+    A single event loop serves all the connections, while the
+    requests are processed by the workers pool, so blocking
+    processors don't stall the loop
+    """
+
+    def __init__(self):
+        super(AsyncListener, self).__init__()
+        self.loop = None
+        self.servers = []
+
+    def listen(self):
+        """ Start the listener """
+        if self.socket and self.binded == True and self.started == False:
+            self.started = True
+            configuration = minestorm.get('configuration')
+            # Start the pool which will run processors
+            self._start_workers()
+            if not self.workers:
+                raise RuntimeError('The asyncio engine requires networking.workers.pool_size to be greater than 0')
+            # Start the event loop in its own thread
+            self.loop = asyncio.new_event_loop()
+            self.thread = AsyncListenerThread(self)
+            self.thread.start()
+            # Start serving the binded socket
+            backlog = int( configuration.get('networking.backlog', 128) )
+            future = asyncio.run_coroutine_threadsafe(self._start_server(backlog), self.loop)
+            future.result()
+            self.logger.info('Now listening for new connections')
+        else:
+            raise RuntimeError('Listener already started')
+
+    def stop(self):
+        """ Stop the listener """
+        if self.started == True or self.binded == True:
+            # Reset variables
+            self.binded = False
+            self.started = False
+            # Stop the loop if it was started, it will also close the socket
+            if self.loop:
+                self.loop.call_soon_threadsafe(self._stop_loop)
+                self.thread = None
+            else:
+                self.socket.close()
+            self.socket = None
+            # The loop closes the Unix socket too, only its file must be removed
+            if self.unix_path and os.path.exists(self.unix_path):
+                os.unlink(self.unix_path)
+            self.unix_socket = None
+            self.unix_path = None
+            # Stop all the workers
+            for worker in self.workers:
+                worker.stop = True
+            self.workers = []
+            self.logger.info('Networking stopped!')
+        else:
+            raise RuntimeError('Can\'t stop a stopped server...')
+
+    async def _start_server(self, backlog):
+        """ Start serving the binded sockets """
+        self.servers.append( await asyncio.start_server(self._handle_connection, sock=self.socket, backlog=backlog) )
+        if self.unix_socket:
+            self.servers.append( await asyncio.start_unix_server(self._handle_connection, sock=self.unix_socket, backlog=backlog) )
+
+    def _stop_loop(self):
+        """ Close the servers and stop the loop, must be called from the loop """
+        for server in self.servers:
+            server.close()
+        self.servers = []
+        # Cancel the connections still open, stopping the loop when
+        # all of them are closed
+        tasks = asyncio.all_tasks(self.loop)
+        for task in tasks:
+            task.cancel()
+        asyncio.gather(*tasks, return_exceptions=True).add_done_callback(lambda future: self.loop.stop())
+
+    async def _handle_connection(self, reader, writer):
+        """ Receive the requests sent through a connection """
+        addr = writer.get_extra_info('peername')
+        # Unix sockets don't have an address
+        if not addr:
+            addr = ('unix', self.unix_path)
+        conn = AsyncConnection(self.loop, writer)
+        self._count('accepted')
+        # Continue reading until the client closes the connection, so
+        # persistent connections can carry more requests
+        while True:
+            try:
+                # Get the packet length and the packet
+                length, compressed = minestorm.common.unpack_header( await reader.readexactly(4) )
+                # Reject hostile lengths before reading anything
+                if length > self.max_frame_size:
+                    raise RuntimeError('Frame too large: {} bytes'.format(length))
+                data = await reader.readexactly(length)
+                if compressed:
+                    data = minestorm.common.decompress(data, self.max_frame_size)
+            except ( asyncio.IncompleteReadError, socket.error, zlib.error, RuntimeError ) as e:
+                # Don't complain about connections closed between two requests
+                if not isinstance(e, asyncio.IncompleteReadError) or e.partial:
+                    self.logger.warning('Connection with {0} broken'.format(addr))
+                writer.close()
+                return
+            except asyncio.CancelledError:
+                # The listener is stopping, end the task without
+                # propagating the cancellation to asyncio's callbacks
+                writer.close()
+                return
+            # Hand the request off to the pool
+            self._enqueue(self._process, conn, addr, data)
+
+class AsyncConnection:
+    """
+    Socket-like wrapper around an asyncio stream writer
+
+    It can be used from any thread, so Request.reply
+    works the same way with both listeners
+    """
+
+    def __init__(self, loop, writer):
+        self.loop = loop
+        self.writer = writer
+        self.lock = threading.Lock()
+        self.persistent = False
+        self.send_timeout = float( minestorm.get('configuration').get('networking.send_timeout', 60) )
+
+    def make_persistent(self):
+        """ Keep the connection open after the replies, the event
+        loop is already reading the next requests """
+        self.persistent = True
+
+    def send(self, data):
+        """ Send some data """
+        return self._write([ bytes(data) ])
+
+    def sendmsg(self, buffers):
+        """ Send some buffers with a single call """
+        return self._write([ bytes(buffer) for buffer in buffers ])
+
+    def _write(self, buffers):
+        """ Write some buffers from another thread, waiting while the
+        transport has too much data queued, so a slow client blocks who
+        is sending to it like a socket would, instead of filling the memory """
+        # Fail like a socket if the connection was closed
+        if self.writer.is_closing() or self.loop.is_closed():
+            raise socket.error('Connection closed')
+        # The loop itself can't wait for the transport, for example when
+        # it rejects a request because the pool is busy
+        if self._in_loop():
+            self.writer.writelines(buffers)
+            return sum( len(buffer) for buffer in buffers )
+        try:
+            future = asyncio.run_coroutine_threadsafe(self._drain(buffers), self.loop)
+        except RuntimeError:
+            raise socket.error('Connection closed') # The loop was closed meanwhile
+        try:
+            future.result(self.send_timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise socket.timeout('Timed out sending to the client')
+        except concurrent.futures.CancelledError:
+            raise socket.error('Connection closed') # The listener stopped
+        return sum( len(buffer) for buffer in buffers )
+
+    def is_closed(self):
+        """ Check if the client closed the connection, the event
+        loop closes the writer as soon as it reads the end of the stream """
+        return self.writer.is_closing() or self.loop.is_closed()
+
+    def _in_loop(self):
+        """ Check if the caller is running in the event loop """
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    async def _drain(self, buffers):
+        """ Write some buffers and wait for the transport to accept more """
+        self.writer.writelines(buffers)
+        await self.writer.drain()
+
+    def close(self):
+        """ Schedule the closing of the connection """
+        # The connection was already closed with the loop
+        if self.loop.is_closed():
+            return
+        try:
+            self.loop.call_soon_threadsafe(self.writer.close)
+        except RuntimeError:
+            pass # The loop was closed meanwhile
+
+class AsyncListenerThread(threading.Thread):
+    """
+    This thread runs the event loop of the asyncio listener
+    """
+
+    def __init__(self, listener):
+        self.listener = listener
+        super(AsyncListenerThread, self).__init__()
+
+    def run(self):
+        loop = self.listener.loop
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+        loop.close()
@@ -0,0 +1,329 @@
+#!/usr/bin/python3
+import os
+import mmap
+import array
+import gzip
+import shutil
+import struct
+import time
+import logging
+import threading
+
+class OutputBuffer:
+    """
+    Fixed capacity buffer of output lines
+
+    Every line gets a sequence number, which always increases:
+    when the buffer is full the oldest lines are evicted, but the
+    sequence numbers of the other lines don't change
+    """
+
+    def __init__(self, capacity, next=0):
+        if capacity < 1:
+            raise RuntimeError('Invalid output buffer capacity: {}'.format(capacity))
+        self.capacity = capacity
+        self.lines = [None] * capacity
+        self.times = array.array('d', [0]) * capacity # Time of each line
+        self.next = next # Sequence number of the next line
+        self.start = next # Sequence number of the first line ever added
+        self.lock = threading.Lock()
+
+    @property
+    def first(self):
+        """ Sequence number of the oldest line still available """
+        return max(self.next - self.capacity, self.start)
+
+    def append(self, line, timestamp=None):
+        """ Add a line, returning its sequence number """
+        return self.extend([ line ], timestamp)
+
+    def extend(self, lines, timestamp=None):
+        """ Add some lines printed at the same time, returning the
+        sequence number of the first one """
+        if timestamp is None:
+            timestamp = time.time()
+        with self.lock:
+            first = self.next
+            for line in lines:
+                self.lines[ self.next % self.capacity ] = line
+                self.times[ self.next % self.capacity ] = timestamp
+                self.next += 1
+        return first
+
+    def get(self, sequence):
+        """ Get a line by its sequence number """
+        with self.lock:
+            if not self.first <= sequence < self.next:
+                raise KeyError('Line {} not available'.format(sequence))
+            return self.lines[ sequence % self.capacity ]
+
+    def range(self, start, stop):
+        """ Convert the start and stop points to a range of sequence numbers
+        Negative points are relative to the end, and the stop point is
+        excluded unless it's negative: -1 is the last line
+        It returns a tuple with the first sequence number and the last one, excluded """
+        with self.lock:
+            next = self.next
+        first = start if start >= 0 else max(next+start, 0)
+        last = min(stop, next) if stop >= 0 else next+stop+1
+        return first, max(first, last)
+
+    def retrieve(self, start, stop):
+        """ Retrieve some lines
+        It returns a dict containing lines by their sequence number,
+        and the number of requested lines which were evicted """
+        first, last = self.range(start, stop)
+        with self.lock:
+            evicted = max( min(self.first, last) - first, 0 )
+            lines = { i: self.lines[ i % self.capacity ] for i in range( max(first, self.first), last ) }
+        return lines, evicted
+
+    def slice(self, start, stop, times=False):
+        """ Retrieve some consecutive lines as a list
+        It returns the sequence number of the first line, the list of lines,
+        the list of their times if requested, and the number of requested
+        lines which were evicted """
+        first, last = self.range(start, stop)
+        with self.lock:
+            evicted = max( min(self.first, last) - first, 0 )
+            base = min( max(first, self.first), last )
+            lines = self._ring_slice(self.lines, base, last-base)
+            line_times = self._ring_slice(self.times, base, last-base).tolist() if times else None
+        return base, lines, line_times, evicted
+
+    def _ring_slice(self, ring, base, count):
+        """ Get count items of a ring starting from a sequence number, with
+        at most two slices; must be called with the lock held """
+        start = base % self.capacity
+        if start + count <= self.capacity:
+            return ring[ start : start+count ]
+        return ring[ start : ] + ring[ : start+count-self.capacity ]
+
+    def iter_chunks(self, start, stop, chunk_size):
+        """ Retrieve some lines, yielding chunks of them
+        Every chunk is a dict containing lines by their sequence number,
+        lines evicted in the meantime are skipped """
+        first, last = self.range(start, stop)
+        for chunk_start in range(first, last, chunk_size):
+            lines, evicted = self.retrieve(chunk_start, min(chunk_start+chunk_size, last))
+            if lines:
+                yield lines
+
+    def __len__(self):
+        return self.next - self.first
+
+class OutputLog:
+    """
+    Disk-backed log of output lines, split into segment files
+
+    Each segment has an index, containing the offset and the
+    time of each line, which is used to read ranges of lines
+    through mmap. Old segments are compressed in the background
+    """
+
+    def __init__(self, directory, segment_size, keep_uncompressed=2):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.keep_uncompressed = keep_uncompressed
+        self.segments = []
+        self.lock = threading.Lock()
+        self.compressor = None
+        os.makedirs(directory, exist_ok=True)
+        # Load existing segments, oldest first
+        for name in sorted( os.listdir(directory) ):
+            if name.endswith('.idx'):
+                self.segments.append( LogSegment(directory, int(name[:-4])) )
+        # Continue the last segment, or start the first one
+        if self.segments and not self.segments[-1].compressed:
+            self.segments[-1].open()
+        else:
+            self._new_segment( self.segments[-1].next if self.segments else 0 )
+
+    @property
+    def first(self):
+        """ Sequence number of the oldest line in the log """
+        return self.segments[0].base
+
+    @property
+    def next(self):
+        """ Sequence number of the next line """
+        return self.segments[-1].next
+
+    def append(self, lines, timestamp=None):
+        """ Append some lines to the log """
+        if timestamp is None:
+            timestamp = time.time()
+        with self.lock:
+            self.segments[-1].append(lines, timestamp)
+            # Start a new segment if the current one is full
+            if self.segments[-1].size >= self.segment_size:
+                self.segments[-1].close()
+                self._new_segment( self.segments[-1].next )
+                self._compress_old()
+
+    def retrieve(self, first, last):
+        """ Retrieve lines from first to last, excluded
+        It returns a dict containing lines by their sequence number """
+        with self.lock:
+            segments = list(self.segments)
+        result = {}
+        for segment in segments:
+            # Skip segments outside of the range
+            if segment.next <= first or segment.base >= last:
+                continue
+            result.update( segment.read( max(first, segment.base), min(last, segment.next) ) )
+        return result
+
+    def timestamps(self, first, last):
+        """ Get the times of the lines from first to last, excluded """
+        with self.lock:
+            segments = list(self.segments)
+        result = []
+        for segment in segments:
+            # Skip segments outside of the range
+            if segment.next <= first or segment.base >= last:
+                continue
+            result.extend( timestamp for offset, timestamp in segment.records( max(first, segment.base), min(last, segment.next) ) )
+        return result
+
+    def _new_segment(self, base):
+        """ Start a new segment, must be called with the lock held """
+        segment = LogSegment(self.directory, base)
+        segment.open()
+        self.segments.append(segment)
+
+    def _compress_old(self):
+        """ Compress old segments in the background, must be called with the lock held """
+        # Only one compressor at time
+        if self.compressor is not None and self.compressor.is_alive():
+            return
+        old = [ segment for segment in self.segments[:-self.keep_uncompressed-1] if not segment.compressed ]
+        if old:
+            self.compressor = SegmentsCompressorThread(old)
+            self.compressor.start()
+
+class LogSegment:
+    """
+    A segment of the output log, made of a file with the lines
+    and an index with the offset and the time of each line
+    """
+    record = struct.Struct('<Qd') # Offset and timestamp of a line
+
+    def __init__(self, directory, base):
+        self.base = base
+        self.path = os.path.join(directory, '{:020d}'.format(base))
+        self.compressed = os.path.exists(self.path+'.log.gz')
+        self.file = None
+        self.index = None
+        # Load the size of the segment from the files
+        self.count = os.path.getsize(self.path+'.idx') // self.record.size if os.path.exists(self.path+'.idx') else 0
+        self.size = os.path.getsize(self.path+'.log') if os.path.exists(self.path+'.log') else 0
+
+    @property
+    def next(self):
+        """ Sequence number of the line after the last one """
+        return self.base + self.count
+
+    def open(self):
+        """ Open the segment for appending """
+        self.file = open(self.path+'.log', 'ab')
+        self.index = open(self.path+'.idx', 'ab')
+        # Drop an incomplete index record left by a crash
+        self.index.truncate(self.count * self.record.size)
+        self.index.flush()
+        # And the lines written before the crash without their index
+        # records, since reads expect the indexed lines to be contiguous
+        end = 0
+        if self.count:
+            offset = self.records(self.next-1, self.next)[0][0]
+            with open(self.path+'.log', 'rb') as f:
+                f.seek(offset)
+                end = offset + len( f.readline() )
+        self.file.truncate(end)
+        self.size = end
+
+    def close(self):
+        """ Close the segment """
+        self.file.close()
+        self.index.close()
+        self.file, self.index = None, None
+
+    def append(self, lines, timestamp):
+        """ Append some lines to the segment """
+        records = []
+        data = []
+        for line in lines:
+            encoded = line.encode('utf-8') + b'\n'
+            records.append( self.record.pack(self.size, timestamp) )
+            data.append(encoded)
+            self.size += len(encoded)
+        # Lines must be on the disk before the index points to them
+        self.file.write( b''.join(data) )
+        self.file.flush()
+        self.index.write( b''.join(records) )
+        self.index.flush()
+        self.count += len(lines)
+
+    def records(self, first, last):
+        """ Get the offset and the time of the lines from first to last, excluded """
+        with open(self.path+'.idx', 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as index:
+                start = ( first - self.base ) * self.record.size
+                stop = ( last - self.base ) * self.record.size
+                return list( self.record.iter_unpack(index[start:stop]) )
+
+    def offsets(self, first, last):
+        """ Get the offsets of the lines from first to last, excluded """
+        return [ offset for offset, timestamp in self.records(first, last) ]
+
+    def read(self, first, last):
+        """ Read the lines from first to last, excluded
+        It returns a dict containing lines by their sequence number """
+        if first >= last:
+            return {}
+        offsets = self.offsets(first, last)
+        try:
+            if not self.compressed:
+                data = self._read_mapped(offsets)
+            else:
+                data = self._read_compressed(offsets)
+        except FileNotFoundError:
+            # The segment was just compressed
+            data = self._read_compressed(offsets)
+        lines = data.decode('utf-8', 'replace').split('\n')
+        return { first+i: line for i, line in enumerate( lines[:len(offsets)] ) }
+
+    def _read_mapped(self, offsets):
+        """ Read the lines at the offsets from the uncompressed file """
+        with open(self.path+'.log', 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as log:
+                return log[ offsets[0] : log.find(b'\n', offsets[-1])+1 ]
+
+    def _read_compressed(self, offsets):
+        """ Read the lines at the offsets from the compressed file """
+        with gzip.open(self.path+'.log.gz', 'rb') as f:
+            f.seek(offsets[0])
+            return b''.join( f.readline() for offset in offsets )
+
+    def compress(self):
+        """ Compress the segment """
+        with open(self.path+'.log', 'rb') as source:
+            with gzip.open(self.path+'.log.gz.tmp', 'wb') as destination:
+                shutil.copyfileobj(source, destination)
+        os.rename(self.path+'.log.gz.tmp', self.path+'.log.gz')
+        self.compressed = True
+        os.unlink(self.path+'.log')
+
+class SegmentsCompressorThread(threading.Thread):
+    """ This thread compresses old segments of the output log """
+
+    def __init__(self, segments):
+        super(SegmentsCompressorThread, self).__init__() # Run the parent constructor
+        self.segments = segments
+
+    def run(self):
+        for segment in self.segments:
+            try:
+                segment.compress()
+            except OSError as e:
+                logging.getLogger('minestorm.servers').error('Unable to compress the log segment {0}: {1!s}'.format(segment.path, e))
@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+import re
+import minestorm
+
+# Prefix printed by each server type before the message
+PREFIXES = {
+    'vanilla': r'(?:\[[\d:]+\] )?\[[^\]]*/(?P<level>\w+)\]: ',
+    'bukkit': r'\[[\d:]+ (?P<level>\w+)\]: ',
+    'spigot': r'\[[\d:]+ (?P<level>\w+)\]: ',
+    'bungeecord': r'[\d:]+ \[(?P<level>\w+)\] ',
+}
+
+# Patterns of the messages printed by Minecraft servers
+MINECRAFT_PATTERNS = [
+    ( 'joined', r'(?P<player>\w+) joined the game' ),
+    ( 'left', r'(?P<player>\w+) left the game' ),
+    ( 'chat', r'(?:\[Not Secure\] )?<(?P<player>[^>]+)> (?P<message>.*)' ),
+    ( 'lag', r'Can\'t keep up!(?:.*Running (?P<milliseconds>\d+)ms)?' ),
+    ( 'ready', r'Done \((?P<seconds>[\d.,]+)s\)!' ),
+    ( 'stopping', r'Stopping (?:the )?server' ),
+    ( 'exception', r'(?:Exception in thread "[^"]*" )?(?P<exception>(?:[a-zA-Z_$][\w$]*\.)+[\w$]*(?:Exception|Error))(?:: (?P<message>.*))?$' ),
+]
+
+# Patterns of the messages printed by Bungeecord
+BUNGEECORD_PATTERNS = [
+    ( 'joined', r'\[(?P<player>\w+)(?:,[^\]]*)?\] <-> InitialHandler has connected' ),
+    ( 'left', r'\[(?P<player>\w+)(?:,[^\]]*)?\] -> UpstreamBridge has disconnected' ),
+    ( 'lag', r'Can\'t keep up!(?:.*Running (?P<milliseconds>\d+)ms)?' ),
+    ( 'ready', r'Listening on /(?P<address>\S+)' ),
+    ( 'stopping', r'Closing listener' ),
+    ( 'exception', r'(?P<exception>(?:[a-zA-Z_$][\w$]*\.)+[\w$]*(?:Exception|Error))(?:: (?P<message>.*))?$' ),
+]
+
+PATTERNS = {
+    'vanilla': MINECRAFT_PATTERNS,
+    'bukkit': MINECRAFT_PATTERNS,
+    'spigot': MINECRAFT_PATTERNS,
+    'bungeecord': BUNGEECORD_PATTERNS,
+}
+
+# Kinds of lines recognized by the parsers
+KINDS = ( 'joined', 'left', 'chat', 'lag', 'ready', 'stopping', 'exception' )
+
+class LineParser:
+    """
+    Parser of the output lines of a server type
+
+    All the patterns are combined into a single regex, and the
+    kind of each line is got from the name of the matched group,
+    so every line is matched only once
+    """
+
+    def __init__(self, prefix, patterns):
+        self.fields = {}
+        alternatives = []
+        for kind, pattern in patterns:
+            # Prefix the groups with the kind, so their names are unique
+            # in the combined regex
+            fields = re.compile(pattern).groupindex.keys()
+            for field in fields:
+                pattern = pattern.replace('(?P<{}>'.format(field), '(?P<{}__{}>'.format(kind, field))
+            self.fields[kind] = [ ( '{}__{}'.format(kind, field), field ) for field in fields ]
+            alternatives.append( '(?P<{}>{})'.format(kind, pattern) )
+        # The prefix is optional, some lines are printed without it
+        self.regex = re.compile( '(?:{})?(?:{})'.format( prefix, '|'.join(alternatives) ) )
+
+    def parse(self, line):
+        """ Parse a line
+        It returns a tuple with the kind of the line and its fields,
+        or None if the line isn't recognized """
+        match = self.regex.match(line)
+        if match is None:
+            return None
+        # The group of the kind is the outer one, so it's the last closed
+        kind = match.lastgroup
+        fields = { field: match.group(group) for group, field in self.fields[kind] }
+        fields['level'] = match.group('level')
+        return kind, fields
+
+_parsers = {}
+
+def parser(type):
+    """ Get the parser of a server type, compiling it only once """
+    if type not in _parsers:
+        if type not in PATTERNS:
+            raise RuntimeError('No parser for the server type: {}'.format(type))
+        _parsers[type] = LineParser( PREFIXES[type], PATTERNS[type] )
+    return _parsers[type]
+
+def create_events():
+    """ Create the events triggered for parsed lines """
+    for kind in KINDS:
+        minestorm.get('events').create('server.output.{}'.format(kind))
@@ -1,7 +1,11 @@
 #!/usr/bin/python3
 import logging
+import math
+import socket
+import threading
 import minestorm
 import minestorm.server.networking
+import minestorm.server.subscribers
 import minestorm.common.resources
 
 class RequestSorter( minestorm.common.resources.ResourceWrapper ):
@@ -69,6 +73,30 @@ class BaseProcessor:
         """ Process the request """
         pass
 
+    def submit_job(self, request, function):
+        """ Run the function as a background job, replying with its id """
+        job = minestorm.get('server.jobs').submit(self.name, function)
+        request.reply({ 'status': 'job_created', 'job': job.id })
+
+    def _number(self, request, key, default=None, minimum=None, integer=False):
+        """ Get a number provided by the client, None if it's missing
+        It raises a ValueError with the reason if the number isn't valid """
+        value = request.data.get(key, default)
+        if value is None:
+            return None
+        # Booleans are numbers for Python, but not for the clients
+        if isinstance(value, bool):
+            raise ValueError('Invalid {}: it must be a number'.format(key))
+        try:
+            number = float(value)
+        except ( TypeError, ValueError ):
+            raise ValueError('Invalid {}: it must be a number'.format(key))
+        if not math.isfinite(number) or ( integer and not number.is_integer() ):
+            raise ValueError('Invalid {}: it must be {}'.format(key, 'an integer' if integer else 'a finite number'))
+        if minimum is not None and number < minimum:
+            raise ValueError('Invalid {}: it must be at least {}'.format(key, minimum))
+        return int(number) if integer else number
+
     def __repr__(self):
         return '<Request processor for \'{0}\'>'.format(self.name)
 
@@ -115,9 +143,14 @@ class StartAllServersProcessor(BaseProcessor):
     require_sid = True
 
     def process(self, request):
+        # Start servers in the background if requested, the job will
+        # finish when all of them are ready
+        if request.data.get('background', False):
+            self.submit_job(request, lambda job: minestorm.get('server.servers').start_all(job.update, True))
+            return
         try:
             minestorm.get('server.servers').start_all()
-        except RuntimeError:
+        except RuntimeError as e:
             request.reply({ 'status': 'failed', 'reason': str(e) })
         else:
             request.reply({'status': 'ok'})
@@ -135,9 +168,14 @@ class StopAllServersProcessor(BaseProcessor):
     def process(self, request):
         # Get the stop message
         stop_message = request.data['message'] if 'message' in request.data else None
+        # Stop servers in the background if requested, the job
+        # will finish when all of them are stopped
+        if request.data.get('background', False):
+            self.submit_job(request, lambda job: minestorm.get('server.servers').stop_all(stop_message, job.update, True))
+            return
         try:
             minestorm.get('server.servers').stop_all(stop_message)
-        except RuntimeError:
+        except RuntimeError as e:
             request.reply({ 'status': 'failed', 'reason': str(e) })
         else:
             request.reply({'status': 'ok'})
@@ -156,7 +194,14 @@ class StopServerProcessor(BaseProcessor):
         # Get the stop message
         stop_message = request.data['message'] if 'message' in request.data else None
         try:
-            minestorm.get('server.servers').get( request.data['server'] ).stop(stop_message)
+            server = minestorm.get('server.servers').get( request.data['server'] )
+            # Stop the server in the background if requested, the job
+            # will finish when the server is stopped
+            if request.data.get('background', False):
+                server.stop(stop_message)
+                self.submit_job(request, lambda job: self._wait(server, job))
+                return
+            server.stop(stop_message)
         except NameError:
             request.reply({ 'status': 'failed', 'reason': 'Server {} does not exist'.format(request.data['server']) })
         except RuntimeError as e:
@@ -164,6 +209,13 @@ class StopServerProcessor(BaseProcessor):
         else:
             request.reply({'status':'ok'})
 
+    def _wait(self, server, job):
+        """ Wait for the server to stop, killing it if it doesn't stop in time """
+        job.update(0, 1)
+        outcome = server.wait_or_kill()
+        job.update(1, 1)
+        return outcome
+
 class NewSessionProcessor(BaseProcessor):
     """
     New session processor
@@ -213,6 +265,8 @@ class CommandProcessor(BaseProcessor):
         if server.status == server.STATUS_STARTED:
             server.command( request.data['command'] ) # Execute the command
             request.reply({ 'status': 'ok' })
+        elif server.status == server.STATUS_STARTING:
+            request.reply({ 'status': 'failed', 'reason': 'Server {} is not ready yet'.format(server.details['name']) })
         else:
             request.reply({ 'status': 'failed', 'reason': 'Server {} is not running'.format(server.details['name']) })
 
@@ -243,11 +297,394 @@ class RetrieveLinesProcessor(BaseProcessor):
         start, stop = int(request.data['start']), int(request.data['stop'])
         # Check if the server exists
         if request.data['server'] in minestorm.get('server.servers').servers:
-            # Get requested lines
-            lines = minestorm.get('server.servers').get( request.data['server'] ).retrieve_lines( start, stop )
+            server = minestorm.get('server.servers').get( request.data['server'] )
+            # Send lines in chunks if requested, without building the whole response
+            # Clients supporting it can receive a list of lines with the
+            # sequence number of the first one, instead of a dict
+            compact = request.data.get('compact', False)
+            times = request.data.get('times', False)
+            if request.data.get('chunked', False):
+                chunk_size = int( request.data.get('chunk_size', minestorm.get('configuration').get('networking.chunk_size', 1000)) )
+                if chunk_size < 1:
+                    request.reply({ 'status': 'failed', 'reason': 'Invalid chunk size' })
+                else:
+                    request.reply_chunked( server.iter_lines(start, stop, chunk_size, compact, times) )
+                return
             # Build response
             result = { 'status': 'retrieve_lines_response' }
-            result['lines'] = lines
+            if compact:
+                base, lines, line_times, evicted = server.retrieve_compact( start, stop, times )
+                result.update( server.compact_lines(base, lines, line_times) )
+            else:
+                lines, evicted = server.retrieve_output( start, stop )
+                result['lines'] = lines
+            result['first_available'] = server.first_available_line()
+            result['next'] = server.output.next
+            result['evicted'] = evicted
             request.reply(result)
         else:
             request.reply({ 'status': 'failed', 'reason': 'Invalid server' })
+
+class SearchLinesProcessor(BaseProcessor):
+    """
+    Search lines processor
+
+    Search the output of a server for a substring or a regex,
+    optionally in a time range, returning the last matching lines
+    """
+    name = 'search_lines'
+    require_sid = True
+
+    def process(self, request):
+        # Check if the server exists
+        if request.data.get('server') not in minestorm.get('server.servers').servers:
+            request.reply({ 'status': 'failed', 'reason': 'Invalid server' })
+            return
+        if not request.data.get('query'):
+            request.reply({ 'status': 'failed', 'reason': 'Please provide a query' })
+            return
+        server = minestorm.get('server.servers').get( request.data['server'] )
+        # Don't return more lines than the configured limit
+        max_results = minestorm.get('configuration').get('servers.search_index.max_results', 1000)
+        try:
+            limit = min( self._number(request, 'limit', 100, integer=True), max_results )
+            since, until = self._number(request, 'since'), self._number(request, 'until')
+        except ValueError as e:
+            request.reply({ 'status': 'invalid_request', 'reason': str(e) })
+            return
+        try:
+            matches, truncated = server.search_lines( request.data['query'],
+                                                      regex = request.data.get('regex', False),
+                                                      ignore_case = request.data.get('ignore_case', False),
+                                                      since = since,
+                                                      until = until,
+                                                      limit = limit )
+        except RuntimeError as e:
+            request.reply({ 'status': 'failed', 'reason': str(e) })
+        else:
+            request.reply({ 'status': 'search_lines_response', 'matches': matches, 'truncated': truncated, 'first_indexed': server.search.base })
+
+class MetricsHistoryProcessor(BaseProcessor):
+    """
+    Metrics history processor
+
+    Returns the history of the RAM, CPU, lines per second and
+    players of a server, at the finest resolution covering the
+    requested time range unless a resolution is provided
+    """
+    name = 'metrics_history'
+    require_sid = True
+
+    def process(self, request):
+        # Check if the server exists
+        if request.data.get('server') not in minestorm.get('server.servers').servers:
+            request.reply({ 'status': 'failed', 'reason': 'Invalid server' })
+            return
+        server = minestorm.get('server.servers').get( request.data['server'] )
+        if server.metrics is None:
+            request.reply({ 'status': 'failed', 'reason': 'The metrics history is disabled' })
+            return
+        # Return only the requested metrics
+        names = request.data.get('metrics', server.metrics.names)
+        if any( name not in server.metrics.names for name in names ):
+            request.reply({ 'status': 'failed', 'reason': 'Invalid metrics' })
+            return
+        try:
+            since, until = self._number(request, 'since'), self._number(request, 'until')
+            resolution = self._number(request, 'resolution', integer=True)
+        except ValueError as e:
+            request.reply({ 'status': 'invalid_request', 'reason': str(e) })
+            return
+        try:
+            resolution, times, columns = server.metrics.query( since = since, until = until, resolution = resolution )
+        except RuntimeError as e:
+            request.reply({ 'status': 'failed', 'reason': str(e) })
+            return
+        result = { 'status': 'metrics_history_response' }
+        result['resolution'] = resolution
+        result['resolutions'] = server.metrics.resolutions
+        result['times'] = times
+        result['metrics'] = { name: columns[name] for name in names }
+        request.reply(result)
+
+class StartupHistoryProcessor(BaseProcessor):
+    """
+    Startup history processor
+
+    Returns the last starts of a server, with the time each
+    of them needed to be ready, grouped also by how the class
+    data archive was used
+    """
+    name = 'startup_history'
+    require_sid = True
+
+    def process(self, request):
+        # Check if the server exists
+        if request.data.get('server') not in minestorm.get('server.servers').servers:
+            request.reply({ 'status': 'failed', 'reason': 'Invalid server' })
+            return
+        try:
+            limit = self._number(request, 'limit', 20, minimum=1, integer=True)
+        except ValueError as e:
+            request.reply({ 'status': 'invalid_request', 'reason': str(e) })
+            return
+        server = minestorm.get('server.servers').get( request.data['server'] )
+        result = { 'status': 'startup_history_response' }
+        result['starts'] = server.startups.last(limit)
+        result['summary'] = server.startups.summary()
+        # Compare the starts with and without the class data archive
+        result['cds'] = server.startups.compare('cds', 'off')
+        request.reply(result)
+
+class SubscribeLinesProcessor(BaseProcessor):
+    """
+    Subscribe lines processor
+
+    Keep the connection open, pushing every new line printed
+    by a server. Lines before the subscription can be replayed
+    providing a start index, and the policy decides what to do
+    when the client can't keep up
+    """
+    name = 'subscribe_lines'
+    require_sid = True
+
+    def process(self, request):
+        # Check if the server exists
+        if request.data.get('server') not in minestorm.get('server.servers').servers:
+            request.reply({ 'status': 'failed', 'reason': 'Invalid server' })
+        # Subscriptions need a real connection
+        elif request.connection is None:
+            request.reply({ 'status': 'failed', 'reason': 'Subscriptions can\'t be batched' })
+        elif request.data.get('policy') not in ( None, ) + minestorm.server.subscribers.POLICIES:
+            request.reply({ 'status': 'failed', 'reason': 'Invalid policy' })
+        else:
+            LinesSubscription(request, request.data['server'], request.data.get('start'), request.data.get('policy')).start()
+
+class LinesSubscription:
+    """
+    A subscription to the output of a server, which pushes
+    every line to the client with its index
+    """
+
+    def __init__(self, request, server, start=None, policy=None):
+        self.request = request
+        self.server = server
+        self.start_index = start
+        self.policy = policy
+        self.ready = False
+        self.stopped = False
+        self.pending = []
+        self.lock = threading.Lock()
+
+    def start(self):
+        """ Start the subscription """
+        manager = minestorm.get('server.servers')
+        # Check the client is still connected while the server prints
+        # nothing, pushing the lines would be the only other way to notice
+        manager.subscribe(self.on_line, {}, index_name='index', policy=self.policy, name='subscribe_lines:{}'.format(self.server),
+                          on_idle=self.check_client)
+        # Lines are pushed without holding the lock, so the subscriber
+        # thread is held only while the pending list is swapped
+        try:
+            self.request.push({ 'status': 'subscribed', 'server': self.server })
+            # Replay old lines if requested
+            last = -1
+            if self.start_index is not None:
+                lines = manager.get(self.server).retrieve_lines( int(self.start_index), -1 )
+                for index, line in sorted(lines.items()):
+                    self._push(index, line)
+                    last = index
+            # Push lines printed in the meantime, skipping replayed ones,
+            # until no more lines are pending
+            while True:
+                with self.lock:
+                    pending = self.pending
+                    if not pending:
+                        self.pending = None
+                        self.ready = True
+                        break
+                    self.pending = []
+                for index, line in pending:
+                    if index > last:
+                        self._push(index, line)
+        except ( socket.error, RuntimeError ):
+            self.stop()
+
+    def stop(self):
+        """ Stop the subscription """
+        with self.lock:
+            if self.stopped:
+                return
+            self.stopped = True
+        minestorm.get('server.servers').unsubscribe(self.on_line)
+        # End only this subscription with a final message, the
+        # connection may be carrying other requests
+        try:
+            self.request.reply({ 'status': 'unsubscribed', 'server': self.server })
+        except ( socket.error, RuntimeError ):
+            # The client went away
+            if not self.request.connection.persistent:
+                self.request.connection.close()
+
+    def check_client(self):
+        """ Stop the subscription if the client went away """
+        if not self.stopped and self.request.connection.is_closed():
+            self.stop()
+
+    def on_line(self, server, line, index):
+        """ Method called when a line is printed """
+        if server != self.server or self.stopped:
+            return
+        # Keep the line aside while old lines are being replayed
+        if not self.ready:
+            with self.lock:
+                if self.pending is not None:
+                    self.pending.append( (index, line) )
+                    return
+        try:
+            self._push(index, line)
+        except ( socket.error, RuntimeError ):
+            # The client went away
+            self.stop()
+
+    def _push(self, index, line):
+        """ Push a line to the client """
+        self.request.push({ 'status': 'line', 'server': self.server, 'index': index, 'line': line })
+
+class StatsProcessor(BaseProcessor):
+    """
+    Stats processor
+
+    Returns counters about the work done by the daemon
+    """
+    name = 'stats'
+    require_sid = True
+
+    def process(self, request):
+        result = { 'status': 'stats_response' }
+        result['networking'] = minestorm.get('server.networking').get_stats()
+        result['subscribers'] = minestorm.get('server.servers').subscribers_stats()
+        request.reply(result)
+
+class JobStatusProcessor(BaseProcessor):
+    """
+    Job status processor
+
+    Returns the status and the progress of a background job
+    """
+    name = 'job_status'
+    require_sid = True
+
+    def process(self, request):
+        try:
+            job = minestorm.get('server.jobs').get( request.data.get('job') )
+        except KeyError:
+            request.reply({ 'status': 'failed', 'reason': 'Invalid job' })
+        else:
+            request.reply({ 'status': 'job_status_response', 'job': job.details() })
+
+class WaitProcessor(BaseProcessor):
+    """
+    Wait processor
+
+    Wait for a background job to finish, up to a timeout,
+    and returns its status. The reply is sent when the job
+    finishes, so no networking worker is busy while waiting
+    """
+    name = 'wait'
+    require_sid = True
+
+    def process(self, request):
+        # Don't allow waiting more than the configured limit
+        max_timeout = minestorm.get('configuration').get('jobs.max_wait', 60)
+        try:
+            timeout = min( self._number(request, 'timeout', max_timeout, minimum=0), max_timeout )
+        except ValueError as e:
+            request.reply({ 'status': 'invalid_request', 'reason': str(e) })
+            return
+        manager = minestorm.get('server.jobs')
+        try:
+            job = manager.get( request.data.get('job') )
+        except KeyError:
+            request.reply({ 'status': 'failed', 'reason': 'Invalid job' })
+            return
+        # Batches collect replies before returning, so they get the
+        # current status without waiting
+        if request.connection is None:
+            self._reply(request, job)
+            return
+        manager.notify(job, timeout, lambda job: self._reply(request, job))
+
+    def _reply(self, request, job):
+        """ Reply with the status of the job """
+        try:
+            request.reply({ 'status': 'job_status_response', 'job': job.details() })
+        except ( socket.error, RuntimeError ):
+            pass # The client went away
+
+class BatchProcessor(BaseProcessor):
+    """
+    Batch processor
+
+    Process a list of requests, replying with the ordered
+    list of their responses. Every request is checked with
+    the SID of the batch, so requests after a remove_session
+    are refused
+    """
+    name = 'batch'
+    require_sid = True
+
+    def process(self, request):
+        # A list of requests is needed
+        if not isinstance(request.data.get('requests'), list):
+            request.reply({ 'status': 'failed', 'reason': 'Please provide a list of requests' })
+            return
+        sorter = minestorm.get('server.requests')
+        responses = []
+        for data in request.data['requests']:
+            # Every request must be a dict
+            if not isinstance(data, dict):
+                responses.append({ 'status': 'invalid_request', 'reason': 'Invalid request' })
+                continue
+            # Don't allow batches into batches
+            if data.get('status') == self.name:
+                responses.append({ 'status': 'failed', 'reason': 'Nested batches are not allowed' })
+                continue
+            # Process the request with the batch SID, an error in a
+            # request must not lose the responses of the other ones
+            item = BatchedRequest(request, data)
+            try:
+                sorter.sort(item)
+            except Exception:
+                logging.getLogger('minestorm.request').exception('Unexpected error while processing a batched {0} request'.format(data.get('status')))
+                responses.append({ 'status': 'failed', 'reason': 'Internal error' })
+                continue
+            responses.append(item.response if item.replied else { 'status': 'failed', 'reason': 'No response' })
+        request.reply({ 'status': 'batch_response', 'responses': responses })
+
+class BatchedRequest( minestorm.server.networking.Request ):
+    """
+    A request which is part of a batch, its reply is
+    collected instead of being sent
+    """
+
+    def __init__(self, batch, data):
+        self.replied = False
+        self.connection = None
+        self.address = batch.address
+        self.request_id = None
+        self.response = None
+        self.data = data.copy()
+        self.data['sid'] = batch.data['sid']
+
+    def reply(self, data):
+        """ Collect the reply """
+        if not self.replied:
+            self.replied = True
+            self.response = data
+        else:
+            raise RuntimeError('Something already replied to this request')
+
+    def reply_chunked(self, chunks):
+        """ Collect all the chunks into a single reply """
+        self.reply({ 'status': 'chunks_response', 'chunks': list(chunks) })
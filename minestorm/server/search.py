@@ -0,0 +1,191 @@
+#!/usr/bin/python3
+import re
+import array
+import bisect
+import threading
+
+class WordIndex:
+    """
+    Index of the words contained in the output lines
+
+    Lines are added in order, with their sequence number and time;
+    every word points to the sorted list of lines containing it
+    """
+    tokenizer = re.compile(r'\w\w+') # Single characters aren't indexed
+    gram_size = 3 # Size of the pieces of the words indexed to find them by fragments
+
+    def __init__(self, next=0):
+        self.words = {}
+        self.grams = {} # Words containing each trigram, to avoid scanning the vocabulary
+        self.base = next # Sequence number of the first indexed line
+        self.times = array.array('d') # Time of each indexed line
+        self.lock = threading.Lock()
+
+    @property
+    def next(self):
+        """ Sequence number of the next line """
+        return self.base + len(self.times)
+
+    def add(self, first, lines, timestamp):
+        """ Index some lines, starting from the sequence number first """
+        with self.lock:
+            # Lines must follow the indexed ones
+            if first != self.next:
+                raise RuntimeError('Lines must be indexed in order')
+            for i, line in enumerate(lines):
+                for word in set( self.tokenizer.findall( line.lower() ) ):
+                    if word not in self.words:
+                        self.words[word] = array.array('Q')
+                        for gram in self._grams(word):
+                            self.grams.setdefault(gram, set()).add(word)
+                    self.words[word].append(first+i)
+                self.times.append(timestamp)
+
+    def prune(self, first):
+        """ Remove lines older than the sequence number first """
+        with self.lock:
+            if first <= self.base:
+                return
+            first = min(first, self.next)
+            for word, sequences in list(self.words.items()):
+                del sequences[ : bisect.bisect_left(sequences, first) ]
+                if not sequences:
+                    del self.words[word]
+                    for gram in self._grams(word):
+                        self.grams[gram].discard(word)
+                        if not self.grams[gram]:
+                            del self.grams[gram]
+            del self.times[ : first-self.base ]
+            self.base = first
+
+    def time(self, sequence):
+        """ Get the time of a line, or None if it isn't indexed """
+        with self.lock:
+            if not self.base <= sequence < self.next:
+                return None
+            return self.times[ sequence-self.base ]
+
+    def time_range(self, since=None, until=None):
+        """ Convert a time range to a range of sequence numbers
+        It returns a tuple with the first sequence number and the last one, excluded """
+        with self.lock:
+            first = self.base + ( bisect.bisect_left(self.times, since) if since is not None else 0 )
+            last = self.base + ( bisect.bisect_right(self.times, until) if until is not None else len(self.times) )
+        return first, max(first, last)
+
+    def candidates(self, fragments, first, last):
+        """ Get the lines which may contain all the fragments, in the range
+        A fragment matches all the words containing it; if no fragment is
+        usable all the lines in the range are returned """
+        fragments = set( fragment.lower() for fragment in fragments if len(fragment) > 1 )
+        if not fragments:
+            return range(first, last)
+        with self.lock:
+            # Find the postings of every fragment, limited to the range
+            groups = []
+            for fragment in fragments:
+                slices = []
+                for word in self._words_containing(fragment):
+                    postings = self.words[word]
+                    start = bisect.bisect_left(postings, first)
+                    stop = bisect.bisect_left(postings, last)
+                    if start < stop:
+                        slices.append(( postings, start, stop ))
+                if not slices:
+                    return []
+                groups.append(( sum( stop-start for postings, start, stop in slices ), slices ))
+            # Start from the most selective fragment, and only look up its
+            # lines in the postings of the other ones
+            groups.sort(key=lambda group: group[0])
+            result = self._union( groups[0][1] )
+            for size, slices in groups[1:]:
+                if len(result) * len(slices) < size:
+                    result = [ sequence for sequence in result if any( self._contains(slice, sequence) for slice in slices ) ]
+                else:
+                    sequences = set( self._union(slices) )
+                    result = [ sequence for sequence in result if sequence in sequences ]
+                if not result:
+                    break
+        return result
+
+    def _words_containing(self, fragment):
+        """ Get the indexed words containing a fragment, with the lock held """
+        grams = self._grams(fragment)
+        if not grams:
+            # Fragments shorter than a trigram need a scan of the vocabulary
+            return [ word for word in self.words if fragment in word ]
+        words = None
+        for gram in sorted(grams, key=lambda gram: len( self.grams.get(gram, ()) )):
+            words = set( self.grams.get(gram, ()) ) if words is None else words & self.grams[gram]
+            if not words:
+                return []
+        # Trigrams can appear in a word in another order
+        return [ word for word in words if fragment in word ]
+
+    @classmethod
+    def _grams(cls, word):
+        """ Get the trigrams of a word """
+        return set( word[i:i+cls.gram_size] for i in range( len(word)-cls.gram_size+1 ) )
+
+    @staticmethod
+    def _union(slices):
+        """ Get the sorted sequence numbers in some slices of postings """
+        if len(slices) == 1:
+            postings, start, stop = slices[0]
+            return postings[start:stop].tolist()
+        return sorted( set().union( *( postings[start:stop] for postings, start, stop in slices ) ) )
+
+    @staticmethod
+    def _contains(slice, sequence):
+        """ Check if a slice of postings contains a sequence number """
+        postings, start, stop = slice
+        i = bisect.bisect_left(postings, sequence, start, stop)
+        return i < stop and postings[i] == sequence
+
+def fragments(query, regex=False):
+    """ Extract the words which must be present in lines matching the query
+    With regexes, only literal text outside of groups is considered """
+    if not regex:
+        return re.findall(r'\w+', query)
+    result = []
+    run = ''
+    depth = 0
+    i = 0
+    while i < len(query):
+        char = query[i]
+        if char == '\\':
+            # Escaped characters are never part of words
+            i += 2
+            result.append(run)
+            run = ''
+            continue
+        elif char == '[':
+            # Skip character classes
+            end = query.find(']', i+2)
+            i = end+1 if end != -1 else len(query)
+            result.append(run)
+            run = ''
+            continue
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == '|' and depth == 0:
+            # Alternations make every part optional
+            return []
+        elif char in '*?{':
+            # The previous character is optional
+            run = run[:-1]
+            # Skip the repetitions count
+            if char == '{':
+                end = query.find('}', i)
+                i = end if end != -1 else len(query)
+        elif depth == 0 and re.match(r'\w', char):
+            run += char
+            i += 1
+            continue
+        result.append(run)
+        run = ''
+        i += 1
+    result.append(run)
+    return [ fragment for fragment in result if fragment ]
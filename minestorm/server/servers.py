@@ -1,10 +1,25 @@
 #!/usr/bin/python3
 import subprocess
+import shlex
+import codecs
 import threading
+import selectors
+import queue
+import collections
 import os
+import re
 import logging
 import time
 import minestorm
+import minestorm.server.output
+import minestorm.server.search
+import minestorm.server.parsing
+import minestorm.server.monitoring
+import minestorm.server.metrics
+import minestorm.server.subscribers
+import minestorm.server.history
+import minestorm.server.jvm
+import minestorm.server.cds
 
 class ServersManager:
     """ Manager of all servers """
@@ -13,6 +28,23 @@ class ServersManager:
         self.servers = {}
         self.logger = logging.getLogger('minestorm.servers')
         self.subscribers = []
+        self._subscribers_lock = threading.Lock()
+        # Sample the resources used by all servers from a single place
+        self.sampler = minestorm.server.monitoring.ResourcesSampler(self)
+        self.sampler_thread = None
+        # Watch the output of all servers with a single thread if requested,
+        # which also drives the sampler
+        engine = minestorm.get('configuration').get('servers.output_engine', 'threads')
+        if engine == 'selectors':
+            dispatcher = OutputDispatcher( int( minestorm.get('configuration').get('servers.output_workers', 2) ) )
+            self.reactor = OutputReactor(self.sampler, dispatcher)
+            self.reactor.start()
+        elif engine == 'threads':
+            self.reactor = None
+            self.sampler_thread = minestorm.server.monitoring.UsageSamplerThread(self.sampler)
+            self.sampler_thread.start()
+        else:
+            raise RuntimeError('Invalid output engine: {0}'.format(engine))
 
     def register(self, details):
         """ Register a new server """
@@ -28,19 +60,101 @@ class ServersManager:
         else:
             raise RuntimeError('Server already exists: {0}'.format(details['name']))
 
-    def start_all(self):
-        """ Start all servers """
-        for name, server in self.servers.items():
-            # Start the server only if it isn't already started
-            if server.status in (server.STATUS_STOPPED, server.STATUS_CRASHED):
-                server.start()
+    def start_all(self, progress=None, wait=False):
+        """ Start all servers, in the declared order
+        If wait is true servers are started in parallel, up to the configured
+        concurrency, waiting for each of them to be ready, and every order
+        group starts only when the previous one is ready
+        The progress function, if provided, is called after each server
+        It returns the time needed to start servers and their outcome """
+        return self._bulk( self._start_one, self._waves(), progress, wait, 'Started' )
 
-    def stop_all(self, message=None):
-        """ Stop all servers """
-        for name, server in self.servers.items():
-            # Stop the server only if it's started
-            if server.status == server.STATUS_STARTED:
-                server.stop(message)
+    def stop_all(self, message=None, progress=None, wait=False):
+        """ Stop all servers, in the reverse of the declared order
+        If wait is true servers are stopped in parallel, up to the configured
+        concurrency, waiting for each of them to exit, and every order group
+        is stopped only when the previous one is stopped
+        The progress function, if provided, is called after each server
+        It returns the time needed to stop servers and their outcome """
+        return self._bulk( lambda server, wait: self._stop_one(server, message, wait), self._waves(reverse=True), progress, wait, 'Stopped' )
+
+    def _waves(self, reverse=False):
+        """ Group servers by their declared order
+        Bungeecord is started after the other servers by default """
+        waves = {}
+        for server in self.servers.values():
+            order = server.details.get('order', 1 if server.details['type'] == 'bungeecord' else 0)
+            waves.setdefault(order, []).append(server)
+        return [ waves[order] for order in sorted(waves, reverse=reverse) ]
+
+    def _bulk(self, function, waves, progress, wait, action):
+        """ Call the function with every server, a group at time """
+        started_at = time.time()
+        total = sum( len(wave) for wave in waves )
+        result = { 'servers': {} }
+        lock = threading.Lock()
+        def run(server):
+            """ Run the function with a server, reporting the progress """
+            server_started_at = time.time()
+            # An error is the outcome of this server, the other ones are
+            # still started or stopped
+            try:
+                outcome = { 'result': function(server, wait) }
+            except Exception as e:
+                self.logger.exception('Unexpected error with the server {}'.format(server.details['name']))
+                outcome = { 'result': 'failed', 'error': str(e) }
+            outcome['seconds'] = time.time() - server_started_at
+            with lock:
+                result['servers'][ server.details['name'] ] = outcome
+                if progress is not None:
+                    progress(len(result['servers']), total)
+        if wait:
+            # Limit the servers handled at the same time
+            slots = threading.Semaphore( max( int( minestorm.get('configuration').get('servers.bulk_concurrency', 2) ), 1 ) )
+            for wave in waves:
+                workers = [ BulkWorkerThread(run, server, slots) for server in wave ]
+                for worker in workers:
+                    worker.start()
+                # Wait for the whole group
+                for worker in workers:
+                    worker.join()
+        else:
+            for wave in waves:
+                for server in wave:
+                    run(server)
+        result['seconds'] = time.time() - started_at
+        if wait:
+            self.logger.info('{0} {1} servers in {2:.1f} seconds'.format(action, total, result['seconds']))
+        return result
+
+    def _start_one(self, server, wait):
+        """ Start a server, returning the outcome """
+        # Start the server only if it isn't already started
+        if server.status not in (server.STATUS_STOPPED, server.STATUS_CRASHED):
+            return 'skipped'
+        try:
+            server.start()
+        except RuntimeError:
+            return 'failed'
+        if not wait:
+            return 'started'
+        timeout = minestorm.get('configuration').get('servers.start_timeout', 300)
+        if server.wait_ready(timeout):
+            return 'ready'
+        elif server.stopped.is_set():
+            return 'crashed'
+        self.logger.warning('The server {0} isn\'t ready after {1} seconds'.format(server.details['name'], timeout))
+        return 'timeout'
+
+    def _stop_one(self, server, message, wait):
+        """ Stop a server, returning the outcome """
+        # Stop the server only if it's started
+        if server.status not in (server.STATUS_STARTING, server.STATUS_STARTED):
+            return 'skipped'
+        server.stop(message)
+        if not wait:
+            return 'stopping'
+        return server.wait_or_kill()
 
     def get(self, name):
         """ Get a server """
@@ -49,10 +163,37 @@ class ServersManager:
         else:
             raise NameError('Server {} not found'.format(name))
 
-    def subscribe(self, method, args={}, line_name='line', server_name='server'):
-        """ Subscribe for the output """
+    def subscribe(self, method, args={}, line_name='line', server_name='server', index_name=None, policy=None, name=None, on_idle=None):
+        """ Subscribe for the output
+        Lines are delivered by a dedicated thread, and the policy decides
+        what to do when the subscriber can't keep up. on_idle is called
+        every second while no line is delivered """
+        configuration = minestorm.get('configuration')
+        subscriber = minestorm.server.subscribers.Subscriber( method, args, line_name, server_name, index_name,
+                                                               policy = policy or configuration.get('servers.subscribers.policy', 'drop_oldest'),
+                                                               queue_size = int( configuration.get('servers.subscribers.queue_size', 10000) ),
+                                                               block_timeout = float( configuration.get('servers.subscribers.block_timeout', 0.05) ),
+                                                               sample_every = int( configuration.get('servers.subscribers.sample_every', 10) ),
+                                                               name = name,
+                                                               on_idle = on_idle )
         # Append the subscriber to the list
-        self.subscribers.append( { 'method': method, 'args': args, 'line_name': line_name, 'server_name': server_name } )
+        with self._subscribers_lock:
+            self.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, method):
+        """ Remove a subscription for the output """
+        with self._subscribers_lock:
+            for subscriber in list(self.subscribers):
+                if subscriber.method == method:
+                    subscriber.stop()
+                    self.subscribers.remove(subscriber)
+
+    def subscribers_stats(self):
+        """ Get the counters of all subscribers """
+        with self._subscribers_lock:
+            subscribers = list(self.subscribers)
+        return [ subscriber.stats() for subscriber in subscribers ]
 
     def status(self):
         """ Get the status of all servers """
@@ -62,14 +203,12 @@ class ServersManager:
             result[name] = server.server_status()
         return result
 
-    def _emit_line(self, server, line):
-        """ Emit a line to subscribers """
-        for subscriber in self.subscribers:
-            # Call the method
-            args = subscriber['args']
-            args[subscriber['line_name']] = line
-            args[subscriber['server_name']] = server
-            subscriber['method'](**args)
+    def _emit_lines(self, server, first, lines):
+        """ Emit some lines to subscribers, without waiting for them """
+        with self._subscribers_lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.offer(server, first, lines)
 
 class Server:
     """ Representation of a process """
@@ -88,40 +227,84 @@ class Server:
         self.process = None
         self.pipes = {'in': None, 'out': None}
         self.pid = None
-        self.output = []
+        # Keep only the last lines of output, the number is configurable
+        # for each server
+        scrollback = details.get('scrollback', minestorm.get('configuration').get('servers.scrollback', 10000))
+        # Also save the output on the disk if enabled, continuing the
+        # sequence numbers of the existing log
+        self.log = None
+        if minestorm.get('configuration').get('servers.output_log.enabled', False):
+            directory = os.path.expanduser( minestorm.get('configuration').get('servers.output_log.directory') )
+            self.log = minestorm.server.output.OutputLog( os.path.join(directory, details['name']),
+                                                          int( minestorm.get('configuration').get('servers.output_log.segment_size', 16777216) ),
+                                                          int( minestorm.get('configuration').get('servers.output_log.keep_uncompressed', 2) ) )
+            self.output = minestorm.server.output.OutputBuffer( int(scrollback), self.log.next )
+        else:
+            self.output = minestorm.server.output.OutputBuffer( int(scrollback) )
+        self.parser = minestorm.server.parsing.parser( details['type'] )
+        # Index the words of new lines to speed up searches
+        self.search = None
+        if minestorm.get('configuration').get('servers.search_index.enabled', True):
+            self.search = minestorm.server.search.WordIndex( self.output.next )
+        # Keep the history of the resources usage and of the activity
+        self.metrics = None
+        if minestorm.get('configuration').get('servers.metrics.enabled', True):
+            resolutions = minestorm.get('configuration').get('servers.metrics.resolutions', minestorm.server.metrics.RESOLUTIONS)
+            self.metrics = minestorm.server.metrics.MetricsHistory([ ( step, length ) for step, length in resolutions ])
+        # Record how long every start takes, saving it in the data
+        # directory if configured
+        directory = minestorm.get('configuration').get('servers.data_directory', '')
+        path = os.path.join( os.path.expanduser(directory), details['name'], 'startups.jsonl' ) if directory else None
+        self.startups = minestorm.server.history.StartupHistory( path, int( minestorm.get('configuration').get('servers.startup_history.max_entries', 100) ) )
+        # Share the class data of the jar between starts, saving the
+        # archive in the data directory
+        self.cds = None
+        if details.get('jvm', {}).get('cds', minestorm.get('configuration').get('servers.jvm.cds', False)):
+            if directory:
+                jar = str(details['start_command']['jar'])
+                if 'directory' in details['start_command']:
+                    jar = os.path.join(details['start_command']['directory'], jar)
+                self.cds = minestorm.server.cds.ClassDataArchive( os.path.join( os.path.expanduser(directory), details['name'], 'cds' ), jar,
+                                                                  str( details['start_command'].get('java', 'java') ) )
+            else:
+                logging.getLogger('minestorm.servers').warning('Class data archives need servers.data_directory, disabled for {}'.format(details['name']))
+        self.startup = None # Details of the start in progress, until the server is ready
+        self.startup_timer = None
+        self._startup_lock = threading.Lock()
         self.subscribers = []
         self.watcher = None
-        self.updater = None
         self.change_status(self.STATUS_STOPPED, True)
         self.started_at = None
         self.ram = None
+        self.usage = {}
+        self.players = set() # Players currently online
+        self.lines_mark = None # Time and number of lines at the last sample
+        self.exit_code = None
+        self.stopped = threading.Event()
+        self.stopped.set()
+        self.ready = threading.Event() # Set when the server is ready, or stopped
+        self.ready.set()
 
     def start(self):
         """ Start the server """
         # Allow starting the server only when it's stopped or crashed
         if self.status in (self.STATUS_STOPPED, self.STATUS_CRASHED):
+            # Generate the command, which fails with invalid JVM settings
+            cds_mode, cds_arguments = self.cds.prepare() if self.cds is not None else ( None, [] )
+            command = self.command_line(cds_arguments)
             self.change_status(self.STATUS_STARTING) # Move the status to starting
             try:
-                # Generate the command
-                command = 'java'
-                if 'ram' in self.details['start_command']:
-                    if 'min' in self.details['start_command']['ram']:
-                        command += ' -Xms'+str(self.details['start_command']['ram']['min'])
-                    if 'max' in self.details['start_command']['ram']:
-                        command += ' -Xmx'+str(self.details['start_command']['ram']['max'])
-                command += ' -jar '+str(self.details['start_command']['jar'])
-                if self.details['type'] == 'vanilla':
-                    command += ' nogui'
-                if 'flags' in self.details:
-                    command += ' '+flags
-                # Setup process options
+                # Setup process options, the command is executed
+                # directly without a shell
                 options = {}
-                options['shell'] = True
                 options['stderr'] = subprocess.STDOUT
                 options['stdout'] = subprocess.PIPE
                 options['stdin'] = subprocess.PIPE
+                # Run the server in its own session, so signals sent to the
+                # daemon's process group don't kill it before it's stopped
+                options['start_new_session'] = True
                 # Setup server directory
-                if 'directory' in self.details:
+                if 'directory' in self.details['start_command']:
                     options['cwd'] = self.details['start_command']['directory']
                 else:
                     # If a directory is not passed as detail assume
@@ -129,28 +312,48 @@ class Server:
                     options['cwd'] = os.path.dirname( self.details['start_command']['jar'] )
                 # Start the process
                 self.process = subprocess.Popen(command, **options)
-                self.change_status(self.STATUS_STARTED)
             except OSError:
+                if self.cds is not None:
+                    self.cds.training = None
                 self.change_status(self.STATUS_CRASHED)
                 raise RuntimeError('Unable to start the server')
             else:
                 # Populate informations
                 self.pid = self.process.pid
+                self.exit_code = None
                 self.pipes = {'in': self.process.stdin, 'out': self.process.stdout}
-                self.output = []
-                self.watcher = OutputWatcher(self) # Create an output watcher
-                self.watcher.start()
-                self.updater = UsageInformationsUpdater(self)
-                self.updater.start()
                 self.started_at = time.time() # Set the started at value
+                self.lines_mark = ( self.started_at, self.output.next )
+                self.players = set()
+                self.ready.clear()
+                self.stopped.clear()
+                # The server is starting until it prints that it's ready,
+                # or the timeout expires
+                self.startup = { 'started_at': self.started_at, 'command': command, 'cds': cds_mode }
+                self.startup_timer = threading.Timer( minestorm.get('configuration').get('servers.start_timeout', 300), self._on_start_timeout, [ self.startup ] )
+                self.startup_timer.daemon = True # Don't prevent the program from exiting
+                self.startup_timer.start()
+                # Let the reactor watch the server if enabled, else
+                # start a dedicated thread
+                if self.manager.reactor is not None:
+                    self.manager.reactor.register(self)
+                else:
+                    self.watcher = OutputWatcher(self) # Create an output watcher
+                    self.watcher.start()
         else:
             raise RuntimeError('The server was already started')
 
     def stop(self, message=None):
         """ Stop the server """
-        # If the server is running
-        if self.status == self.STATUS_STARTED:
-            self.change_status(self.STATUS_STOPPING) # Move the status to stopping
+        # If the server is running, or still starting; the status is
+        # changed with the startup lock, so a server getting ready
+        # meanwhile doesn't move it back to started
+        with self._startup_lock:
+            stopping = self.status in (self.STATUS_STARTING, self.STATUS_STARTED)
+            if stopping:
+                self.change_status(self.STATUS_STOPPING) # Move the status to stopping
+        if stopping:
+            self._finish_startup(self.startup, 'stopped')
             command = ''
             # Minecraft/Bukkit/Spigot and Bungeecord have different stop commands
             if self.details['type'] in ( 'vanilla', 'bukkit', 'spigot' ):
@@ -169,6 +372,57 @@ class Server:
         else:
             raise RuntimeError('The server must be started before stopping it')
 
+    def command_line(self, extra=()):
+        """ Get the arguments used to start the server, with some
+        extra arguments for the JVM """
+        command = [ self.details['start_command'].get('java', 'java') ]
+        # Add the heap size and the tuning of the JVM profiles, sized
+        # for the memory available to the container
+        command += minestorm.server.jvm.arguments( self.details,
+                                                   limit = minestorm.server.jvm.memory_limit(),
+                                                   heap_ratio = float( minestorm.get('configuration').get('servers.jvm.heap_ratio', 0.8) ),
+                                                   default_profiles = minestorm.get('configuration').get('servers.jvm.profiles', []),
+                                                   servers = len(self.manager.servers) )
+        command += list(extra)
+        command += [ '-jar', str(self.details['start_command']['jar']) ]
+        if self.details['type'] == 'vanilla':
+            command.append('nogui')
+        # Flags can be a list of arguments or a string, which is splitted
+        # like a shell would do
+        if 'flags' in self.details:
+            flags = self.details['flags']
+            command += shlex.split(flags) if isinstance(flags, str) else [ str(flag) for flag in flags ]
+        return command
+
+    def wait_stopped(self, timeout=None):
+        """ Wait for the server to stop, returning if it stopped """
+        return self.stopped.wait(timeout)
+
+    def wait_ready(self, timeout=None):
+        """ Wait for the server to be ready, returning if it's ready """
+        return self.ready.wait(timeout) and not self.stopped.is_set()
+
+    def wait_or_kill(self, timeout=None):
+        """ Wait for the server to stop, terminating and then killing the
+        process if it doesn't stop in time
+        It returns if the server stopped, was terminated or killed """
+        process = self.process
+        if timeout is None:
+            timeout = minestorm.get('configuration').get('servers.stop_timeout', 120)
+        if self.wait_stopped(timeout) or process is None:
+            return 'stopped'
+        kill_timeout = minestorm.get('configuration').get('servers.kill_timeout', 10)
+        # Ask the process to exit with SIGTERM, then force it with SIGKILL
+        for outcome, signal in ( ( 'terminated', process.terminate ), ( 'killed', process.kill ) ):
+            self.logger.warning('The server {0} didn\'t stop in time, it will be {1}'.format(self.details['name'], outcome))
+            try:
+                signal()
+            except OSError:
+                pass # The process just exited
+            if self.wait_stopped(kill_timeout):
+                return outcome
+        raise RuntimeError('Unable to kill the server {}'.format(self.details['name']))
+
     def command(self, command):
         """ Send a command to the server """
         # Allow sending commands only when the status is starting, started or stopping
@@ -196,146 +450,501 @@ class Server:
             result['started_at'] = self.started_at
             result['uptime'] = time.time() - self.started_at
             result['ram_used'] = self.ram
+            # Details provided by the resources sampler
+            for key in ( 'cpu', 'rss', 'pss', 'read_bytes', 'write_bytes', 'threads', 'processes' ):
+                result[key] = self.usage.get(key)
+            result['players'] = len(self.players)
+        # Provide the exit code of the last run, if any
+        else:
+            result['exit_code'] = self.exit_code
         return result
 
     def retrieve_lines(self, start, stop):
         """ Retrieve some output lines
-        It returns a tuple containing lines and the last index """
-        # If the stop point is negative and greater than the list length
-        # stop will became 0 to prevent exceptions
-        if stop < 0 and len(self.output)+stop < 0:
-            stop = 0
-        # Do the same for the start point
-        if start < 0 and len(self.output)+start < 0 :
-            start = 0
-        # If the stop point is positive and greater than the list length
-        # stop will became -1 to prevent exceptions
-        if stop >= 0 and stop > len(self.output)-1:
-            stop = -1
-        # Do the same for the start point
-        if start >= 0 and start > len(self.output)-1:
-            start = -1
-        # Get the result
-        if stop == -1:
-            lines = self.output[start:]
-        else:
-            # If the stop point is negative increase it by one
-            # to prevent strange behaviors
-            if stop < 0:
-                stop += 1
-            lines = self.output[start:stop]
-        # Add indexes to lines
-        starting_at = start if start >= 0 else len(self.output)+start # Get starting index
+        It returns a dict containing lines by their sequence number """
+        return self.retrieve_output(start, stop)[0]
+
+    def iter_lines(self, start, stop, chunk_size, compact=False, times=False):
+        """ Retrieve some output lines, yielding chunks of them
+        Every chunk is a dict containing lines by their sequence number,
+        or if compact is true a dict with the sequence number of the
+        first line, the list of lines and optionally their times """
+        first, last = self.output.range(start, stop)
+        for chunk_start in range(first, last, chunk_size):
+            chunk_stop = min(chunk_start+chunk_size, last)
+            if compact:
+                base, lines, line_times, evicted = self.retrieve_compact(chunk_start, chunk_stop, times)
+                if lines:
+                    yield self.compact_lines(base, lines, line_times)
+            else:
+                lines = self.retrieve_output(chunk_start, chunk_stop)[0]
+                if lines:
+                    yield lines
+
+    def retrieve_output(self, start, stop):
+        """ Retrieve some output lines, reading from the disk lines
+        not in memory anymore if the output log is enabled
+        It returns a dict containing lines by their sequence number,
+        and the number of requested lines not available anymore """
+        first, last = self.output.range(start, stop)
+        lines, evicted = self.output.retrieve(first, last)
+        if evicted and self.log is not None:
+            old = self.log.retrieve(first, first+evicted)
+            evicted -= len(old)
+            old.update(lines)
+            lines = old
+        return lines, evicted
+
+    def retrieve_compact(self, start, stop, times=False):
+        """ Retrieve some consecutive output lines as a list, reading from
+        the disk lines not in memory anymore if the output log is enabled
+        It returns the sequence number of the first line, the list of lines,
+        the list of their times if requested, and the number of requested
+        lines not available anymore """
+        first, last = self.output.range(start, stop)
+        base, lines, line_times, evicted = self.output.slice(first, last, times)
+        if evicted and self.log is not None:
+            old = self.log.retrieve(first, first+evicted)
+            if old:
+                # Lines in the log are consecutive and followed by the ones in memory
+                old_base = min(old)
+                lines = [ old[i] for i in range(old_base, old_base+len(old)) ] + lines
+                if times:
+                    line_times = self.log.timestamps(old_base, old_base+len(old)) + line_times
+                base = old_base
+                evicted -= len(old)
+        return base, lines, line_times, evicted
+
+    @staticmethod
+    def compact_lines(base, lines, times=None):
+        """ Build the compact representation of some consecutive lines """
+        result = { 'base': base, 'lines': lines }
+        if times is not None:
+            result['times'] = times
+        return result
+
+    def lines_by_sequence(self, sequences):
+        """ Get some lines by their sequence numbers
+        It returns a dict containing the available lines by their sequence number """
         result = {}
-        for i, line in enumerate(lines):
-            result[i+starting_at] = line
-        # Return the result
+        missing = []
+        for sequence in sequences:
+            try:
+                result[sequence] = self.output.get(sequence)
+            except KeyError:
+                missing.append(sequence)
+        # Read lines not in memory anymore from the log, a run
+        # of consecutive lines at time
+        if missing and self.log is not None:
+            missing.sort()
+            start = missing[0]
+            for previous, sequence in zip(missing, missing[1:] + [ None ]):
+                if sequence != previous+1:
+                    result.update( self.log.retrieve(start, previous+1) )
+                    start = sequence
         return result
 
+    def search_lines(self, query, regex=False, ignore_case=False, since=None, until=None, limit=100):
+        """ Search the lines containing the query, or matching it if it's a regex
+        It returns a list of the last matching lines, with their sequence number
+        and time, and if more lines matched """
+        if self.search is None:
+            raise RuntimeError('The search index is disabled')
+        if limit < 1:
+            raise RuntimeError('The limit must be greater than 0')
+        try:
+            pattern = re.compile(query if regex else re.escape(query), re.IGNORECASE if ignore_case else 0)
+        except re.error as e:
+            raise RuntimeError('Invalid regex: {0!s}'.format(e))
+        # Get the lines which may match from the index
+        first, last = self.search.time_range(since, until)
+        candidates = self.search.candidates( minestorm.server.search.fragments(query, regex), first, last )
+        # Check the newest lines first, until the limit is reached
+        matches = []
+        for stop in range(len(candidates), 0, -256):
+            chunk = candidates[ max(0, stop-256) : stop ][::-1]
+            lines = self.lines_by_sequence(chunk)
+            for sequence in chunk:
+                if sequence in lines and pattern.search( lines[sequence] ):
+                    matches.append({ 'index': sequence, 'time': self.search.time(sequence), 'line': lines[sequence] })
+            if len(matches) > limit:
+                break
+        matches.reverse()
+        return matches[-limit:], len(matches) > limit
+
+    def first_available_line(self):
+        """ Get the sequence number of the oldest line available """
+        if self.log is not None:
+            return self.log.first
+        return self.output.first
+
     # Events called by the OutputWatcher
 
     def _on_line_printed(self, line):
         """ Method called when a line is printed """
-        self.output.append(line) # Append the line to the output
-        self.manager._emit_line(self.details['name'], line) # Notify subscribers
+        self._on_lines_printed([ line ])
+
+    def _on_lines_printed(self, lines):
+        """ Method called when some lines are printed """
+        timestamp = time.time()
+        first = self.output.extend(lines, timestamp) # Append the lines to the output
+        self._process_lines(first, lines, timestamp)
+
+    def _process_lines(self, first, lines, timestamp):
+        """ Save, index and parse some lines already in the output """
+        if self.log is not None:
+            self.log.append(lines, timestamp)
+        if self.search is not None:
+            self._index_lines(first, lines, timestamp)
+        # Notify subscribers
+        self.manager._emit_lines(self.details['name'], first, lines)
+        for i, line in enumerate(lines):
+            self._parse_line(line, first+i)
+
+    def _parse_line(self, line, index):
+        """ Recognize a line, triggering the event of its kind """
+        result = self.parser.parse(line)
+        if result is not None:
+            kind, fields = result
+            # Track online players for the metrics
+            if kind == 'ready':
+                self._on_ready( fields.get('seconds') )
+            elif kind == 'joined':
+                self.players.add( fields['player'] )
+            elif kind == 'left':
+                self.players.discard( fields['player'] )
+            data = { 'server': self.details['name'], 'index': index, 'line': line, 'fields': fields }
+            minestorm.get('events').trigger('server.output.{}'.format(kind), data)
+
+    def _on_ready(self, reported):
+        """ Method called when the server prints that it's ready """
+        # The time reported by the server may use a comma as separator
+        if reported is not None:
+            reported = float( reported.replace(',', '.') )
+        if self._finish_startup(self.startup, 'ready', reported):
+            self._mark_started()
+        # Wake up who is waiting only after the status is updated, and
+        # not if the server is being stopped
+        if self.status == self.STATUS_STARTED:
+            self.ready.set()
+
+    def _on_start_timeout(self, startup):
+        """ Method called when the server isn't ready in time """
+        if self._finish_startup(startup, 'timeout'):
+            self.logger.warning('The server {0} isn\'t ready after {1:.0f} seconds'.format(self.details['name'], time.time() - startup['started_at']))
+            # Consider it started anyway, it may not print the usual message
+            self._mark_started()
+
+    def _mark_started(self):
+        """ Move the status to started, unless the server was stopped meanwhile """
+        with self._startup_lock:
+            if self.status == self.STATUS_STARTING:
+                self.change_status(self.STATUS_STARTED)
+
+    def _finish_startup(self, startup, result, reported=None):
+        """ Record the outcome of a start, returning if it was still in progress """
+        with self._startup_lock:
+            if startup is None or self.startup is not startup:
+                return False
+            self.startup = None
+        if self.startup_timer is not None:
+            self.startup_timer.cancel()
+        entry = {}
+        entry['started_at'] = startup['started_at']
+        entry['result'] = result
+        entry['seconds'] = time.time() - startup['started_at']
+        entry['reported'] = reported # Time reported by the server itself
+        entry['command'] = startup['command']
+        entry['cds'] = startup['cds'] # How the class data archive was used
+        self.startups.record(entry)
+        return True
+
+    def _index_lines(self, first, lines, timestamp):
+        """ Index some lines, removing the oldest ones from the index """
+        self.search.add(first, lines, timestamp)
+        # Index only the lines kept in memory, or the configured
+        # number of lines if they're saved on the disk
+        if self.log is not None:
+            keep = int( minestorm.get('configuration').get('servers.search_index.max_lines', 1000000) )
+        else:
+            keep = self.output.capacity
+        # Prune in blocks, to avoid scanning all the words every time
+        if self.search.next - self.search.base > keep + keep//10:
+            self.search.prune( self.search.next - keep )
 
     def _on_stop(self):
         """ Method called when a server is stopped """
-        self.change_status(self.STATUS_STOPPED) # Move the status to stopped
+        # The server exited before being ready
+        ready = not self._finish_startup(self.startup, 'exited')
+        # Collect the exit code; the process closed its output, so it
+        # should exit very soon
+        try:
+            self.exit_code = self.process.wait( minestorm.get('configuration').get('servers.exit_timeout', 5) )
+        except subprocess.TimeoutExpired:
+            self.exit_code = None
+            self.logger.warning('The server {0} closed its output but is still running'.format(self.details['name']))
+        # Keep the class data archive if it was created
+        if self.cds is not None:
+            self.cds.finish(self.exit_code, ready)
+        # The server crashed if it exited with an error without being stopped
+        with self._startup_lock:
+            if self.status != self.STATUS_STOPPING and self.exit_code != 0:
+                self.change_status(self.STATUS_CRASHED)
+            else:
+                self.change_status(self.STATUS_STOPPED) # Move the status to stopped
         # Reset informations
-        self.watcher.stop = True
-        self.watcher = None
-        self.updater.stop = True
-        self.updater = None
+        if self.watcher is not None:
+            self.watcher.stop = True
+            self.watcher = None
+        for pipe in self.pipes.values():
+            pipe.close()
         self.process = None
         self.pipes = {'in': None, 'out': None}
         self.pid = None
-        self.output = []
         self.started_at = None
         self.ram = None
+        self.usage = {}
+        self.players = set()
+        self.lines_mark = None
+        self.stopped.set() # Wake up everyone waiting for the stop
+        self.ready.set() # And everyone waiting for the server to be ready
 
-    # Proc parser methods
-
-    def _update_resource_usage(self):
-        """ Update resource usage variables """
-        self.ram = self._parse_ram()
-
-    def _parse_ram(self):
-        """ Get ram usage from the proc filesystem """
-        result = 0
-        procfile = '/proc/{}/status'.format(self.pid) # Prepare file name
-        meminfo = '/proc/meminfo'
-        # To get the ram usage from the proc file we need to
-        # sum 'VmRSS' and 'VmPSS'
-        # Also we need to strip the kB suffix from values
-        # in order to convert string to int
-        with open(procfile, 'r') as f:
-            # Iterate over proc file lines
-            for line in f:
-                # Clean key and value
-                key, value = line.split(':')
-                key = key.strip()
-                value = value.strip()
-                # Check if the first two chars are 'Vm'; see above
-                if key in ('VmRSS', 'VmPSS'):
-                    # Add this value to the result
-                    result += int( value.replace('kB', '').strip() )
-        # Now we need to get the total ram available, via /proc/meminfo
-        with open(meminfo, 'r') as f:
-            # Iterate over lines
-            for line in f:
-                key, value = line.split(':')
-                key = key.strip()
-                value = value.replace('kB', '').strip()
-                # Check if the key is MemTotal
-                if key == 'MemTotal':
-                    total = int(value)
-                    break
-        # Calculate usage average
-        average = ( result * 100 ) / total
-        return average
+    # Events called by the resources sampler
+
+    def _on_usage_sampled(self, usage):
+        """ Method called when the resources usage is sampled """
+        self.usage = usage
+        self.ram = usage['ram_used']
+        # The server may stop while it's being sampled
+        mark = self.lines_mark
+        if self.metrics is not None and mark is not None:
+            now, lines = time.time(), self.output.next
+            # Lines printed per second since the last sample
+            previous_time, previous_lines = mark
+            rate = ( lines - previous_lines ) / ( now - previous_time ) if now > previous_time else None
+            self.lines_mark = ( now, lines )
+            self.metrics.add(now, { 'ram': usage['rss'], 'cpu': usage['cpu'], 'lines': rate, 'players': len(self.players) })
 
     # Some magic methods
 
     def __repr__(self):
         return '<Server "'+self.details['name']+'">'
 
+class BulkWorkerThread(threading.Thread):
+    """ This thread starts or stops a server during a bulk operation """
+
+    def __init__(self, function, server, slots):
+        super(BulkWorkerThread, self).__init__() # Run the parent constructor
+        self.function = function
+        self.server = server
+        self.slots = slots
+
+    def run(self):
+        with self.slots:
+            self.function(self.server)
+
 class OutputWatcher(threading.Thread):
     """ This class simply watch for new output on a server' stdout """
 
     def __init__(self, server):
         super(OutputWatcher, self).__init__() # Run the parent constructor
         self.server = server
-        self.line = ''
+        self.splitter = LineSplitter()
         self.stop = False
+        self.logger = logging.getLogger('minestorm.servers')
 
     def run(self):
+        size = int( minestorm.get('configuration').get('servers.output_read_size', 65536) )
         while not ( self.stop or minestorm.shutdowned ):
-            # Get a char from the stdout of the server
-            # and convert it to string
-            char = self.server.pipes['out'].read(1)
-            char = char.decode('utf-8')
-            # If the char is empty, the server was stopped
-            if char == '':
-                self.server._on_stop() # Tell the server that it was stopped
-            # If the char is a return char, send the current line to the server
-            elif char == '\n':
-                self.server._on_line_printed( self.line )
-                self.line = '' # Reset the line
+            # Get all the available output of the server, up to size bytes
+            data = self.server.pipes['out'].read1(size)
+            # If nothing was read, the server was stopped
+            if data == b'':
+                # Send the last line, even if it isn't terminated
+                line = self.splitter.flush()
+                if line:
+                    self._process([ line ])
+                try:
+                    self.server._on_stop() # Tell the server that it was stopped
+                except Exception:
+                    self.logger.exception('Unable to stop the server {0}'.format(self.server.details['name']))
+                break
             else:
-                self.line += char
+                # Send all the complete lines to the server
+                lines = self.splitter.feed(data)
+                if lines:
+                    self._process(lines)
 
-class UsageInformationsUpdater(threading.Thread):
-    """ This thread will update informations about resouces usages for each server """
+    def _process(self, lines):
+        """ Send some lines to the server, without stopping to read the
+        output if they can't be processed, else the server would block
+        on the full pipe """
+        try:
+            self.server._on_lines_printed(lines)
+        except Exception:
+            self.logger.exception('Unable to process the output of {0}'.format(self.server.details['name']))
 
-    def __init__(self, server):
-        super(UsageInformationsUpdater, self).__init__() # Run the parent constructor
-        self.server = server
+class OutputReactor(threading.Thread):
+    """ This thread watches the output of all servers with a single
+    selector, and updates informations about their resources usage
+    The work which may block, like saving the output on the disk or
+    collecting the exit code, is handed off to the dispatcher """
+
+    def __init__(self, sampler, dispatcher):
+        super(OutputReactor, self).__init__() # Run the parent constructor
+        self.sampler = sampler
+        self.dispatcher = dispatcher
+        self.selector = selectors.DefaultSelector()
+        self.pending = queue.Queue()
         self.stop = False
+        # The reactor is woken up with this pipe when a server is registered
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        self.selector.register(self._wakeup_read, selectors.EVENT_READ, None)
+
+    def register(self, server):
+        """ Start watching a server """
+        self.pending.put(server)
+        os.write(self._wakeup_write, b'\0')
 
     def run(self):
+        size = int( minestorm.get('configuration').get('servers.output_read_size', 65536) )
+        next_update = time.time()
         while not ( self.stop or minestorm.shutdowned ):
-            # Call the server _update_resource_usage method
-            self.server._update_resource_usage()
-            # Now sleep a little
-            time.sleep( minestorm.get('configuration').get('servers.update_usage_informations_every') )
+            # Wait for some output until the next usage update, checking
+            # from time to time if minestorm is shutting down
+            timeout = min( max( next_update-time.time(), 0 ), 1 )
+            for key, mask in self.selector.select(timeout):
+                if key.data is None:
+                    os.read(self._wakeup_read, 4096)
+                    self._register_pending()
+                else:
+                    self._read(key, size)
+            # Update resources usage of all servers
+            if time.time() >= next_update:
+                self.sampler.sample_all()
+                next_update = time.time() + minestorm.get('configuration').get('servers.update_usage_informations_every')
+        self.selector.close()
+
+    def _register_pending(self):
+        """ Register the servers waiting to be watched """
+        while not self.pending.empty():
+            server = self.pending.get()
+            self.selector.register(server.pipes['out'].fileno(), selectors.EVENT_READ, ( server, LineSplitter() ))
+
+    def _read(self, key, size):
+        """ Read the available output of a server """
+        server, splitter = key.data
+        data = os.read(key.fd, size)
+        # If nothing was read, the server was stopped
+        if data == b'':
+            self.selector.unregister(key.fd)
+            # Send the last line, even if it isn't terminated
+            line = splitter.flush()
+            if line:
+                self._lines_printed(server, [ line ])
+            # Tell the server that it was stopped after its last lines
+            # are processed, in its own thread since it waits for the
+            # process to exit
+            self.dispatcher.submit(server, self._stopped, server)
+        else:
+            # Send all the complete lines to the server
+            lines = splitter.feed(data)
+            if lines:
+                self._lines_printed(server, lines)
+
+    def _lines_printed(self, server, lines):
+        """ Append some lines to the output of a server, processing them later """
+        timestamp = time.time()
+        first = server.output.extend(lines, timestamp)
+        self.dispatcher.submit(server, server._process_lines, first, lines, timestamp)
+
+    def _stopped(self, server):
+        """ Run the stop handler of a server in a dedicated thread """
+        thread = threading.Thread(target=server._on_stop, name='{}-stop'.format(server.details['name']))
+        thread.daemon = True # Don't prevent the program from exiting
+        thread.start()
+
+class OutputDispatcher:
+    """ Run the work on the output of servers in a pool of threads
+
+    The work of every server is done in the order it was submitted,
+    but a server which is slow to process doesn't hold the other ones """
+
+    def __init__(self, workers=2):
+        self.queue = queue.Queue() # Servers with pending work
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger('minestorm.servers')
+        self.workers = []
+        for i in range(max(workers, 1)):
+            worker = OutputDispatcherThread(self)
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, server, function, *args):
+        """ Submit some work for a server """
+        with self.lock:
+            # Queue the server only if no one is already working on it
+            if server in self.pending:
+                self.pending[server].append( ( function, args ) )
+                return
+            self.pending[server] = collections.deque([ ( function, args ) ])
+        self.queue.put(server)
+
+    def stop(self):
+        """ Stop all the workers """
+        for worker in self.workers:
+            worker.stop = True
+
+    def _run_next(self, timeout):
+        """ Do all the pending work of the next server, waiting up to the timeout for one """
+        try:
+            server = self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return
+        while True:
+            with self.lock:
+                work = self.pending[server]
+                if not work:
+                    del self.pending[server]
+                    return
+                function, args = work.popleft()
+            try:
+                function(*args)
+            except Exception:
+                self.logger.exception('Unable to process the output of {0}'.format(server.details['name']))
+
+class OutputDispatcherThread(threading.Thread):
+    """ This thread does the work submitted to the output dispatcher """
+
+    def __init__(self, dispatcher):
+        super(OutputDispatcherThread, self).__init__() # Run the parent constructor
+        self.dispatcher = dispatcher
+        self.stop = False
+
+    def run(self):
+        # Check from time to time if minestorm is shutting down
+        while not ( self.stop or minestorm.shutdowned ):
+            self.dispatcher._run_next(0.5)
+
+class LineSplitter:
+    """ Split a stream of UTF-8 bytes into lines
+    Multi-byte characters splitted between chunks are handled """
+
+    def __init__(self):
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.line = ''
+
+    def feed(self, data):
+        """ Feed some bytes, returning the completed lines """
+        lines = ( self.line + self.decoder.decode(data) ).split('\n')
+        # The last piece isn't terminated yet
+        self.line = lines.pop()
+        return lines
+
+    def flush(self):
+        """ Return the incomplete line, resetting the splitter """
+        line = self.line + self.decoder.decode(b'', True)
+        self.line = ''
+        self.decoder.reset()
+        return line
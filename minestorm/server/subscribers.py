@@ -0,0 +1,167 @@
+#!/usr/bin/python3
+import collections
+import logging
+import threading
+import time
+import minestorm
+
+# What to do when the queue of a subscriber is full
+POLICY_DROP_OLDEST = 'drop_oldest' # Drop the oldest queued line
+POLICY_BLOCK = 'block' # Wait for the subscriber, up to a timeout
+POLICY_SAMPLE = 'sample' # Keep only some lines while the queue is filling
+POLICIES = ( POLICY_DROP_OLDEST, POLICY_BLOCK, POLICY_SAMPLE )
+
+class Subscriber:
+    """
+    A subscriber to the output of the servers
+
+    Lines are added to a bounded queue, and delivered by a dedicated
+    worker, so a slow subscriber doesn't slow down the reading of the
+    output. What happens when the queue is full depends on the policy:
+    only the block one can make the reader wait, up to block_timeout for
+    every batch of lines, which delays the output of the server and its
+    parsing for all the other subscribers too
+
+    While no line arrives the worker calls on_idle every second,
+    so the subscriber can check if it's still needed
+    """
+
+    def __init__(self, method, args={}, line_name='line', server_name='server', index_name=None,
+                 policy=POLICY_DROP_OLDEST, queue_size=10000, block_timeout=0.05, sample_every=10, name=None, on_idle=None):
+        if policy not in POLICIES:
+            raise RuntimeError('Invalid subscriber policy: {}'.format(policy))
+        if queue_size < 1:
+            raise RuntimeError('Invalid subscriber queue size: {}'.format(queue_size))
+        if sample_every < 1:
+            raise RuntimeError('Invalid subscriber sample rate: {}'.format(sample_every))
+        if block_timeout < 0:
+            raise RuntimeError('Invalid subscriber block timeout: {}'.format(block_timeout))
+        self.method = method
+        self.args = args
+        self.line_name = line_name
+        self.server_name = server_name
+        self.index_name = index_name
+        self.policy = policy
+        self.queue_size = queue_size
+        self.block_timeout = block_timeout
+        self.sample_every = sample_every
+        self.name = name if name is not None else repr(method)
+        self.on_idle = on_idle
+        self.queue = collections.deque()
+        self.condition = threading.Condition()
+        self.stopped = False
+        # Counters exposed in the stats
+        self.delivered = 0
+        self.dropped = 0
+        self.lag = None # Seconds between the print and the delivery of the last line
+        self.max_lag = 0
+        self._sampled = 0
+        self.worker = SubscriberThread(self)
+        self.worker.start()
+
+    def offer(self, server, first, lines):
+        """ Queue some consecutive lines of a server, starting from the index first """
+        now = time.time()
+        deadline = now + self.block_timeout
+        with self.condition:
+            for i, line in enumerate(lines):
+                if self.stopped:
+                    return
+                if self.policy == POLICY_BLOCK:
+                    # Wait for some space, but don't stall the reader forever
+                    while len(self.queue) >= self.queue_size and not self.stopped:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            break
+                        self.condition.wait(remaining)
+                    if len(self.queue) >= self.queue_size:
+                        self.dropped += 1
+                        continue
+                elif self.policy == POLICY_SAMPLE and len(self.queue) >= self.queue_size // 2:
+                    # Keep a line every sample_every while the queue is more than half full
+                    self._sampled += 1
+                    if self._sampled % self.sample_every != 0:
+                        self.dropped += 1
+                        continue
+                # Make space dropping the oldest line
+                if len(self.queue) >= self.queue_size:
+                    self.queue.popleft()
+                    self.dropped += 1
+                self.queue.append( ( now, server, first+i, line ) )
+            self.condition.notify_all()
+
+    def stop(self):
+        """ Stop delivering lines """
+        with self.condition:
+            self.stopped = True
+            self.queue.clear()
+            self.condition.notify_all()
+
+    def stats(self):
+        """ Get the counters of the subscriber """
+        with self.condition:
+            return {
+                'name': self.name,
+                'policy': self.policy,
+                'queued': len(self.queue),
+                'queue_size': self.queue_size,
+                'delivered': self.delivered,
+                'dropped': self.dropped,
+                'lag': self.lag,
+                'max_lag': self.max_lag,
+            }
+
+    def _next(self, timeout):
+        """ Get the next queued line, or None if there is none after the timeout """
+        with self.condition:
+            if not self.queue and not self.stopped:
+                self.condition.wait(timeout)
+            if not self.queue or self.stopped:
+                return None
+            item = self.queue.popleft()
+            # Wake up the reader if it's waiting for some space
+            self.condition.notify_all()
+            return item
+
+    def _deliver(self, item):
+        """ Call the method of the subscriber with a line """
+        queued_at, server, index, line = item
+        # Build new arguments every time, the method may keep them
+        args = dict(self.args)
+        args[self.line_name] = line
+        args[self.server_name] = server
+        if self.index_name is not None:
+            args[self.index_name] = index
+        self.method(**args)
+        with self.condition:
+            self.delivered += 1
+            self.lag = time.time() - queued_at
+            self.max_lag = max(self.max_lag, self.lag)
+
+class SubscriberThread(threading.Thread):
+    """ This thread delivers the queued lines to a subscriber """
+
+    def __init__(self, subscriber):
+        super(SubscriberThread, self).__init__() # Run the parent constructor
+        self.subscriber = subscriber
+        self.daemon = True # Don't prevent the program from exiting
+
+    def run(self):
+        while not ( self.subscriber.stopped or minestorm.shutdowned ):
+            item = self.subscriber._next(1)
+            if item is None:
+                self._idle()
+                continue
+            try:
+                self.subscriber._deliver(item)
+            except Exception as e:
+                logging.getLogger('minestorm.servers').error('Subscriber {0} failed: {1!s}'.format(self.subscriber.name, e))
+
+    def _idle(self):
+        """ Notify the subscriber no line arrived """
+        if self.subscriber.on_idle is None or self.subscriber.stopped:
+            return
+        try:
+            self.subscriber.on_idle()
+        except Exception as e:
+            logging.getLogger('minestorm.servers').error('Subscriber {0} failed: {1!s}'.format(self.subscriber.name, e))
@@ -4,6 +4,21 @@ import minestorm.test.container
 import minestorm.test.common.configuration
 import minestorm.test.common.resources
 import minestorm.test.common.events
+import minestorm.test.common.framing
+import minestorm.test.server.jobs
+import minestorm.test.server.servers
+import minestorm.test.server.output
+import minestorm.test.server.search
+import minestorm.test.server.parsing
+import minestorm.test.server.monitoring
+import minestorm.test.server.metrics
+import minestorm.test.server.subscribers
+import minestorm.test.server.history
+import minestorm.test.server.jvm
+import minestorm.test.server.cds
+import minestorm.test.server.networking
+import minestorm.test.server.requests
+import minestorm.test.console.servers
 
 def load(case):
     """ Add a test to the suite """
@@ -18,6 +33,41 @@ def generate_suite():
     suite.addTest( load( minestorm.test.common.resources.ResourcesTestCase ) )
     suite.addTest( load( minestorm.test.common.resources.ResourceTestCase ) )
     suite.addTest( load( minestorm.test.common.events.EventsTestCase ) )
+    suite.addTest( load( minestorm.test.common.framing.FramingTestCase ) )
+    suite.addTest( load( minestorm.test.server.jobs.JobTestCase ) )
+    suite.addTest( load( minestorm.test.server.jobs.JobsManagerTestCase ) )
+    suite.addTest( load( minestorm.test.server.servers.LineSplitterTestCase ) )
+    suite.addTest( load( minestorm.test.server.servers.OutputReactorTestCase ) )
+    suite.addTest( load( minestorm.test.server.servers.OutputWatcherTestCase ) )
+    suite.addTest( load( minestorm.test.server.servers.DataDirectoryTestCase ) )
+    suite.addTest( load( minestorm.test.server.servers.SearchLinesTestCase ) )
+    suite.addTest( load( minestorm.test.server.servers.OutputEventsTestCase ) )
+    suite.addTest( load( minestorm.test.server.servers.BulkTestCase ) )
+    suite.addTest( load( minestorm.test.server.servers.LifecycleTestCase ) )
+    suite.addTest( load( minestorm.test.server.output.OutputBufferTestCase ) )
+    suite.addTest( load( minestorm.test.server.output.OutputLogTestCase ) )
+    suite.addTest( load( minestorm.test.server.search.WordIndexTestCase ) )
+    suite.addTest( load( minestorm.test.server.parsing.LineParserTestCase ) )
+    suite.addTest( load( minestorm.test.server.monitoring.ResourcesSamplerTestCase ) )
+    suite.addTest( load( minestorm.test.server.metrics.MetricsHistoryTestCase ) )
+    suite.addTest( load( minestorm.test.server.subscribers.SubscriberTestCase ) )
+    suite.addTest( load( minestorm.test.server.history.StartupHistoryTestCase ) )
+    suite.addTest( load( minestorm.test.server.jvm.JvmTestCase ) )
+    suite.addTest( load( minestorm.test.server.cds.ClassDataArchiveTestCase ) )
+    suite.addTest( load( minestorm.test.server.networking.WorkersPoolTestCase ) )
+    suite.addTest( load( minestorm.test.server.networking.AsyncListenerTestCase ) )
+    suite.addTest( load( minestorm.test.server.networking.AsyncConnectionTestCase ) )
+    suite.addTest( load( minestorm.test.server.networking.MultiplexingTestCase ) )
+    suite.addTest( load( minestorm.test.server.networking.AsyncMultiplexingTestCase ) )
+    suite.addTest( load( minestorm.test.server.networking.UnixSocketTestCase ) )
+    suite.addTest( load( minestorm.test.server.requests.BatchTestCase ) )
+    suite.addTest( load( minestorm.test.server.requests.SubscriptionTestCase ) )
+    suite.addTest( load( minestorm.test.server.requests.WaitTestCase ) )
+    suite.addTest( load( minestorm.test.server.requests.RetrieveLinesTestCase ) )
+    suite.addTest( load( minestorm.test.server.requests.CompressionTestCase ) )
+    suite.addTest( load( minestorm.test.server.requests.MetricsHistoryTestCase ) )
+    suite.addTest( load( minestorm.test.server.requests.StartupHistoryTestCase ) )
+    suite.addTest( load( minestorm.test.console.servers.ServerTestCase ) )
     return suite
 
 def run():
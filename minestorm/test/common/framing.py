@@ -0,0 +1,72 @@
+#!/usr/bin/python3
+import unittest
+import socket
+import struct
+import threading
+import zlib
+import minestorm.common
+
+class FramingTestCase( unittest.TestCase ):
+    """
+    This class will test the framing functions
+    """
+
+    def setUp(self):
+        self.a, self.b = socket.socketpair()
+
+    def tearDown(self):
+        self.a.close()
+        self.b.close()
+
+    def test_small_frame(self):
+        """ Test sending and receiving a small frame """
+        minestorm.common.send_frame(self.a, b'hello')
+        self.assertEqual( minestorm.common.receive_frame(self.b), b'hello' )
+
+    def test_empty_frame(self):
+        """ Test sending and receiving an empty frame """
+        minestorm.common.send_frame(self.a, b'')
+        self.assertEqual( minestorm.common.receive_frame(self.b), b'' )
+
+    def test_big_frame(self):
+        """ Test frames bigger than the socket buffers """
+        payload = bytes( range(256) ) * 40000
+        # Send it from another thread, else the socket buffer will fill up
+        thread = threading.Thread(target=minestorm.common.send_frame, args=(self.a, payload))
+        thread.start()
+        received = minestorm.common.receive_frame(self.b)
+        thread.join()
+        self.assertEqual( received, payload )
+
+    def test_compressed_frame(self):
+        """ Test compressed frames are decompressed transparently """
+        payload = b'a line of output\n' * 1000
+        minestorm.common.send_frame(self.a, zlib.compress(payload), compressed=True)
+        self.assertEqual( minestorm.common.receive_frame(self.b), payload )
+
+    def test_header(self):
+        """ Test packing and unpacking headers """
+        self.assertEqual( minestorm.common.unpack_header( minestorm.common.pack_header(1234) ), (1234, False) )
+        self.assertEqual( minestorm.common.unpack_header( minestorm.common.pack_header(1234, True) ), (1234, True) )
+
+    def test_broken_socket(self):
+        """ Test receiving from a closed socket """
+        # Send only the header, announcing a 5 bytes payload
+        minestorm.common.send_packet(self.a, struct.pack('I', 5))
+        self.a.close()
+        with self.assertRaises( RuntimeError ):
+            minestorm.common.receive_frame(self.b)
+
+    def test_frame_too_large(self):
+        """ Test frames announcing a length over the max are rejected """
+        # Only the header is sent, the payload must not be waited for
+        minestorm.common.send_packet(self.a, minestorm.common.pack_header(1024*1024))
+        with self.assertRaises( RuntimeError ):
+            minestorm.common.receive_frame(self.b, 1024)
+
+    def test_compressed_frame_too_large(self):
+        """ Test compressed frames which expand over the max are rejected """
+        payload = zlib.compress(b'\0' * 100000)
+        minestorm.common.send_frame(self.a, payload, compressed=True)
+        with self.assertRaises( RuntimeError ):
+            minestorm.common.receive_frame(self.b, 1024)
@@ -0,0 +1,35 @@
+#!/usr/bin/python3
+import unittest
+import minestorm.console.servers
+
+class ServerTestCase( unittest.TestCase ):
+    """
+    This class will test the local copy of a server
+    """
+
+    def setUp(self):
+        self.server = minestorm.console.servers.Server('test')
+
+    def store(self, base, lines):
+        """ Store a retrieve_lines response """
+        self.server.store_lines({ 'status': 'retrieve_lines_response', 'base': base, 'lines': lines })
+
+    def test_store_lines(self):
+        """ Test lines already downloaded aren't stored again """
+        self.store(0, [ 'a', 'b' ])
+        self.store(1, [ 'b', 'c' ])
+        self.store(3, [])
+        self.assertEqual( self.server.all_lines(), [ 'a', 'b', 'c' ] )
+
+    def test_missed_lines(self):
+        """ Test lines discarded between two polls are marked """
+        self.store(0, [ 'a', 'b' ])
+        self.store(5, [ 'f' ])
+        self.assertEqual( self.server.all_lines(), [ 'a', 'b', '[... 3 lines not received ...]', 'f' ] )
+        self.store(6, [ 'g' ])
+        self.assertEqual( self.server.all_lines()[-1], 'g' )
+
+    def test_old_backend(self):
+        """ Test the responses of old backends, with a dict of lines """
+        self.server.store_lines({ 'status': 'retrieve_lines_response', 'lines': { '10': 'b', '9': 'a' } })
+        self.assertEqual( self.server.all_lines(), [ 'a', 'b' ] )
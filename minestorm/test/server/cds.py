@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+import unittest
+import tempfile
+import shutil
+import os
+import minestorm.server.cds
+
+class ClassDataArchiveTestCase( unittest.TestCase ):
+    """
+    This class will test the class data sharing archives
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.jar = os.path.join(self.directory, 'server.jar')
+        self.write_jar(b'first')
+        self.java = os.path.join(self.directory, 'java')
+        self.write_java(0)
+        self.archive = minestorm.server.cds.ClassDataArchive( os.path.join(self.directory, 'cds'), self.jar, self.java )
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_jar(self, content):
+        """ Write the jar, with an mtime in the past """
+        with open(self.jar, 'wb') as f:
+            f.write(content)
+        os.utime(self.jar, ( 1000, 1000 ))
+
+    def write_java(self, exit_code):
+        """ Write a fake java, which counts how many times it's run """
+        with open(self.java, 'w') as f:
+            f.write('#!/bin/sh\necho run >> {0}\nexit {1}\n'.format( os.path.join(self.directory, 'runs'), exit_code ))
+        os.chmod(self.java, 0o755)
+
+    def runs(self):
+        """ Get how many times the fake java was run """
+        if not os.path.exists( os.path.join(self.directory, 'runs') ):
+            return 0
+        with open( os.path.join(self.directory, 'runs') ) as f:
+            return len( f.readlines() )
+
+    def train(self, exit_code=0, ready=True):
+        """ Simulate a training run, where the JVM dumps the archive """
+        mode, arguments = self.archive.prepare()
+        self.assertEqual( mode, 'training' )
+        path = arguments[0].split('=', 1)[1]
+        with open(path, 'wb') as f:
+            f.write(b'classes')
+        self.archive.finish(exit_code, ready)
+
+    def test_training(self):
+        """ Test the archive is used after a training run """
+        self.train()
+        mode, arguments = self.archive.prepare()
+        self.assertEqual( mode, 'archive' )
+        self.assertTrue( os.path.exists( arguments[0].split('=', 1)[1] ) )
+        # Another jar needs another archive, which replaces the old one
+        self.write_jar(b'second')
+        self.train()
+        self.assertEqual( len( os.listdir( os.path.join(self.directory, 'cds') ) ), 1 )
+
+    def test_new_java(self):
+        """ Test the archive is created again if the JVM is replaced """
+        self.train()
+        self.write_java(0)
+        os.utime(self.java, ( 2000, 2000 ))
+        self.assertEqual( self.archive.prepare()[0], 'training' )
+
+    def test_unsupported_java(self):
+        """ Test JVMs which can't dump archives aren't trained """
+        self.write_java(1)
+        with self.assertLogs('minestorm.servers', 'WARNING'):
+            self.assertEqual( self.archive.prepare(), ( None, [] ) )
+        # The JVM is probed only once
+        self.assertEqual( self.archive.prepare(), ( None, [] ) )
+        self.assertEqual( self.runs(), 1 )
+
+    def test_touched_jar(self):
+        """ Test the archive is created again if the jar is newer """
+        self.train()
+        os.utime(self.jar, None)
+        self.assertEqual( self.archive.prepare()[0], 'training' )
+
+    def test_failed_training(self):
+        """ Test a crashed training run discards the archive """
+        self.train(exit_code=1, ready=True)
+        self.assertEqual( os.listdir( os.path.join(self.directory, 'cds') ), [] )
+        # If the server didn't even start it isn't tried again
+        self.train(exit_code=1, ready=False)
+        self.assertEqual( self.archive.prepare(), ( None, [] ) )
+
+    def test_missing_jar(self):
+        """ Test a missing jar disables the archive """
+        os.remove(self.jar)
+        self.assertEqual( self.archive.prepare(), ( None, [] ) )
+
+    def test_unusable_directory(self):
+        """ Test the archive is disabled if its directory can't be created """
+        with open(os.path.join(self.directory, 'cds'), 'w') as f:
+            f.write('not a directory')
+        with self.assertLogs('minestorm.servers', 'WARNING'):
+            self.assertEqual( self.archive.prepare(), ( None, [] ) )
@@ -0,0 +1,72 @@
+#!/usr/bin/python3
+import unittest
+import tempfile
+import shutil
+import os
+import minestorm.server.history
+
+class StartupHistoryTestCase( unittest.TestCase ):
+    """
+    This class will test the history of the starts
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'server', 'startups.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def entry(self, result, seconds):
+        """ Create an entry of the history """
+        return { 'started_at': 100, 'result': result, 'seconds': seconds, 'reported': None, 'command': [ 'java' ] }
+
+    def test_summary(self):
+        """ Test the summary considers only successful starts """
+        history = minestorm.server.history.StartupHistory()
+        self.assertEqual( history.summary()['count'], 0 )
+        for result, seconds in ( ( 'ready', 10 ), ( 'timeout', 300 ), ( 'ready', 20 ) ):
+            history.record( self.entry(result, seconds) )
+        summary = history.summary()
+        self.assertEqual( summary['count'], 2 )
+        self.assertEqual( summary['average'], 15 )
+        self.assertEqual( summary['last'], 20 )
+        self.assertEqual( len( history.last(2) ), 2 )
+
+    def test_persistence(self):
+        """ Test the history is loaded back from the file """
+        history = minestorm.server.history.StartupHistory(self.path, 3)
+        for i in range(10):
+            history.record( self.entry('ready', i) )
+        self.assertEqual( [ entry['seconds'] for entry in history.last() ], [ 7, 8, 9 ] )
+        # Append a truncated line, like after a crash
+        with open(self.path, 'a') as f:
+            f.write('{"started_at": 1')
+        history = minestorm.server.history.StartupHistory(self.path, 3)
+        self.assertEqual( [ entry['seconds'] for entry in history.last() ], [ 7, 8, 9 ] )
+        history.record( self.entry('ready', 10) )
+        history = minestorm.server.history.StartupHistory(self.path, 3)
+        self.assertEqual( [ entry['seconds'] for entry in history.last() ], [ 8, 9, 10 ] )
+
+    def test_compare(self):
+        """ Test grouping the starts by how they were done """
+        history = minestorm.server.history.StartupHistory()
+        for cds, seconds in ( ( None, 12 ), ( 'training', 14 ), ( 'archive', 8 ), ( 'archive', 6 ) ):
+            entry = self.entry('ready', seconds)
+            entry['cds'] = cds
+            history.record(entry)
+        groups = history.compare('cds', 'off')
+        self.assertEqual( sorted(groups), [ 'archive', 'off', 'training' ] )
+        self.assertEqual( groups['archive']['average'], 7 )
+        self.assertEqual( groups['off']['count'], 1 )
+
+    def test_unusable_file(self):
+        """ Test the history is kept in memory if its file can't be used """
+        # The parent directory is a file
+        with open(os.path.join(self.directory, 'server'), 'w') as f:
+            f.write('not a directory')
+        with self.assertLogs('minestorm.servers', 'ERROR'):
+            history = minestorm.server.history.StartupHistory(self.path)
+        self.assertIsNone( history.path )
+        history.record( self.entry('ready', 10) )
+        self.assertEqual( history.summary()['count'], 1 )
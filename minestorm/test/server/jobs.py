@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+import unittest
+import threading
+import time
+import minestorm.server.jobs
+
+class JobTestCase( unittest.TestCase ):
+    """
+    This class will test the background jobs
+    """
+
+    def test_run(self):
+        """ Test running a job """
+        job = minestorm.server.jobs.Job('test', lambda job: 42)
+        self.assertEqual( job.status, job.STATUS_PENDING )
+        self.assertFalse( job.wait(0) )
+        job.run()
+        self.assertTrue( job.wait(0) )
+        self.assertEqual( job.status, job.STATUS_DONE )
+        self.assertEqual( job.details()['result'], 42 )
+
+    def test_failure(self):
+        """ Test a job which raises an exception """
+        def function(job):
+            raise RuntimeError('Something went wrong')
+        job = minestorm.server.jobs.Job('test', function)
+        job.run()
+        self.assertEqual( job.status, job.STATUS_FAILED )
+        self.assertEqual( job.details()['error'], 'Something went wrong' )
+        self.assertNotIn( 'result', job.details() )
+
+    def test_progress(self):
+        """ Test the progress of a job """
+        def function(job):
+            for i in range(3):
+                job.update(i+1, 3)
+        job = minestorm.server.jobs.Job('test', function)
+        self.assertEqual( job.details()['progress'], { 'done': 0, 'total': None } )
+        job.run()
+        self.assertEqual( job.details()['progress'], { 'done': 3, 'total': 3 } )
+
+    def test_done_callback(self):
+        """ Test callbacks are called when the job finishes """
+        job = minestorm.server.jobs.Job('test', lambda job: 42)
+        called = []
+        job.add_done_callback(called.append)
+        self.assertEqual( called, [] )
+        job.run()
+        self.assertEqual( called, [ job ] )
+        # Jobs already finished call it right away
+        job.add_done_callback(called.append)
+        self.assertEqual( called, [ job, job ] )
+
+class JobsManagerTestCase( unittest.TestCase ):
+    """
+    This class will test the background jobs manager
+    """
+
+    def setUp(self):
+        self.manager = minestorm.server.jobs.JobsManager()
+        self.addCleanup( self.manager.stop )
+        self.gate = threading.Event()
+        self.addCleanup( self.gate.set )
+
+    def notified(self, job, timeout):
+        """ Wait to be notified about a job, returning its status then """
+        event = threading.Event()
+        statuses = []
+        def callback(job):
+            statuses.append(job.status)
+            event.set()
+        self.manager.notify(job, timeout, callback)
+        self.assertTrue( event.wait(5) )
+        time.sleep(0.1)
+        self.assertEqual( len(statuses), 1 ) # Notified only once
+        return statuses[0]
+
+    def test_notify_finished(self):
+        """ Test waiters are notified when the job finishes """
+        job = self.manager.submit('test', lambda job: self.gate.wait(5))
+        threading.Timer(0.1, self.gate.set).start()
+        self.assertEqual( self.notified(job, 5), job.STATUS_DONE )
+
+    def test_notify_timeout(self):
+        """ Test waiters are notified when the timeout expires """
+        job = self.manager.submit('test', lambda job: self.gate.wait(5))
+        start = time.time()
+        self.assertEqual( self.notified(job, 0.2), job.STATUS_RUNNING )
+        self.assertLess( time.time() - start, 2 )
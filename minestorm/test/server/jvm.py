@@ -0,0 +1,90 @@
+#!/usr/bin/python3
+import unittest
+import tempfile
+import shutil
+import os
+import minestorm.server.jvm
+
+class JvmTestCase( unittest.TestCase ):
+    """
+    This class will test the generation of the JVM arguments
+    """
+
+    def details(self, ram={}, **jvm):
+        """ Create the details of a server """
+        return { 'name': 'test', 'type': 'vanilla', 'start_command': { 'jar': 'server.jar', 'ram': ram }, 'jvm': jvm }
+
+    def test_sizes(self):
+        """ Test converting memory sizes """
+        self.assertEqual( minestorm.server.jvm.parse_size('512M'), 512 * 1024 * 1024 )
+        self.assertEqual( minestorm.server.jvm.parse_size('4g'), 4 * 1024 ** 3 )
+        self.assertEqual( minestorm.server.jvm.parse_size(1024), 1024 )
+        self.assertEqual( minestorm.server.jvm.format_size(2 * 1024 ** 3), '2048M' )
+        with self.assertRaises( RuntimeError ):
+            minestorm.server.jvm.parse_size('a lot')
+
+    def test_plain(self):
+        """ Test the heap is passed as is without profiles """
+        arguments = minestorm.server.jvm.arguments( self.details({ 'min': '1G', 'max': '2G' }) )
+        self.assertEqual( arguments, [ '-Xms1G', '-Xmx2G' ] )
+        self.assertEqual( minestorm.server.jvm.arguments( self.details() ), [] )
+
+    def test_aikar(self):
+        """ Test the G1 profile is tuned for the heap size """
+        arguments = minestorm.server.jvm.arguments( self.details({ 'max': '4G' }, profiles='aikar') )
+        # The initial heap is the maximum one
+        self.assertEqual( arguments[:2], [ '-Xms4G', '-Xmx4G' ] )
+        self.assertIn( '-XX:+UseG1GC', arguments )
+        self.assertIn( '-XX:G1HeapRegionSize=8M', arguments )
+        arguments = minestorm.server.jvm.arguments( self.details({ 'max': '16G' }, profiles=[ 'aikar' ]) )
+        self.assertIn( '-XX:G1HeapRegionSize=16M', arguments )
+
+    def test_overrides(self):
+        """ Test the flags of the user override the ones of the profiles """
+        arguments = minestorm.server.jvm.arguments( self.details({ 'max': '4G' }, profiles=[ 'aikar', 'string_dedup' ],
+                                                                  flags=[ '-XX:MaxGCPauseMillis=100', '-XX:-AlwaysPreTouch', '-Xms1G', '-verbose:gc' ]) )
+        self.assertIn( '-XX:MaxGCPauseMillis=100', arguments )
+        self.assertNotIn( '-XX:MaxGCPauseMillis=200', arguments )
+        self.assertIn( '-XX:-AlwaysPreTouch', arguments )
+        self.assertNotIn( '-XX:+AlwaysPreTouch', arguments )
+        self.assertIn( '-XX:+UseStringDeduplication', arguments )
+        self.assertEqual( arguments[0], '-Xms1G' )
+        self.assertEqual( arguments[-1], '-verbose:gc' )
+
+    def test_invalid_profiles(self):
+        """ Test unknown and conflicting profiles """
+        with self.assertRaises( RuntimeError ):
+            minestorm.server.jvm.arguments( self.details(profiles=[ 'turbo' ]) )
+        with self.assertRaises( RuntimeError ):
+            minestorm.server.jvm.arguments( self.details(profiles=[ 'aikar', 'zgc' ]) )
+
+    def test_memory_limit(self):
+        """ Test the heap is derived from the memory limit """
+        arguments = minestorm.server.jvm.arguments( self.details(profiles=[ 'zgc' ]), limit=10 * 1024 ** 3, heap_ratio=0.5 )
+        self.assertEqual( arguments[:3], [ '-Xms5120M', '-Xmx5120M', '-XX:+UseZGC' ] )
+        # The memory is shared with the other servers
+        arguments = minestorm.server.jvm.arguments( self.details(profiles=[ 'zgc' ]), limit=10 * 1024 ** 3, heap_ratio=0.5, servers=2 )
+        self.assertEqual( arguments[:2], [ '-Xms2560M', '-Xmx2560M' ] )
+        # A configured heap too big for the container is reduced, even without profiles
+        arguments = minestorm.server.jvm.arguments( self.details({ 'min': '1G', 'max': '8G' }), limit=4 * 1024 ** 3, heap_ratio=0.5 )
+        self.assertEqual( arguments, [ '-Xms1G', '-Xmx2048M' ] )
+
+    def test_cgroups(self):
+        """ Test reading the memory limit of the cgroup """
+        root = tempfile.mkdtemp()
+        try:
+            cgroups = os.path.join(root, 'cgroup')
+            with open(cgroups, 'w') as f:
+                f.write('4:memory:/minecraft\n0::/minecraft\n')
+            self.assertIsNone( minestorm.server.jvm.memory_limit(root, cgroups) )
+            # Cgroups v1 report a huge number when unlimited
+            os.makedirs( os.path.join(root, 'memory', 'minecraft') )
+            with open( os.path.join(root, 'memory', 'minecraft', 'memory.limit_in_bytes'), 'w' ) as f:
+                f.write('9223372036854771712\n')
+            self.assertIsNone( minestorm.server.jvm.memory_limit(root, cgroups) )
+            os.makedirs( os.path.join(root, 'minecraft') )
+            with open( os.path.join(root, 'minecraft', 'memory.max'), 'w' ) as f:
+                f.write('1073741824\n')
+            self.assertEqual( minestorm.server.jvm.memory_limit(root, cgroups), 1073741824 )
+        finally:
+            shutil.rmtree(root)
@@ -0,0 +1,57 @@
+#!/usr/bin/python3
+import unittest
+import minestorm.server.metrics
+
+class MetricsHistoryTestCase( unittest.TestCase ):
+    """
+    This class will test the history of the metrics
+    """
+
+    def setUp(self):
+        self.history = minestorm.server.metrics.MetricsHistory([ ( 10, 6 ), ( 1, 5 ) ], ( 'ram', 'cpu' ))
+
+    def test_query(self):
+        """ Test getting the points of the finest resolution """
+        self.history.add(100, { 'ram': 10, 'cpu': 1 })
+        self.history.add(101, { 'ram': 20, 'cpu': None })
+        self.history.add(101.5, { 'ram': 30, 'cpu': 3 })
+        resolution, times, columns = self.history.query(now=102)
+        self.assertEqual( resolution, 1 )
+        self.assertEqual( times, [100, 101] )
+        self.assertEqual( columns['ram'], [10, 25] )
+        # Unknown values are ignored by the average
+        self.assertEqual( columns['cpu'], [1, 3] )
+
+    def test_downsampling(self):
+        """ Test old points are available only at coarser resolutions """
+        for second in range(100, 120):
+            self.history.add(second, { 'ram': second, 'cpu': None })
+        # The finest resolution keeps only the last points
+        resolution, times, columns = self.history.query(resolution=1)
+        self.assertEqual( times, [115, 116, 117, 118, 119] )
+        # Longer ranges use the coarser resolution
+        resolution, times, columns = self.history.query(since=100, now=120)
+        self.assertEqual( resolution, 10 )
+        self.assertEqual( times, [100, 110] )
+        self.assertEqual( columns['ram'], [104.5, 114.5] )
+        self.assertEqual( columns['cpu'], [None, None] )
+
+    def test_range(self):
+        """ Test getting the points in a time range """
+        for second in ( 100, 101, 103 ):
+            self.history.add(second, { 'ram': 1, 'cpu': 1 })
+        resolution, times, columns = self.history.query(since=101, until=102, now=104)
+        self.assertEqual( times, [101] )
+        with self.assertRaises( RuntimeError ):
+            self.history.query(resolution=5)
+
+    def test_wraparound(self):
+        """ Test slots are reused by newer points """
+        ring = minestorm.server.metrics.MetricsRing(1, 3, ( 'ram', ))
+        ring.add(1, { 'ram': 1 })
+        ring.add(4, { 'ram': 4 })
+        ring.add(5, { 'ram': 5 })
+        # The point of the second 1 was overwritten by the second 4
+        times, columns = ring.query()
+        self.assertEqual( times, [4, 5] )
+        self.assertEqual( columns['ram'], [4, 5] )
@@ -0,0 +1,45 @@
+#!/usr/bin/python3
+import unittest
+import os
+import subprocess
+import minestorm.server.monitoring
+
+class ResourcesSamplerTestCase( unittest.TestCase ):
+    """
+    This class will test the resources sampler, on the current process
+    """
+
+    def setUp(self):
+        self.sampler = minestorm.server.monitoring.ResourcesSampler(None)
+
+    def test_sample(self):
+        """ Test sampling the current process """
+        usage = self.sampler.sample('test', os.getpid())
+        self.assertTrue( usage['rss'] > 0 )
+        self.assertTrue( usage['threads'] >= 1 )
+        self.assertTrue( 0 < usage['ram_used'] < 100 )
+        # The CPU usage needs two samples
+        self.assertIsNone( usage['cpu'] )
+        sum( range(100000) ) # Use some CPU
+        usage = self.sampler.sample('test', os.getpid())
+        self.assertTrue( usage['cpu'] >= 0 )
+
+    def test_process_tree(self):
+        """ Test the usage of children is included """
+        child = subprocess.Popen(['sleep', '10'])
+        try:
+            self.assertIn( child.pid, minestorm.server.monitoring.process_tree( os.getpid() ) )
+            usage = self.sampler.sample('test', os.getpid())
+            self.assertTrue( usage['processes'] >= 2 )
+        finally:
+            child.kill()
+            child.wait()
+
+    def test_memory_total(self):
+        """ Test reading the total memory """
+        self.assertTrue( minestorm.server.monitoring.memory_total() > 0 )
+
+    def test_dead_process(self):
+        """ Test sampling a process which doesn't exist """
+        with self.assertRaises( OSError ):
+            self.sampler.sample('test', 2**22+1)
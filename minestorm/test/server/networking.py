@@ -0,0 +1,383 @@
+#!/usr/bin/python3
+import unittest
+import threading
+import socket
+import time
+import tempfile
+import shutil
+import os
+import asyncio
+import minestorm
+import minestorm.common.networking
+import minestorm.server.networking
+
+class EchoMixin:
+    """
+    Listener which replies to every request with its content,
+    without going through the request processors
+    """
+
+    def setup_echo(self):
+        self.gate = threading.Event()
+        self.gate.set()
+        self.entered = threading.Semaphore(0)
+        self.fail_next = False
+
+    def _on_request_recived(self, conn, addr, data):
+        request = minestorm.server.networking.Request(conn, addr, data)
+        self.entered.release()
+        # Fast requests aren't held by the gate
+        if not request.data.get('fast'):
+            self.gate.wait(5)
+        if self.fail_next:
+            self.fail_next = False
+            raise ValueError('Something went wrong')
+        request.reply({ 'status': 'echo', 'data': request.data.get('data') })
+
+class EchoListener(EchoMixin, minestorm.server.networking.Listener):
+    pass
+
+class NetworkingTestCase( unittest.TestCase ):
+    """
+    Base class of the tests which need a real listener
+    """
+    listener_class = EchoListener
+
+    def configure(self, **entries):
+        """ Change some configuration entries for this test """
+        configuration = minestorm.get('configuration')
+        for key, value in entries.items():
+            key = key.replace('__', '.')
+            old = configuration.get(key) if configuration.has(key) else None
+            self.addCleanup( self._restore, key, old )
+            configuration.update(key, value)
+
+    def _restore(self, key, value):
+        """ Restore a configuration entry """
+        if value is None:
+            minestorm.get('configuration').remove(key)
+        else:
+            minestorm.get('configuration').update(key, value)
+
+    def start_listener(self):
+        """ Start a listener on a free port """
+        self.listener = self.listener_class()
+        self.listener.setup_echo()
+        self.listener.bind(0)
+        self.listener.listen()
+        self.addCleanup( self.stop_listener )
+        self.address = self.listener.socket.getsockname()[:2]
+        return self.listener
+
+    def stop_listener(self):
+        """ Stop the listener, releasing the blocked requests """
+        self.listener.gate.set()
+        if self.listener.started or self.listener.binded:
+            self.listener.stop()
+
+    def request(self, data):
+        """ Make a request with a new connection """
+        return minestorm.common.networking.Client(self.address).request(data)
+
+    def wait_for(self, condition):
+        """ Wait until a condition is true """
+        for i in range(200):
+            if condition():
+                return
+            time.sleep(0.01)
+        self.fail('Condition not met in time')
+
+class WorkersPoolTestCase( NetworkingTestCase ):
+    """
+    This class will test the workers pool of the listener
+    """
+
+    def test_concurrent(self):
+        """ Test requests are processed concurrently by the workers """
+        self.configure( networking__workers__pool_size=4, networking__workers__queue_size=8 )
+        listener = self.start_listener()
+        listener.gate.clear()
+        results = []
+        threads = [ threading.Thread(target=lambda i=i: results.append( self.request({ 'data': i }) )) for i in range(4) ]
+        for thread in threads:
+            thread.start()
+        # All the requests are being processed at the same time
+        for i in range(4):
+            self.assertTrue( listener.entered.acquire(timeout=5) )
+        listener.gate.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual( sorted( result['data'] for result in results ), [ 0, 1, 2, 3 ] )
+        self.assertEqual( listener.get_stats()['processed'], 4 )
+
+    def test_queue_full(self):
+        """ Test requests are rejected when the queue is full """
+        self.configure( networking__workers__pool_size=1, networking__workers__queue_size=1 )
+        listener = self.start_listener()
+        listener.gate.clear()
+        results = []
+        first = threading.Thread(target=lambda: results.append( self.request({ 'data': 1 }) ))
+        first.start()
+        self.assertTrue( listener.entered.acquire(timeout=5) )
+        # This one waits in the queue
+        second = threading.Thread(target=lambda: results.append( self.request({ 'data': 2 }) ))
+        second.start()
+        self.wait_for( lambda: listener.get_stats()['queued'] == 2 )
+        with self.assertLogs('minestorm.networking', 'WARNING'):
+            self.assertEqual( self.request({ 'data': 3 }), { 'status': 'failed', 'reason': 'Server busy' } )
+        listener.gate.set()
+        first.join(5)
+        second.join(5)
+        self.assertEqual( sorted( result['data'] for result in results ), [ 1, 2 ] )
+        self.assertEqual( listener.get_stats()['rejected'], 1 )
+
+    def test_invalid_queue_size(self):
+        """ Test an unbounded queue can't be configured """
+        self.configure( networking__workers__pool_size=1, networking__workers__queue_size=0 )
+        with self.assertRaises( RuntimeError ):
+            EchoListener()._start_workers()
+
+    def test_worker_survives_errors(self):
+        """ Test an unexpected error doesn't kill the worker """
+        self.configure( networking__workers__pool_size=1, networking__workers__queue_size=4 )
+        listener = self.start_listener()
+        listener.fail_next = True
+        with self.assertLogs('minestorm.networking', 'ERROR'):
+            with self.assertRaises( ( socket.error, RuntimeError ) ):
+                self.request({ 'data': 1 })
+        self.assertEqual( self.request({ 'data': 2 }), { 'status': 'echo', 'data': 2 } )
+
+class EchoAsyncListener(EchoMixin, minestorm.server.networking.AsyncListener):
+    pass
+
+class AsyncListenerTestCase( NetworkingTestCase ):
+    """
+    This class will test the asyncio networking engine
+    """
+    listener_class = EchoAsyncListener
+
+    def setUp(self):
+        self.configure( networking__workers__pool_size=2, networking__workers__queue_size=8 )
+
+    def test_request(self):
+        """ Test processing some requests """
+        self.start_listener()
+        for i in range(3):
+            self.assertEqual( self.request({ 'data': i }), { 'status': 'echo', 'data': i } )
+        self.assertEqual( self.listener.get_stats()['accepted'], 3 )
+
+    def test_concurrent(self):
+        """ Test a slow request doesn't stall the event loop """
+        listener = self.start_listener()
+        listener.gate.clear()
+        results = []
+        slow = threading.Thread(target=lambda: results.append( self.request({ 'data': 'slow' }) ))
+        slow.start()
+        self.assertTrue( listener.entered.acquire(timeout=5) )
+        # Another worker replies while the first one is blocked
+        self.assertEqual( self.request({ 'data': 'fast', 'fast': True })['data'], 'fast' )
+        self.assertEqual( results, [] )
+        listener.gate.set()
+        slow.join(5)
+        self.assertEqual( results, [ { 'status': 'echo', 'data': 'slow' } ] )
+
+    def test_queue_full(self):
+        """ Test the event loop rejects requests when the queue is full """
+        self.configure( networking__workers__pool_size=1, networking__workers__queue_size=1 )
+        listener = self.start_listener()
+        listener.gate.clear()
+        threads = [ threading.Thread(target=self.request, args=({ 'data': i },)) for i in range(2) ]
+        threads[0].start()
+        self.assertTrue( listener.entered.acquire(timeout=5) )
+        threads[1].start()
+        self.wait_for( lambda: listener.get_stats()['queued'] == 2 )
+        with self.assertLogs('minestorm.networking', 'WARNING'):
+            self.assertEqual( self.request({ 'data': 3 }), { 'status': 'failed', 'reason': 'Server busy' } )
+        listener.gate.set()
+        for thread in threads:
+            thread.join(5)
+
+    def test_requires_workers(self):
+        """ Test the engine refuses to run without the workers pool """
+        self.configure( networking__workers__pool_size=0 )
+        listener = EchoAsyncListener()
+        listener.bind(0)
+        with self.assertRaises( RuntimeError ):
+            listener.listen()
+        listener.stop()
+
+class AsyncConnectionTestCase( unittest.TestCase ):
+    """
+    This class will test sending data through the asyncio engine
+    """
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.start()
+        self.addCleanup( self.stop_loop )
+        self.server, self.client = socket.socketpair()
+        self.addCleanup( self.client.close )
+        self.server.setblocking(False)
+        reader, writer = asyncio.run_coroutine_threadsafe(asyncio.open_connection(sock=self.server), self.loop).result(5)
+        self.conn = minestorm.server.networking.AsyncConnection(self.loop, writer)
+
+    def stop_loop(self):
+        """ Stop and close the event loop """
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(5)
+            self.loop.close()
+
+    def test_backpressure(self):
+        """ Test a client which doesn't read blocks the sender """
+        sent = []
+        sender = threading.Thread(target=lambda: sent.append( sum( self.conn.send(b'x' * 65536) for i in range(64) ) ))
+        sender.start()
+        time.sleep(0.2)
+        self.assertTrue( sender.is_alive() )
+        # The data queued in memory is bounded
+        self.assertLess( self.conn.writer.transport.get_write_buffer_size(), 4 * 65536 )
+        received = 0
+        while received < 64 * 65536:
+            received += len( self.client.recv(1048576) )
+        sender.join(5)
+        self.assertEqual( sent, [ 64 * 65536 ] )
+
+    def test_closed_loop(self):
+        """ Test using the connection after the loop is closed """
+        self.assertFalse( self.conn.is_closed() )
+        self.stop_loop()
+        self.assertTrue( self.conn.is_closed() )
+        self.conn.close()
+        with self.assertRaises( socket.error ):
+            self.conn.send(b'data')
+
+class MultiplexingTestCase( NetworkingTestCase ):
+    """
+    This class will test the persistent multiplexed connections
+    """
+
+    def setUp(self):
+        self.configure( networking__workers__pool_size=2, networking__workers__queue_size=8 )
+        self.start_listener()
+        self.client = minestorm.common.networking.MultiplexedClient(self.address)
+        self.addCleanup( self.client.close )
+
+    def test_single_connection(self):
+        """ Test all the requests go through the same connection """
+        for i in range(5):
+            self.assertEqual( self.client.request({ 'data': i }, 5), { 'status': 'echo', 'data': i } )
+        self.assertEqual( self.listener.get_stats()['accepted'], 1 )
+
+    def test_out_of_order(self):
+        """ Test a slow response doesn't hold the following ones """
+        self.listener.gate.clear()
+        results = []
+        slow = threading.Thread(target=lambda: results.append( self.client.request({ 'data': 'slow' }, 5) ))
+        slow.start()
+        self.assertTrue( self.listener.entered.acquire(timeout=5) )
+        self.assertEqual( self.client.request({ 'data': 'fast', 'fast': True }, 5)['data'], 'fast' )
+        self.assertEqual( results, [] )
+        self.listener.gate.set()
+        slow.join(5)
+        self.assertEqual( results, [ { 'status': 'echo', 'data': 'slow' } ] )
+
+    def test_connection_lost(self):
+        """ Test pending requests fail when the connection is closed """
+        self.listener.gate.clear()
+        errors = []
+        def request():
+            try:
+                self.client.request({ 'data': 'lost' }, 5)
+            except socket.error as e:
+                errors.append(e)
+        pending = threading.Thread(target=request)
+        pending.start()
+        self.assertTrue( self.listener.entered.acquire(timeout=5) )
+        self.client.close()
+        pending.join(5)
+        self.assertEqual( len(errors), 1 )
+        self.assertNotIsInstance( errors[0], socket.timeout )
+        # A new connection is opened by the next request
+        self.listener.gate.set()
+        self.assertEqual( self.client.request({ 'data': 'again' }, 5)['data'], 'again' )
+
+    def test_stop(self):
+        """ Test stopping the listener closes the persistent connections """
+        self.assertEqual( self.client.request({ 'data': 1 }, 5)['data'], 1 )
+        self.listener.stop()
+        self.wait_for( lambda: not any( isinstance(thread, minestorm.server.networking.ConnectionThread) for thread in threading.enumerate() ) )
+        self.assertEqual( self.listener.connections, set() )
+        # The client sees the connection closed
+        self.wait_for( lambda: self.client.socket is None )
+
+class AsyncMultiplexingTestCase( MultiplexingTestCase ):
+    """
+    This class will test the multiplexed connections with the asyncio engine
+    """
+    listener_class = EchoAsyncListener
+
+class UnixSocketTestCase( NetworkingTestCase ):
+    """
+    This class will test the Unix domain socket
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup( shutil.rmtree, self.directory )
+        self.path = os.path.join(self.directory, 'private', 'minestorm.sock')
+        self.configure( networking__workers__pool_size=0, networking__unix_socket__path=self.path )
+
+    def start_unix_listener(self):
+        """ Start a listener also binding the Unix socket """
+        self.listener = EchoListener()
+        self.listener.setup_echo()
+        self.listener.bind(0)
+        self.addCleanup( self.listener.stop )
+        self.listener.bind_unix(self.path)
+        self.listener.listen()
+
+    def test_request(self):
+        """ Test making requests through the Unix socket """
+        self.start_unix_listener()
+        # The socket is in a directory only its owner can use
+        self.assertEqual( os.stat( os.path.dirname(self.path) ).st_mode & 0o777, 0o700 )
+        client = minestorm.common.networking.client()
+        self.assertEqual( client.address, self.path )
+        self.assertEqual( client.request({ 'data': 1 }), { 'status': 'echo', 'data': 1 } )
+
+    def test_stale_socket(self):
+        """ Test a socket left by a previous run is replaced """
+        os.makedirs( os.path.dirname(self.path) )
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(self.path)
+        stale.close()
+        self.start_unix_listener()
+        self.assertEqual( minestorm.common.networking.Client(self.path).request({ 'data': 1 })['data'], 1 )
+
+    def test_not_a_socket(self):
+        """ Test files which aren't sockets are never removed """
+        os.makedirs( os.path.dirname(self.path) )
+        with open(self.path, 'w') as f:
+            f.write('important')
+        listener = EchoListener()
+        with self.assertRaises( RuntimeError ):
+            listener.bind_unix(self.path)
+        self.assertTrue( os.path.isfile(self.path) )
+        # And clients don't connect to them
+        self.assertNotEqual( minestorm.common.networking.client().address, self.path )
+
+    def test_foreign_socket(self):
+        """ Test sockets owned by other users aren't trusted """
+        if os.getuid() != 0:
+            self.skipTest('Changing the owner of a file requires root')
+        os.makedirs( os.path.dirname(self.path) )
+        foreign = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        foreign.bind(self.path)
+        self.addCleanup( foreign.close )
+        os.chown(self.path, 12345, 12345)
+        self.assertNotEqual( minestorm.common.networking.client().address, self.path )
+        with self.assertRaises( RuntimeError ):
+            EchoListener().bind_unix(self.path)
+        self.assertTrue( os.path.exists(self.path) )
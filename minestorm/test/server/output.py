@@ -0,0 +1,129 @@
+#!/usr/bin/python3
+import unittest
+import tempfile
+import shutil
+import minestorm.server.output
+
+class OutputBufferTestCase( unittest.TestCase ):
+    """
+    This class will test the output buffer of the servers
+    """
+
+    def setUp(self):
+        self.buffer = minestorm.server.output.OutputBuffer(5)
+
+    def test_append(self):
+        """ Test adding lines """
+        self.assertEqual( self.buffer.append('a'), 0 )
+        self.assertEqual( self.buffer.extend(['b', 'c']), 1 )
+        self.assertEqual( len(self.buffer), 3 )
+        self.assertEqual( self.buffer.get(2), 'c' )
+
+    def test_eviction(self):
+        """ Test the oldest lines are evicted when the buffer is full """
+        self.buffer.extend([ str(i) for i in range(8) ])
+        self.assertEqual( len(self.buffer), 5 )
+        self.assertEqual( self.buffer.first, 3 )
+        self.assertEqual( self.buffer.get(7), '7' )
+        with self.assertRaises( KeyError ):
+            self.buffer.get(2)
+        # Evicted lines are reported
+        lines, evicted = self.buffer.retrieve(0, -1)
+        self.assertEqual( lines, { 3: '3', 4: '4', 5: '5', 6: '6', 7: '7' } )
+        self.assertEqual( evicted, 3 )
+
+    def test_retrieve(self):
+        """ Test retrieving lines by sequence number """
+        self.buffer.extend([ str(i) for i in range(8) ])
+        self.assertEqual( self.buffer.retrieve(4, 6), ({ 4: '4', 5: '5' }, 0) )
+        self.assertEqual( self.buffer.retrieve(6, 100), ({ 6: '6', 7: '7' }, 0) )
+        self.assertEqual( self.buffer.retrieve(8, -1), ({}, 0) )
+        self.assertEqual( self.buffer.retrieve(1, 4), ({ 3: '3' }, 2) )
+        self.assertEqual( self.buffer.retrieve(0, 2), ({}, 2) )
+
+    def test_retrieve_negative(self):
+        """ Test retrieving lines relative to the end """
+        self.assertEqual( self.buffer.retrieve(-10, -1), ({}, 0) )
+        self.buffer.extend([ str(i) for i in range(8) ])
+        self.assertEqual( self.buffer.retrieve(-2, -1), ({ 6: '6', 7: '7' }, 0) )
+        self.assertEqual( self.buffer.retrieve(-3, -2), ({ 5: '5', 6: '6' }, 0) )
+        self.assertEqual( self.buffer.retrieve(-7, -1)[1], 2 )
+
+    def test_chunks(self):
+        """ Test retrieving lines in chunks """
+        self.buffer.extend([ str(i) for i in range(8) ])
+        chunks = list( self.buffer.iter_chunks(0, -1, 2) )
+        self.assertEqual( chunks, [ { 3: '3' }, { 4: '4', 5: '5' }, { 6: '6', 7: '7' } ] )
+
+    def test_slice(self):
+        """ Test retrieving consecutive lines as a list """
+        self.buffer.extend([ str(i) for i in range(4) ], 100)
+        self.buffer.extend([ str(i) for i in range(4, 8) ], 200)
+        self.assertEqual( self.buffer.slice(4, 6), (4, ['4', '5'], None, 0) )
+        # Lines wrapping around the end of the ring
+        self.assertEqual( self.buffer.slice(-4, -1, True), (4, ['4', '5', '6', '7'], [200, 200, 200, 200], 0) )
+        self.assertEqual( self.buffer.slice(1, 5, True), (3, ['3', '4'], [100, 200], 2) )
+        self.assertEqual( self.buffer.slice(0, 2), (2, [], None, 2) )
+        self.assertEqual( self.buffer.slice(8, -1), (8, [], None, 0) )
+
+    def test_invalid_capacity(self):
+        """ Test creating a buffer without capacity """
+        with self.assertRaises( RuntimeError ):
+            minestorm.server.output.OutputBuffer(0)
+
+class OutputLogTestCase( unittest.TestCase ):
+    """
+    This class will test the disk-backed output log
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_retrieve(self):
+        """ Test retrieving lines from the log """
+        log = minestorm.server.output.OutputLog(self.directory, 1024*1024)
+        log.append([ 'line {}'.format(i) for i in range(10) ], 100)
+        self.assertEqual( log.next, 10 )
+        self.assertEqual( log.retrieve(3, 6), { 3: 'line 3', 4: 'line 4', 5: 'line 5' } )
+        self.assertEqual( log.retrieve(8, 100), { 8: 'line 8', 9: 'line 9' } )
+        self.assertEqual( log.timestamps(8, 100), [ 100, 100 ] )
+
+    def test_segments(self):
+        """ Test lines are splitted between segments, and old ones are compressed """
+        log = minestorm.server.output.OutputLog(self.directory, 100, 1)
+        for i in range(50):
+            log.append([ 'line {} ☃'.format(i) ])
+        log.compressor.join()
+        self.assertTrue( len(log.segments) > 3 )
+        self.assertTrue( log.segments[0].compressed )
+        self.assertFalse( log.segments[-1].compressed )
+        self.assertEqual( log.retrieve(0, 50), { i: 'line {} ☃'.format(i) for i in range(50) } )
+
+    def test_reopen(self):
+        """ Test the log continues after being reopened """
+        log = minestorm.server.output.OutputLog(self.directory, 100)
+        log.append([ 'line {}'.format(i) for i in range(20) ])
+        log.segments[-1].close()
+        log = minestorm.server.output.OutputLog(self.directory, 100)
+        self.assertEqual( log.next, 20 )
+        log.append([ 'new line' ])
+        self.assertEqual( log.retrieve(19, 21), { 19: 'line 19', 20: 'new line' } )
+
+    def test_crash_recovery(self):
+        """ Test lines written without their index by a crash are dropped """
+        log = minestorm.server.output.OutputLog(self.directory, 1024*1024)
+        log.append([ 'line {}'.format(i) for i in range(5) ])
+        segment = log.segments[-1]
+        segment.close()
+        # The crash happened between the write of the lines and of the index
+        with open(segment.path+'.log', 'ab') as f:
+            f.write(b'orphan 1\norphan 2\nhalf')
+        with open(segment.path+'.idx', 'ab') as f:
+            f.write(b'\x00\x01')
+        log = minestorm.server.output.OutputLog(self.directory, 1024*1024)
+        self.assertEqual( log.next, 5 )
+        log.append([ 'new line' ])
+        self.assertEqual( log.retrieve(3, 6), { 3: 'line 3', 4: 'line 4', 5: 'new line' } )
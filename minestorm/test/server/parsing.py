@@ -0,0 +1,42 @@
+#!/usr/bin/python3
+import unittest
+import minestorm.server.parsing
+
+class LineParserTestCase( unittest.TestCase ):
+    """
+    This class will test the parsers of the output lines
+    """
+
+    def test_vanilla(self):
+        """ Test parsing lines printed by vanilla servers """
+        parser = minestorm.server.parsing.parser('vanilla')
+        self.assertEqual( parser.parse('[12:00:00] [Server thread/INFO]: Steve joined the game'),
+                          ('joined', { 'player': 'Steve', 'level': 'INFO' }) )
+        self.assertEqual( parser.parse('[12:00:00] [Server thread/INFO]: <Steve> hi <3'),
+                          ('chat', { 'player': 'Steve', 'message': 'hi <3', 'level': 'INFO' }) )
+        self.assertEqual( parser.parse('[12:00:00] [Server thread/INFO]: Done (4.512s)! For help, type "help" or "?"'),
+                          ('ready', { 'seconds': '4.512', 'level': 'INFO' }) )
+        self.assertEqual( parser.parse('[12:00:00] [Server thread/WARN]: Can\'t keep up! Is the server overloaded? Running 2503ms or 50 ticks behind'),
+                          ('lag', { 'milliseconds': '2503', 'level': 'WARN' }) )
+        self.assertIsNone( parser.parse('[12:00:00] [Server thread/INFO]: Preparing spawn area: 42%') )
+
+    def test_spigot(self):
+        """ Test parsing lines printed by spigot servers """
+        parser = minestorm.server.parsing.parser('spigot')
+        self.assertEqual( parser.parse('[12:00:00 INFO]: Alex left the game'),
+                          ('left', { 'player': 'Alex', 'level': 'INFO' }) )
+        self.assertEqual( parser.parse('java.lang.NullPointerException: oops'),
+                          ('exception', { 'exception': 'java.lang.NullPointerException', 'message': 'oops', 'level': None }) )
+
+    def test_bungeecord(self):
+        """ Test parsing lines printed by bungeecord """
+        parser = minestorm.server.parsing.parser('bungeecord')
+        self.assertEqual( parser.parse('12:00:00 [INFO] [Steve,/127.0.0.1:51234] <-> InitialHandler has connected'),
+                          ('joined', { 'player': 'Steve', 'level': 'INFO' }) )
+        self.assertEqual( parser.parse('12:00:00 [INFO] Listening on /0.0.0.0:25577'),
+                          ('ready', { 'address': '0.0.0.0:25577', 'level': 'INFO' }) )
+
+    def test_invalid_type(self):
+        """ Test getting the parser of an unknown server type """
+        with self.assertRaises( RuntimeError ):
+            minestorm.server.parsing.parser('forge')
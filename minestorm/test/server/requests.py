@@ -0,0 +1,471 @@
+#!/usr/bin/python3
+import unittest
+import socket
+import json
+import zlib
+import time
+import threading
+import minestorm
+import minestorm.common
+import minestorm.server.networking
+import minestorm.server.requests
+import minestorm.server.jobs
+import minestorm.server.servers
+import minestorm.common.networking
+import minestorm.common.events
+import minestorm.test.server.servers
+
+class FakeSessions:
+    """
+    Sessions manager which doesn't need the clearer thread
+    """
+
+    def __init__(self, *sids):
+        self.sessions = { sid: FakeSession() for sid in sids }
+
+    def is_valid(self, sid):
+        return sid in self.sessions
+
+    def get(self, sid):
+        return self.sessions[sid]
+
+    def remove(self, sid):
+        del self.sessions[sid]
+
+class FakeSession:
+    """
+    Session which never expires
+    """
+
+    def touch(self):
+        pass
+
+class FakeServers:
+    """
+    Servers manager which delivers lines synchronously
+    """
+
+    def __init__(self, lines):
+        self.servers = { 'srv': self }
+        self.lines = lines
+        self.methods = []
+        self.options = []
+        self.during_replay = []
+
+    def subscribe(self, method, args={}, **options):
+        self.methods.append(method)
+        self.options.append(options)
+
+    def unsubscribe(self, method):
+        self.methods.remove(method)
+
+    def get(self, name):
+        return self
+
+    def retrieve_lines(self, start, stop):
+        # Print some lines from another thread while replaying
+        thread = threading.Thread(target=lambda: [ self.emit(index, line) for index, line in self.during_replay ])
+        thread.start()
+        thread.join(5)
+        return { index: line for index, line in enumerate(self.lines) if index >= start }
+
+    def emit(self, index, line):
+        """ Deliver a line to the subscribers """
+        for method in list(self.methods):
+            method(server='srv', line=line, index=index)
+
+class ExplodeProcessor( minestorm.server.requests.BaseProcessor ):
+    """
+    Processor which fails with an unexpected error
+    """
+    name = 'explode'
+
+    def process(self, request):
+        raise ValueError('Something went wrong')
+
+class OneServer:
+    """
+    Servers manager with a single real server
+    """
+
+    def __init__(self, server):
+        self.servers = { server.details['name']: server }
+
+    def get(self, name):
+        return self.servers[name]
+
+class RequestsTestCase( unittest.TestCase ):
+    """
+    Base class of the tests which send requests to the processors
+    """
+    processors = ()
+
+    def setUp(self):
+        resources = minestorm.get('resources')
+        if not resources.exists('server.request_processors'):
+            resources.add('server.request_processors', subclass_of=minestorm.server.requests.BaseProcessor)
+            self.addCleanup( resources.remove, 'server.request_processors' )
+        self.sorter = minestorm.server.requests.RequestSorter()
+        for processor in self.processors:
+            self.sorter.register( processor() )
+        self.addCleanup( self.sorter.flush )
+        self.sessions = FakeSessions('sid')
+        self.bind('server.requests', self.sorter)
+        self.bind('server.sessions', self.sessions)
+
+    def bind(self, key, value):
+        """ Bind an item in the container for this test """
+        if minestorm.has(key):
+            self.addCleanup( minestorm.bind, key, minestorm.get(key), True )
+        else:
+            self.addCleanup( minestorm.remove, key )
+        minestorm.bind(key, value, True)
+
+    def send(self, data):
+        """ Send a request through a socket pair, returning the
+        request and the other end of the pair """
+        server, client = socket.socketpair()
+        self.addCleanup( server.close )
+        self.addCleanup( client.close )
+        request = minestorm.server.networking.Request(minestorm.server.networking.Connection(server), ( 'test', 0 ), json.dumps(data).encode('utf-8'))
+        self.sorter.sort(request)
+        return request, client
+
+    def receive(self, client):
+        """ Receive a message from the other end of a pair """
+        return json.loads( minestorm.common.receive_frame(client).decode('utf-8') )
+
+    def request(self, data):
+        """ Make a request and return the response """
+        request, client = self.send(data)
+        return self.receive(client)
+
+    def configure(self, key, value):
+        """ Change a configuration entry for this test """
+        configuration = minestorm.get('configuration')
+        self.addCleanup( configuration.update, key, configuration.get(key) )
+        configuration.update(key, value)
+
+    def create_server(self, **details):
+        """ Create a real server, never started, which doesn't save anything """
+        self.configure('servers.data_directory', '')
+        details.update({ 'name': 'srv', 'type': 'vanilla', 'start_command': { 'jar': 'server.jar' } })
+        server = minestorm.server.servers.Server(details, minestorm.test.server.servers.FakeManager())
+        self.bind('server.servers', OneServer(server))
+        return server
+
+class BatchTestCase( RequestsTestCase ):
+    """
+    This class will test the batch processor
+    """
+    processors = ( minestorm.server.requests.BatchProcessor, minestorm.server.requests.PingProcessor,
+                   minestorm.server.requests.RemoveSessionProcessor, ExplodeProcessor )
+
+    def batch(self, *requests):
+        """ Make a batch and return its responses """
+        response = self.request({ 'status': 'batch', 'sid': 'sid', 'requests': list(requests) })
+        self.assertEqual( response['status'], 'batch_response' )
+        return [ item['status'] for item in response['responses'] ]
+
+    def test_batch(self):
+        """ Test the responses are in the same order of the requests """
+        self.assertEqual( self.batch({ 'status': 'ping' }, { 'status': 'unknown' }, 'invalid', { 'status': 'batch' }),
+                          [ 'pong', 'invalid_request', 'invalid_request', 'failed' ] )
+
+    def test_invalid_sid(self):
+        """ Test batches need a valid SID """
+        response = self.request({ 'status': 'batch', 'sid': 'other', 'requests': [ { 'status': 'ping' } ] })
+        self.assertEqual( response, { 'status': 'failed', 'reason': 'Invalid SID' } )
+
+    def test_removed_session(self):
+        """ Test requests after a remove_session aren't authorized """
+        self.sessions.sessions['other'] = FakeSession()
+        responses = self.batch({ 'status': 'remove_session' }, { 'status': 'remove_session', 'sid': 'other' }, { 'status': 'ping' })
+        self.assertEqual( responses, [ 'ok', 'failed', 'pong' ] )
+        self.assertNotIn( 'sid', self.sessions.sessions )
+        # The SID of the batch can't be replaced by the requests
+        self.assertIn( 'other', self.sessions.sessions )
+
+    def test_error(self):
+        """ Test an error in a request doesn't lose the other responses """
+        with self.assertLogs('minestorm.request', 'ERROR'):
+            self.assertEqual( self.batch({ 'status': 'ping' }, { 'status': 'explode' }, { 'status': 'ping' }), [ 'pong', 'failed', 'pong' ] )
+
+class SubscriptionTestCase( RequestsTestCase ):
+    """
+    This class will test the subscriptions to the output
+    """
+    processors = ( minestorm.server.requests.SubscribeLinesProcessor, )
+
+    def setUp(self):
+        super(SubscriptionTestCase, self).setUp()
+        self.servers = FakeServers([ 'a', 'b', 'c', 'd', 'e' ])
+        self.bind('server.servers', self.servers)
+
+    def subscribe(self, **data):
+        """ Start a subscription, returning the other end of the connection """
+        data.update({ 'status': 'subscribe_lines', 'server': 'srv', 'sid': 'sid' })
+        request, client = self.send(data)
+        self.assertEqual( self.receive(client)['status'], 'subscribed' )
+        return request, client
+
+    def lines(self, client, count):
+        """ Receive some lines """
+        return [ ( message['index'], message['line'] ) for message in ( self.receive(client) for i in range(count) ) ]
+
+    def test_replay(self):
+        """ Test old lines are replayed before the new ones """
+        request, client = self.subscribe(start=3)
+        self.servers.emit(5, 'f')
+        self.assertEqual( self.lines(client, 3), [ ( 3, 'd' ), ( 4, 'e' ), ( 5, 'f' ) ] )
+
+    def test_lines_during_replay(self):
+        """ Test lines printed during the replay aren't lost nor duplicated """
+        self.servers.during_replay = [ ( 4, 'e' ), ( 5, 'f' ) ]
+        request, client = self.subscribe(start=3)
+        self.servers.emit(6, 'g')
+        self.assertEqual( self.lines(client, 4), [ ( 3, 'd' ), ( 4, 'e' ), ( 5, 'f' ), ( 6, 'g' ) ] )
+
+    def test_stop(self):
+        """ Test stopping a subscription ends only that request """
+        request, client = self.subscribe(request_id=7)
+        subscription = self.servers.methods[0].__self__
+        subscription.stop()
+        self.assertEqual( self.receive(client), { 'status': 'unsubscribed', 'server': 'srv', 'request_id': 7 } )
+        self.assertEqual( self.servers.methods, [] )
+        # The connection is still usable by other requests
+        self.assertNotEqual( request.connection.socket.fileno(), -1 )
+
+    def test_client_gone(self):
+        """ Test a client which goes away while no line is printed is noticed """
+        request, client = self.subscribe(request_id=7)
+        check = self.servers.options[0]['on_idle']
+        # Other requests sent by the client don't look like a disconnection
+        client.sendall(b'pending')
+        check()
+        self.assertEqual( len(self.servers.methods), 1 )
+        # The connection thread reads them, then the client closes
+        self.assertEqual( request.connection.socket.recv(16), b'pending' )
+        client.close()
+        check()
+        self.assertEqual( self.servers.methods, [] )
+
+class WaitTestCase( RequestsTestCase ):
+    """
+    This class will test waiting for background jobs
+    """
+    processors = ( minestorm.server.requests.WaitProcessor, minestorm.server.requests.BatchProcessor )
+
+    def setUp(self):
+        super(WaitTestCase, self).setUp()
+        self.jobs = minestorm.server.jobs.JobsManager()
+        self.addCleanup( self.jobs.stop )
+        self.bind('server.jobs', self.jobs)
+        self.gate = threading.Event()
+        self.addCleanup( self.gate.set )
+        started = threading.Event()
+        self.job = self.jobs.submit('test', lambda job: started.set() or self.gate.wait(5))
+        self.assertTrue( started.wait(5) )
+
+    def test_wait(self):
+        """ Test the reply is sent when the job finishes, without blocking the processor """
+        request, client = self.send({ 'status': 'wait', 'sid': 'sid', 'job': self.job.id })
+        self.assertFalse( request.replied )
+        self.gate.set()
+        response = self.receive(client)
+        self.assertEqual( response['job']['status'], 'DONE' )
+
+    def test_timeout(self):
+        """ Test the reply is sent when the timeout expires """
+        response = self.request({ 'status': 'wait', 'sid': 'sid', 'job': self.job.id, 'timeout': 0.1 })
+        self.assertEqual( response['job']['status'], 'RUNNING' )
+
+    def test_batched(self):
+        """ Test batched waits reply with the current status """
+        response = self.request({ 'status': 'batch', 'sid': 'sid', 'requests': [ { 'status': 'wait', 'job': self.job.id } ] })
+        self.assertEqual( response['responses'][0]['job']['status'], 'RUNNING' )
+
+    def test_invalid_timeout(self):
+        """ Test invalid timeouts are refused with a reason """
+        for timeout, reason in ( ( 'abc', 'it must be a number' ), ( True, 'it must be a number' ), ( -1, 'it must be at least 0' ), ( 'nan', 'it must be a finite number' ) ):
+            response = self.request({ 'status': 'wait', 'sid': 'sid', 'job': self.job.id, 'timeout': timeout })
+            self.assertEqual( response, { 'status': 'invalid_request', 'reason': 'Invalid timeout: {}'.format(reason) } )
+
+class RetrieveLinesTestCase( RequestsTestCase ):
+    """
+    This class will test retrieving the output, also in chunks
+    """
+    processors = ( minestorm.server.requests.RetrieveLinesProcessor, )
+
+    def setUp(self):
+        super(RetrieveLinesTestCase, self).setUp()
+        self.server = self.create_server(scrollback=10)
+        self.server.output.extend([ 'line {}'.format(i) for i in range(8) ], 100)
+
+    def retrieve(self, **data):
+        """ Make a retrieve_lines request """
+        data.update({ 'status': 'retrieve_lines', 'sid': 'sid', 'server': 'srv' })
+        return self.request(data)
+
+    def test_compact(self):
+        """ Test retrieving the lines as a list """
+        response = self.retrieve(start=-3, stop=-1, compact=True, times=True)
+        self.assertEqual( response['base'], 5 )
+        self.assertEqual( response['lines'], [ 'line 5', 'line 6', 'line 7' ] )
+        self.assertEqual( response['times'], [ 100, 100, 100 ] )
+        self.assertEqual( ( response['next'], response['evicted'] ), ( 8, 0 ) )
+        # Old clients get a dict with the sequence numbers
+        response = self.retrieve(start=6, stop=8)
+        self.assertEqual( response['lines'], { '6': 'line 6', '7': 'line 7' } )
+
+    def test_chunks(self):
+        """ Test the lines are sent in chunks, followed by the end marker """
+        request, client = self.send({ 'status': 'retrieve_lines', 'sid': 'sid', 'server': 'srv', 'start': 0, 'stop': -1,
+                                      'chunked': True, 'chunk_size': 3, 'compact': True })
+        messages = [ self.receive(client) for i in range(4) ]
+        self.assertEqual( [ message['status'] for message in messages ], [ 'chunk', 'chunk', 'chunk', 'chunks_end' ] )
+        self.assertEqual( [ ( message['data']['base'], len( message['data']['lines'] ) ) for message in messages[:3] ], [ ( 0, 3 ), ( 3, 3 ), ( 6, 2 ) ] )
+        self.assertEqual( messages[2]['data']['lines'], [ 'line 6', 'line 7' ] )
+        self.assertEqual( messages[3]['count'], 3 )
+
+    def test_evicted_while_streaming(self):
+        """ Test lines evicted between two chunks are skipped """
+        chunks = self.server.iter_lines(0, -1, 3, compact=True)
+        self.assertEqual( next(chunks), { 'base': 0, 'lines': [ 'line 0', 'line 1', 'line 2' ] } )
+        # Only the lines from 7 are in memory now
+        self.server.output.extend([ 'new line' ] * 9, 200)
+        self.assertEqual( list(chunks), [ { 'base': 7, 'lines': [ 'line 7' ] } ] )
+
+    def test_invalid_chunk_size(self):
+        """ Test chunks must contain at least a line """
+        response = self.retrieve(start=0, stop=-1, chunked=True, chunk_size=0)
+        self.assertEqual( response, { 'status': 'failed', 'reason': 'Invalid chunk size' } )
+
+    def test_client(self):
+        """ Test receiving the chunks with the client, through a real listener """
+        self.configure('networking.compression.threshold', 10)
+        # Pass the requests received by the listener to the processors
+        events = minestorm.common.events.EventsManager()
+        events.create('server.networking.request_received')
+        events.listen('server.networking.request_received', lambda event: self.sorter.sort(event.data['request']))
+        self.bind('events', events)
+        listener = minestorm.server.networking.Listener()
+        self.bind('server.networking', listener)
+        listener.bind(0)
+        listener.listen()
+        self.addCleanup( listener.stop )
+        client = minestorm.common.networking.Client(listener.socket.getsockname()[:2], compression=True)
+        chunks = list( client.request_chunks({ 'status': 'retrieve_lines', 'sid': 'sid', 'server': 'srv', 'start': 0, 'stop': -1,
+                                               'chunked': True, 'chunk_size': 5 }) )
+        self.assertEqual( chunks, [ { str(i): 'line {}'.format(i) for i in range(5) }, { str(i): 'line {}'.format(i) for i in range(5, 8) } ] )
+        # The frames were compressed, since the client supports it
+        self.assertGreater( listener.get_stats()['compression']['frames'], 0 )
+        # Errors are raised instead of being returned as chunks
+        with self.assertRaises( RuntimeError ):
+            list( client.request_chunks({ 'status': 'retrieve_lines', 'sid': 'sid', 'server': 'srv', 'start': 0, 'stop': -1,
+                                          'chunked': True, 'chunk_size': 0 }) )
+
+class CompressionTestCase( RequestsTestCase ):
+    """
+    This class will test the negotiation of the compression
+    """
+
+    def setUp(self):
+        super(CompressionTestCase, self).setUp()
+        self.configure('networking.compression.threshold', 100)
+        self.listener = minestorm.server.networking.Listener()
+        self.bind('server.networking', self.listener)
+
+    def compress(self, data, payload):
+        """ Compress a payload for a request """
+        request = minestorm.server.networking.Request(None, ( 'test', 0 ), json.dumps(data).encode('utf-8'))
+        return request._compress(payload)
+
+    def test_negotiation(self):
+        """ Test frames are compressed only for clients supporting it """
+        payload = b'x' * 1000
+        compressed, flag = self.compress({ 'status': 'ping', 'compression': [ 'zlib' ] }, payload)
+        self.assertTrue( flag )
+        self.assertEqual( zlib.decompress(compressed), payload )
+        self.assertEqual( self.compress({ 'status': 'ping' }, payload), ( payload, False ) )
+        self.assertEqual( self.compress({ 'status': 'ping', 'compression': [ 'lz4' ] }, payload), ( payload, False ) )
+        self.assertEqual( self.listener.get_stats()['compression']['frames'], 1 )
+
+    def test_threshold(self):
+        """ Test small frames aren't compressed """
+        self.assertEqual( self.compress({ 'status': 'ping', 'compression': [ 'zlib' ] }, b'small'), ( b'small', False ) )
+
+class MetricsHistoryTestCase( RequestsTestCase ):
+    """
+    This class will test the history of the metrics
+    """
+    processors = ( minestorm.server.requests.MetricsHistoryProcessor, )
+
+    def setUp(self):
+        super(MetricsHistoryTestCase, self).setUp()
+        self.server = self.create_server()
+        self.now = int( time.time() )
+        for i in range(3):
+            self.server.metrics.add(self.now - 3 + i, { 'ram': 100 * i, 'cpu': 0.5, 'lines': 10, 'players': None })
+
+    def history(self, **data):
+        """ Make a metrics_history request """
+        data.update({ 'status': 'metrics_history', 'sid': 'sid', 'server': 'srv' })
+        return self.request(data)
+
+    def test_history(self):
+        """ Test getting the points at the finest resolution """
+        response = self.history(since=self.now - 60)
+        self.assertEqual( response['status'], 'metrics_history_response' )
+        self.assertEqual( ( response['resolution'], response['resolutions'] ), ( 1, [ 1, 60, 600 ] ) )
+        self.assertEqual( response['times'], [ self.now - 3, self.now - 2, self.now - 1 ] )
+        self.assertEqual( response['metrics']['ram'], [ 0, 100, 200 ] )
+        self.assertEqual( response['metrics']['players'], [ None, None, None ] )
+
+    def test_resolution(self):
+        """ Test getting the downsampled points, and only some metrics """
+        response = self.history(resolution=60, metrics=[ 'cpu' ])
+        self.assertEqual( response['resolution'], 60 )
+        self.assertEqual( list( response['metrics'] ), [ 'cpu' ] )
+        self.assertEqual( response['metrics']['cpu'][-1], 0.5 )
+
+    def test_invalid(self):
+        """ Test invalid requests are refused with a reason """
+        self.assertEqual( self.history(metrics=[ 'fps' ])['reason'], 'Invalid metrics' )
+        self.assertEqual( self.history(resolution=7)['reason'], 'Invalid resolution: 7' )
+        self.assertEqual( self.history(since='yesterday'), { 'status': 'invalid_request', 'reason': 'Invalid since: it must be a number' } )
+        self.assertEqual( self.history(until=[ 1 ])['status'], 'invalid_request' )
+        self.assertEqual( self.history(resolution=1.5)['reason'], 'Invalid resolution: it must be an integer' )
+        # Numbers sent as strings are still accepted
+        self.assertEqual( self.history(since=str(self.now - 60))['times'], [ self.now - 3, self.now - 2, self.now - 1 ] )
+        self.assertEqual( self.request({ 'status': 'metrics_history', 'sid': 'sid', 'server': 'other' })['reason'], 'Invalid server' )
+        self.server.metrics = None
+        self.assertEqual( self.history()['reason'], 'The metrics history is disabled' )
+
+class StartupHistoryTestCase( RequestsTestCase ):
+    """
+    This class will test the history of the starts
+    """
+    processors = ( minestorm.server.requests.StartupHistoryProcessor, )
+
+    def setUp(self):
+        super(StartupHistoryTestCase, self).setUp()
+        self.server = self.create_server()
+        for i in range(3):
+            self.server.startups.record({ 'started': i, 'result': 'ready', 'seconds': i + 1, 'cds': 'off' })
+
+    def history(self, **data):
+        """ Make a startup_history request """
+        data.update({ 'status': 'startup_history', 'sid': 'sid', 'server': 'srv' })
+        return self.request(data)
+
+    def test_limit(self):
+        """ Test only the last starts are returned """
+        response = self.history(limit=2)
+        self.assertEqual( [ entry['started'] for entry in response['starts'] ], [ 1, 2 ] )
+        self.assertEqual( response['summary']['count'], 3 )
+
+    def test_invalid_limit(self):
+        """ Test invalid limits are refused with a reason """
+        self.assertEqual( self.history(limit=-1), { 'status': 'invalid_request', 'reason': 'Invalid limit: it must be at least 1' } )
+        self.assertEqual( self.history(limit='all')['reason'], 'Invalid limit: it must be a number' )
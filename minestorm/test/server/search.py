@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+import unittest
+import minestorm.server.search
+
+class WordIndexTestCase( unittest.TestCase ):
+    """
+    This class will test the index of the output words
+    """
+
+    def setUp(self):
+        self.index = minestorm.server.search.WordIndex()
+        self.index.add(0, [ 'Steve joined the game', 'Alex joined the game' ], 100)
+        self.index.add(2, [ '<Steve> hello', 'Steve left the game' ], 200)
+
+    def test_candidates(self):
+        """ Test getting the lines which may match """
+        self.assertEqual( self.index.candidates(['steve'], 0, 4), [0, 2, 3] )
+        self.assertEqual( self.index.candidates(['Steve', 'game'], 0, 4), [0, 3] )
+        # Fragments match parts of words
+        self.assertEqual( self.index.candidates(['join'], 0, 4), [0, 1] )
+        self.assertEqual( self.index.candidates(['creeper'], 0, 4), [] )
+        # Without usable fragments every line may match
+        self.assertEqual( list( self.index.candidates(['a'], 1, 3) ), [1, 2] )
+
+    def test_time_range(self):
+        """ Test converting a time range to sequence numbers """
+        self.assertEqual( self.index.time_range(), (0, 4) )
+        self.assertEqual( self.index.time_range(150), (2, 4) )
+        self.assertEqual( self.index.time_range(None, 150), (0, 2) )
+        self.assertEqual( self.index.time(3), 200 )
+
+    def test_prune(self):
+        """ Test removing old lines from the index """
+        self.index.prune(2)
+        self.assertEqual( self.index.base, 2 )
+        self.assertEqual( self.index.candidates(['steve'], 0, 4), [2, 3] )
+        self.assertNotIn( 'alex', self.index.words )
+        self.assertIsNone( self.index.time(1) )
+
+    def test_order(self):
+        """ Test lines must be indexed in order """
+        with self.assertRaises( RuntimeError ):
+            self.index.add(10, [ 'line' ], 300)
+
+    def test_fragments(self):
+        """ Test extracting the words needed by a query """
+        fragments = minestorm.server.search.fragments
+        self.assertEqual( fragments('joined the game'), ['joined', 'the', 'game'] )
+        self.assertEqual( fragments(r'Steve (joined|left) \w+ game', True), ['Steve', 'game'] )
+        self.assertEqual( fragments('colou?r', True), ['colo', 'r'] )
+        self.assertEqual( fragments('ab{2}cd', True), ['a', 'cd'] )
+        self.assertEqual( fragments('steve|alex', True), [] )
+
+    def test_grams(self):
+        """ Test the words are found by their trigrams, also after a prune """
+        self.assertEqual( self.index.candidates(['oin'], 0, 4), [0, 1] )
+        # The trigrams are there, but not in the right order
+        self.assertEqual( self.index.candidates(['gamegam'], 0, 4), [] )
+        self.index.prune(2)
+        self.assertNotIn( 'ale', self.index.grams )
+        self.assertIn( 'ste', self.index.grams )
+
+    def test_selective(self):
+        """ Test intersecting a rare fragment with a common one """
+        index = minestorm.server.search.WordIndex()
+        index.add(0, [ 'common line' ] * 1000 + [ 'common rare line' ] + [ 'rare' ], 100)
+        self.assertEqual( index.candidates(['line', 'rare'], 0, 1002), [1000] )
+        self.assertEqual( index.candidates(['mmo', 'ine', 'rare'], 0, 1002), [1000] )
+        self.assertEqual( index.candidates(['rare', 'line'], 1001, 1002), [] )
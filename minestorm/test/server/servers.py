@@ -0,0 +1,513 @@
+#!/usr/bin/python3
+import unittest
+import threading
+import time
+import os
+import tempfile
+import shutil
+import sys
+import minestorm
+import minestorm.common.events
+import minestorm.server.output
+import minestorm.server.parsing
+import minestorm.server.servers
+
+class LineSplitterTestCase( unittest.TestCase ):
+    """
+    This class will test the splitter of the servers output
+    """
+
+    def setUp(self):
+        self.splitter = minestorm.server.servers.LineSplitter()
+
+    def test_lines(self):
+        """ Test splitting complete lines """
+        self.assertEqual( self.splitter.feed(b'first\nsecond\n'), ['first', 'second'] )
+        self.assertEqual( self.splitter.flush(), '' )
+
+    def test_partial_lines(self):
+        """ Test lines splitted between chunks """
+        self.assertEqual( self.splitter.feed(b'fir'), [] )
+        self.assertEqual( self.splitter.feed(b'st\nsec'), ['first'] )
+        self.assertEqual( self.splitter.feed(b'ond\nthi'), ['second'] )
+        self.assertEqual( self.splitter.flush(), 'thi' )
+
+    def test_multibyte_characters(self):
+        """ Test multi-byte characters splitted between chunks """
+        data = 'héllo wörld ☃\n'.encode('utf-8')
+        lines = []
+        # Feed a byte at time, splitting every character
+        for i in range(len(data)):
+            lines.extend( self.splitter.feed(data[i:i+1]) )
+        self.assertEqual( lines, ['héllo wörld ☃'] )
+
+    def test_invalid_bytes(self):
+        """ Test invalid UTF-8 doesn't break the splitter """
+        self.assertEqual( self.splitter.feed(b'bad \xff byte\n'), ['bad � byte'] )
+
+class FakeServer:
+    """
+    Server whose output is written by the test through a pipe
+    """
+
+    def __init__(self, name):
+        self.details = { 'name': name }
+        read, self.write = os.pipe()
+        self.pipes = { 'out': os.fdopen(read, 'rb') }
+        self.output = minestorm.server.output.OutputBuffer(100)
+        self.processed = []
+        self.stopped = threading.Event()
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def print(self, line):
+        os.write(self.write, line.encode('utf-8') + b'\n')
+
+    def close(self):
+        os.close(self.write)
+
+    def _on_lines_printed(self, lines):
+        self._process_lines( self.output.extend(lines, 0), lines, 0 )
+
+    def _process_lines(self, first, lines, timestamp):
+        self.gate.wait(5) # Simulate slow disks
+        if 'explode' in lines:
+            raise OSError('No space left on device')
+        self.processed += [ ( first+i, line ) for i, line in enumerate(lines) ]
+
+    def _on_stop(self):
+        self.gate.wait(5) # Simulate a process slow to exit
+        self.stopped.set()
+
+class FakeSampler:
+    """
+    Sampler which doesn't sample anything
+    """
+
+    def sample_all(self):
+        pass
+
+class OutputReactorTestCase( unittest.TestCase ):
+    """
+    This class will test the output reactor
+    """
+
+    def setUp(self):
+        self.dispatcher = minestorm.server.servers.OutputDispatcher(2)
+        self.reactor = minestorm.server.servers.OutputReactor(FakeSampler(), self.dispatcher)
+        self.reactor.start()
+        self.addCleanup( self.stop )
+        self.servers = [ FakeServer('a'), FakeServer('b') ]
+        for server in self.servers:
+            self.reactor.register(server)
+
+    def stop(self):
+        for server in self.servers:
+            server.gate.set()
+        self.reactor.stop = True
+        self.dispatcher.stop()
+
+    def wait_for(self, condition):
+        """ Wait until a condition is true """
+        for i in range(200):
+            if condition():
+                return
+            time.sleep(0.01)
+        self.fail('Condition not met in time')
+
+    def test_lines(self):
+        """ Test lines are processed in order, and the stop after them """
+        a = self.servers[0]
+        for i in range(50):
+            a.print(str(i))
+        a.close()
+        self.assertTrue( a.stopped.wait(5) )
+        self.assertEqual( a.processed, [ ( i, str(i) ) for i in range(50) ] )
+
+    def test_slow_stop(self):
+        """ Test a server slow to stop doesn't hold the output of the others """
+        a, b = self.servers
+        a.gate.clear()
+        a.close()
+        time.sleep(0.1)
+        b.print('hello')
+        self.wait_for( lambda: b.processed == [ ( 0, 'hello' ) ] )
+        self.assertFalse( a.stopped.is_set() )
+
+    def test_slow_processing(self):
+        """ Test a server slow to process its lines doesn't hold the others """
+        a, b = self.servers
+        a.gate.clear()
+        a.print('first')
+        b.print('hello')
+        self.wait_for( lambda: b.processed == [ ( 0, 'hello' ) ] )
+        # The lines are already readable while they're processed
+        self.assertEqual( a.output.slice(0, 1)[1], [ 'first' ] )
+        self.assertEqual( a.processed, [] )
+        a.gate.set()
+        self.wait_for( lambda: a.processed == [ ( 0, 'first' ) ] )
+
+class FakeManager:
+    """
+    Servers manager without subscribers, watching the output with threads
+    """
+    reactor = None
+
+    def __init__(self):
+        self.servers = {}
+
+    def _emit_lines(self, server, first, lines):
+        pass
+
+# Fake server, printing the Minecraft messages, configured by its flags
+FAKE_SERVER = """#!{python}
+import sys, time, signal
+args = sys.argv[1:]
+delay = float( [ arg[8:] for arg in args if arg.startswith('--delay=') ][0] ) if any( arg.startswith('--delay=') for arg in args ) else 0
+if '--ignore-term' in args:
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+print('[Server thread/INFO]: Starting minecraft server version 1.8', flush=True)
+time.sleep(delay)
+if '--never-ready' not in args:
+    print('[Server thread/INFO]: Done (0.1s)! For help, type "help" or "?"', flush=True)
+for line in sys.stdin:
+    if line.startswith('stop') and '--stubborn' not in args:
+        print('[Server thread/INFO]: Stopping server', flush=True)
+        sys.exit(0)
+time.sleep(60)
+"""
+
+class OutputWatcherTestCase( unittest.TestCase ):
+    """
+    This class will test the thread watching the output of a server
+    """
+
+    def test_errors(self):
+        """ Test an error processing some lines doesn't stop the reading """
+        server = FakeServer('a')
+        watcher = minestorm.server.servers.OutputWatcher(server)
+        watcher.start()
+        with self.assertLogs('minestorm.servers', 'ERROR'):
+            server.print('explode')
+            time.sleep(0.1)
+        server.print('after')
+        server.close()
+        self.assertTrue( server.stopped.wait(5) )
+        watcher.join(5)
+        self.assertFalse( watcher.is_alive() )
+        self.assertEqual( server.processed, [ ( 1, 'after' ) ] )
+
+class ServerTestCase( unittest.TestCase ):
+    """
+    Base class of the tests which need a real server, never started
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup( shutil.rmtree, self.directory )
+        self.configure('servers.data_directory', self.directory)
+
+    def configure(self, key, value):
+        """ Change a configuration entry for this test """
+        configuration = minestorm.get('configuration')
+        self.addCleanup( configuration.update, key, configuration.get(key) )
+        configuration.update(key, value)
+
+    def bind(self, key, value):
+        """ Bind an item in the container for this test """
+        if minestorm.has(key):
+            self.addCleanup( minestorm.bind, key, minestorm.get(key), True )
+        else:
+            self.addCleanup( minestorm.remove, key )
+        minestorm.bind(key, value, True)
+
+    def create_server(self, **details):
+        """ Create a server with some details """
+        details.update({ 'name': 'test', 'type': 'vanilla' })
+        details.setdefault('start_command', {}).update({ 'jar': 'server.jar', 'directory': self.directory })
+        return minestorm.server.servers.Server(details, FakeManager())
+
+class DataDirectoryTestCase( ServerTestCase ):
+    """
+    This class will test the data saved by the servers
+    """
+
+    def test_unusable_directory(self):
+        """ Test a data directory which can't be used doesn't prevent creating servers """
+        path = os.path.join(self.directory, 'file')
+        with open(path, 'w') as f:
+            f.write('not a directory')
+        self.configure('servers.data_directory', path)
+        with open(os.path.join(self.directory, 'server.jar'), 'w') as f:
+            f.write('jar')
+        with self.assertLogs('minestorm.servers', 'WARNING') as logs:
+            server = self.create_server(jvm={ 'cds': True }, start_command={ 'java': shutil.which('true') })
+            self.assertIsNone( server.startups.path )
+            self.assertEqual( server.cds.prepare(), ( None, [] ) )
+        self.assertIn( 'class data archives directory', logs.output[-1] )
+
+    def test_missing_directory(self):
+        """ Test the data directory isn't required """
+        configuration = minestorm.get('configuration')
+        self.addCleanup( configuration.update, 'servers.data_directory', configuration.get('servers.data_directory') )
+        configuration.remove('servers.data_directory')
+        server = self.create_server()
+        self.assertIsNone( server.startups.path )
+
+class SearchLinesTestCase( ServerTestCase ):
+    """
+    This class will test searching the output of a server
+    """
+
+    def setUp(self):
+        super(SearchLinesTestCase, self).setUp()
+        self.server = self.create_server()
+        # Lines the parser doesn't recognize, which trigger no events
+        self.server._on_lines_printed([ 'Steve opened the door', 'Alex opened the door', 'Steve closed the door' ])
+
+    def test_search(self):
+        """ Test the newest matching lines are returned """
+        matches, truncated = self.server.search_lines('opened', limit=1)
+        self.assertEqual( [ match['line'] for match in matches ], [ 'Alex opened the door' ] )
+        self.assertTrue( truncated )
+        matches, truncated = self.server.search_lines('steve', ignore_case=True)
+        self.assertEqual( [ match['index'] for match in matches ], [ 0, 2 ] )
+        self.assertFalse( truncated )
+
+    def test_invalid_limit(self):
+        """ Test a limit lower than 1 is refused instead of returning every line """
+        for limit in ( 0, -1 ):
+            with self.assertRaises( RuntimeError ):
+                self.server.search_lines('opened', limit=limit)
+
+class OutputEventsTestCase( ServerTestCase ):
+    """
+    This class will test the events triggered by the output of a server
+    """
+
+    def setUp(self):
+        super(OutputEventsTestCase, self).setUp()
+        self.bind('events', minestorm.common.events.EventsManager())
+        minestorm.server.parsing.create_events()
+        # Collect the data of every triggered event
+        self.triggered = []
+        for kind in minestorm.server.parsing.KINDS:
+            minestorm.get('events').listen('server.output.{}'.format(kind), self.collect(kind))
+        self.server = self.create_server()
+
+    def collect(self, kind):
+        """ Create a listener collecting the events of a kind """
+        def listener(event):
+            self.triggered.append( ( kind, event.data ) )
+        return listener
+
+    def test_events(self):
+        """ Test the recognized lines trigger their event with the line details """
+        self.server._on_lines_printed([
+            '[12:00:00] [Server thread/INFO]: Steve opened the door',
+            '[12:00:01] [Server thread/INFO]: Steve joined the game',
+            '[12:00:02] [Server thread/INFO]: <Steve> hello',
+        ])
+        self.assertEqual( self.triggered, [
+            ( 'joined', { 'server': 'test', 'index': 1, 'line': '[12:00:01] [Server thread/INFO]: Steve joined the game', 'fields': { 'player': 'Steve', 'level': 'INFO' } } ),
+            ( 'chat', { 'server': 'test', 'index': 2, 'line': '[12:00:02] [Server thread/INFO]: <Steve> hello', 'fields': { 'player': 'Steve', 'message': 'hello', 'level': 'INFO' } } ),
+        ])
+
+    def test_players(self):
+        """ Test the online players are tracked from the joined and left lines """
+        self.server._on_lines_printed([
+            '[12:00:00] [Server thread/INFO]: Steve joined the game',
+            '[12:00:01] [Server thread/INFO]: Alex joined the game',
+            '[12:00:02] [Server thread/INFO]: Steve left the game',
+        ])
+        self.assertEqual( self.server.players, { 'Alex' } )
+        self.assertEqual( [ kind for kind, data in self.triggered ], [ 'joined', 'joined', 'left' ] )
+
+    def test_exception(self):
+        """ Test the exceptions are recognized with their message """
+        self.server._on_line_printed('java.lang.NullPointerException: oops')
+        kind, data = self.triggered[0]
+        self.assertEqual( kind, 'exception' )
+        self.assertEqual( data['fields']['exception'], 'java.lang.NullPointerException' )
+        self.assertEqual( data['fields']['message'], 'oops' )
+
+class FakeBulkServer:
+    """
+    Server which takes some time to start, tracking how many are starting
+    """
+    STATUS_STOPPED = 'STOPPED'
+    STATUS_CRASHED = 'CRASHED'
+
+    def __init__(self, test, name, type='vanilla'):
+        self.test = test
+        self.details = { 'name': name, 'type': type }
+        self.status = self.STATUS_STOPPED
+
+    def start(self):
+        with self.test.lock:
+            self.test.events.append(( 'start', self.details['name'] ))
+            self.test.running += 1
+            self.test.max_running = max(self.test.max_running, self.test.running)
+        time.sleep(0.05)
+        with self.test.lock:
+            self.test.running -= 1
+            self.test.events.append(( 'ready', self.details['name'] ))
+        if self.details['name'] == 'broken':
+            raise ValueError('Something went wrong')
+
+    def wait_ready(self, timeout):
+        return True
+
+class BulkTestCase( ServerTestCase ):
+    """
+    This class will test starting all the servers
+    """
+
+    def setUp(self):
+        super(BulkTestCase, self).setUp()
+        self.configure('servers.bulk_concurrency', 2)
+        self.manager = minestorm.server.servers.ServersManager()
+        self.addCleanup( setattr, self.manager.sampler_thread, 'stop', True )
+        self.lock = threading.Lock()
+        self.events = []
+        self.running = 0
+        self.max_running = 0
+        for name in ( 'a', 'b', 'broken', 'c' ):
+            self.manager.servers[name] = FakeBulkServer(self, name)
+        self.manager.servers['proxy'] = FakeBulkServer(self, 'proxy', 'bungeecord')
+
+    def test_start_all(self):
+        """ Test the servers are started in parallel, a group at time """
+        with self.assertLogs('minestorm.servers', 'ERROR'):
+            result = self.manager.start_all(wait=True)
+        self.assertEqual( self.max_running, 2 )
+        # Bungeecord is started after all the other servers are ready
+        self.assertEqual( self.events[-2:], [ ( 'start', 'proxy' ), ( 'ready', 'proxy' ) ] )
+        # An error is the outcome of its server only
+        outcomes = { name: details['result'] for name, details in result['servers'].items() }
+        self.assertEqual( outcomes, { 'a': 'ready', 'b': 'ready', 'broken': 'failed', 'c': 'ready', 'proxy': 'ready' } )
+        self.assertEqual( result['servers']['broken']['error'], 'Something went wrong' )
+
+class LifecycleTestCase( ServerTestCase ):
+    """
+    This class will test starting and stopping a real process
+    """
+
+    def setUp(self):
+        super(LifecycleTestCase, self).setUp()
+        # Lines recognized by the parser trigger events
+        self.bind('events', minestorm.common.events.EventsManager())
+        minestorm.server.parsing.create_events()
+        self.configure('servers.start_timeout', 5)
+        self.java = os.path.join(self.directory, 'java')
+        with open(self.java, 'w') as f:
+            f.write( FAKE_SERVER.format(python=sys.executable) )
+        os.chmod(self.java, 0o755)
+
+    def create_server(self, *flags):
+        """ Create a server started with some flags """
+        server = super(LifecycleTestCase, self).create_server(start_command={ 'java': self.java }, flags=list(flags))
+        server.statuses = []
+        change_status = server.change_status
+        def record(status, hide=False):
+            server.statuses.append(status)
+            change_status(status, hide)
+        server.change_status = record
+        self.addCleanup( self.kill, server )
+        return server
+
+    def kill(self, server):
+        """ Kill the process of a server, if it's still running """
+        process = server.process
+        if process is not None:
+            process.kill()
+            server.wait_stopped(5)
+
+    def test_ready(self):
+        """ Test the server is started when it prints it's ready """
+        server = self.create_server('--delay=0.2')
+        server.start()
+        self.assertEqual( server.status, server.STATUS_STARTING )
+        self.assertTrue( server.wait_ready(5) )
+        self.assertEqual( server.status, server.STATUS_STARTED )
+        self.assertEqual( server.startups.last()[-1]['result'], 'ready' )
+        self.assertEqual( server.startups.last()[-1]['reported'], 0.1 )
+        server.stop()
+        self.assertEqual( server.wait_or_kill(5), 'stopped' )
+        self.assertEqual( server.status, server.STATUS_STOPPED )
+        self.assertEqual( server.exit_code, 0 )
+
+    def test_start_timeout(self):
+        """ Test a server not ready in time is considered started """
+        self.configure('servers.start_timeout', 0.2)
+        server = self.create_server('--never-ready')
+        server.start()
+        self.assertFalse( server.wait_ready(1) )
+        self.assertEqual( server.status, server.STATUS_STARTED )
+        self.assertEqual( server.startups.last()[-1]['result'], 'timeout' )
+
+    def test_stop_while_starting(self):
+        """ Test a server getting ready while it's stopped isn't started again """
+        server = self.create_server('--delay=0.2')
+        server.start()
+        server.stop()
+        self.assertEqual( server.wait_or_kill(5), 'stopped' )
+        self.assertEqual( server.statuses[-3:], [ server.STATUS_STARTING, server.STATUS_STOPPING, server.STATUS_STOPPED ] )
+        self.assertEqual( server.exit_code, 0 )
+        self.assertEqual( server.startups.last()[-1]['result'], 'stopped' )
+
+    def test_crash(self):
+        """ Test a server exiting by itself is crashed """
+        server = self.create_server()
+        server.start()
+        self.assertTrue( server.wait_ready(5) )
+        server.process.kill()
+        self.assertTrue( server.wait_stopped(5) )
+        self.assertEqual( server.status, server.STATUS_CRASHED )
+
+    def test_stop_when_ready(self):
+        """ Test a server stopped just after it got ready stays stopping """
+        server = self.create_server()
+        # Stop the server while the start is being recorded, between the
+        # ready line and the change of the status
+        record = server.startups.record
+        def stop(entry):
+            record(entry)
+            server.stop()
+        server.startups.record = stop
+        server.start()
+        self.assertEqual( server.wait_or_kill(5), 'stopped' )
+        self.assertNotIn( server.STATUS_STARTED, server.statuses )
+        self.assertEqual( server.status, server.STATUS_STOPPED )
+
+    def test_no_shell(self):
+        """ Test the server is started without a shell in between """
+        server = self.create_server()
+        server.start()
+        self.assertTrue( server.wait_ready(5) )
+        self.assertEqual( server.process.args[0], self.java )
+        with open('/proc/{}/cmdline'.format(server.pid), 'rb') as f:
+            self.assertIn( self.java.encode('utf-8'), f.read().split(b'\0') )
+
+    def test_terminate(self):
+        """ Test a server ignoring the stop command is terminated """
+        self.configure('servers.kill_timeout', 2)
+        server = self.create_server('--stubborn')
+        server.start()
+        self.assertTrue( server.wait_ready(5) )
+        server.stop()
+        with self.assertLogs('minestorm', 'WARNING'):
+            self.assertEqual( server.wait_or_kill(0.2), 'terminated' )
+        self.assertEqual( server.status, server.STATUS_STOPPED )
+
+    def test_kill(self):
+        """ Test a server ignoring also SIGTERM is killed """
+        self.configure('servers.kill_timeout', 0.3)
+        server = self.create_server('--stubborn', '--ignore-term')
+        server.start()
+        self.assertTrue( server.wait_ready(5) )
+        server.stop()
+        with self.assertLogs('minestorm', 'WARNING') as logs:
+            self.assertEqual( server.wait_or_kill(0.2), 'killed' )
+        self.assertEqual( len(logs.output), 2 )
+        self.assertEqual( server.exit_code, -9 )
@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+import unittest
+import threading
+import time
+import minestorm.server.subscribers
+
+class SubscriberTestCase( unittest.TestCase ):
+    """
+    This class will test the subscribers to the output
+    """
+
+    def setUp(self):
+        self.received = []
+        self.gate = threading.Event()
+        self.subscribers = []
+
+    def tearDown(self):
+        self.gate.set()
+        for subscriber in self.subscribers:
+            subscriber.stop()
+
+    def subscriber(self, **options):
+        """ Create a subscriber which waits for the gate before receiving lines """
+        def method(server, line, index, tag):
+            self.gate.wait()
+            self.received.append( ( server, line, index, tag ) )
+        subscriber = minestorm.server.subscribers.Subscriber(method, { 'tag': 'x' }, index_name='index', **options)
+        self.subscribers.append(subscriber)
+        return subscriber
+
+    def wait_delivered(self, subscriber, count):
+        """ Wait until some lines are delivered """
+        for i in range(200):
+            if subscriber.delivered >= count:
+                return
+            time.sleep(0.01)
+        self.fail('Lines not delivered')
+
+    def test_delivery(self):
+        """ Test lines are delivered in order with their own arguments """
+        subscriber = self.subscriber()
+        self.gate.set()
+        subscriber.offer('srv', 5, [ 'a', 'b' ])
+        self.wait_delivered(subscriber, 2)
+        self.assertEqual( self.received, [ ( 'srv', 'a', 5, 'x' ), ( 'srv', 'b', 6, 'x' ) ] )
+        # The arguments of the subscriber aren't changed
+        self.assertEqual( subscriber.args, { 'tag': 'x' } )
+        self.assertIsNotNone( subscriber.stats()['lag'] )
+
+    def test_drop_oldest(self):
+        """ Test the oldest lines are dropped when the queue is full """
+        subscriber = self.subscriber(queue_size=3)
+        subscriber.offer('srv', 0, [ str(i) for i in range(10) ])
+        self.gate.set()
+        self.wait_delivered(subscriber, 3)
+        time.sleep(0.05)
+        stats = subscriber.stats()
+        # The worker may have taken a line before the queue filled up
+        self.assertEqual( stats['delivered'] + stats['dropped'], 10 )
+        self.assertEqual( [ line for server, line, index, tag in self.received[-3:] ], [ '7', '8', '9' ] )
+
+    def test_block(self):
+        """ Test the reader waits for the subscriber only up to the timeout """
+        subscriber = self.subscriber(policy='block', queue_size=2, block_timeout=0.1)
+        start = time.time()
+        subscriber.offer('srv', 0, [ str(i) for i in range(10) ])
+        self.assertLess( time.time() - start, 1 )
+        self.gate.set()
+        self.wait_delivered(subscriber, 2)
+        time.sleep(0.05)
+        stats = subscriber.stats()
+        self.assertTrue( stats['dropped'] > 0 )
+        self.assertEqual( stats['delivered'] + stats['dropped'], 10 )
+        # The newest lines are dropped
+        self.assertEqual( self.received[0][1], '0' )
+
+    def test_sample(self):
+        """ Test only some lines are kept when the queue is filling """
+        subscriber = self.subscriber(policy='sample', queue_size=10, sample_every=5)
+        subscriber.offer('srv', 0, [ str(i) for i in range(100) ])
+        stats = subscriber.stats()
+        self.assertTrue( stats['queued'] <= 10 )
+        self.assertTrue( stats['dropped'] >= 80 )
+
+    def test_idle(self):
+        """ Test the subscriber is notified while no line arrives """
+        idle = threading.Event()
+        subscriber = minestorm.server.subscribers.Subscriber(lambda server, line: None, on_idle=idle.set)
+        self.subscribers.append(subscriber)
+        self.assertTrue( idle.wait(5) )
+
+    def test_invalid_policy(self):
+        """ Test creating a subscriber with an invalid policy """
+        with self.assertRaises( RuntimeError ):
+            self.subscriber(policy='whatever')
+
+    def test_invalid_options(self):
+        """ Test creating a subscriber with invalid limits """
+        for options in ( { 'queue_size': 0 }, { 'sample_every': 0 }, { 'block_timeout': -1 } ):
+            with self.assertRaises( RuntimeError ):
+                self.subscriber(policy='sample', **options)
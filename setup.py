@@ -28,9 +28,11 @@ setuptools.setup(
         'Natural Language :: English',
         'Operative System :: POSIX :: Linux',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.2',
-        'Programming Language :: Python :: 3.3',
-        'Programming Language :: Python :: 3.4',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
         'Topic :: Utilities',
     ],
 
@@ -42,6 +44,8 @@ setuptools.setup(
         'minestorm.server',
         'minestorm.test',
         'minestorm.test.common',
+        'minestorm.test.console',
+        'minestorm.test.server',
     ],
     package_dir={
         'minestorm': 'minestorm',
@@ -59,6 +63,8 @@ setuptools.setup(
         'minestorm': ['_samples/*'],
     },
 
+    python_requires='>=3.7',
+
     install_requires=[
         # Nothing yet
     ],